@@ -0,0 +1,134 @@
+"""
+Prop ordering in flatten_data_table against the engine's algorithm
+
+reference_order is the engine's loop as it was ported before, it rescans
+from the front after every swap. Without a demo, random classes are ordered
+with both and have to come out the same. With a demo, the order of every
+class can be recorded and later runs checked against it:
+
+    python bench_flatten.py
+    python bench_flatten.py --demo match.dem --record order.json
+    python bench_flatten.py --demo match.dem --check order.json
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+from collections import namedtuple
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import demo_parse_test
+from demo_parse_test import FlattenedPropEntry, SPROP_CHANGES_OFTEN
+
+demo_parse_test.DEBUG = False
+
+SendProp = namedtuple('SendProp', ['var_name', 'priority', 'flags'])
+
+PRIORITIES = (0, 1, 64, 128, 128, 128, 128)  # most props are 128 in real tables
+
+
+def reference_order(flattened_props):
+    """the engine's ordering, in place"""
+    priorities = []
+    priorities.append(64)
+    for flattened_prop in flattened_props:
+        priority = flattened_prop.prop.priority
+        if priority not in priorities:
+            priorities.append(priority)
+    priorities.sort()
+
+    start = 0
+    for priority in priorities:
+        while True:
+            current_prop = start
+            while current_prop < len(flattened_props):
+                prop = flattened_props[current_prop].prop
+                sprop_flags = SPROP_CHANGES_OFTEN & prop.flags
+                if prop.priority == priority or (priority == 64 and sprop_flags):
+                    if start != current_prop:
+                        flattened_props[start], flattened_props[current_prop] = flattened_props[current_prop], flattened_props[start]
+                    start += 1
+                    break
+                current_prop += 1
+            if current_prop == len(flattened_props):
+                break
+
+
+def random_class(rand, size):
+    props = []
+    for i in range(size):
+        flags = SPROP_CHANGES_OFTEN if rand.random() < 0.1 else 0
+        props.append(FlattenedPropEntry(
+            SendProp('m_prop{}'.format(i), rand.choice(PRIORITIES), flags), None))
+    return props
+
+
+def timed(order, flattened_props):
+    flattened_props = list(flattened_props)
+    start = perf_counter()
+    order(flattened_props)
+    return [entry.prop.var_name for entry in flattened_props], perf_counter() - start
+
+
+def compare_random(classes, size, seed):
+    rand = random.Random(seed)
+    reference_time = new_time = 0.0
+    for _ in range(classes):
+        props = random_class(rand, size)
+        expected, seconds = timed(reference_order, props)
+        reference_time += seconds
+        names, seconds = timed(demo_parse_test.sort_props_by_priority, props)
+        new_time += seconds
+        if names != expected:
+            sys.exit('orders differ:\n{}\n{}'.format(expected, names))
+    print('{} classes of {} props, same order'.format(classes, size))
+    print('reference {:.3f}s, sort_props_by_priority {:.3f}s, {:.1f}x'.format(
+        reference_time, new_time, reference_time / new_time))
+
+
+def demo_orders(path):
+    """class name -> prop names in index order, for every class of a demo"""
+    import bench_parser
+    demo_parse_test.reset_state()
+    bench_parser.load_data_tables(bench_parser.load(path))
+    return {server_class.strName: [entry.prop.var_name
+                                   for entry in server_class.flattened_props]
+            for server_class in demo_parse_test.SERVER_CLASSES}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='flattened prop order check')
+    parser.add_argument('--classes', type=int, default=300)
+    parser.add_argument('--props', type=int, default=400, help='props per random class')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--demo', help='check the classes of a demo instead')
+    parser.add_argument('--record', metavar='JSON', help='write the order of every class')
+    parser.add_argument('--check', metavar='JSON', help='compare with a recorded order')
+    args = parser.parse_args(argv)
+
+    if args.demo is None:
+        compare_random(args.classes, args.props, args.seed)
+        return
+
+    orders = demo_orders(args.demo)
+    if args.record:
+        with open(args.record, 'w') as record_file:
+            json.dump(orders, record_file, indent=1)
+        print('recorded {} classes'.format(len(orders)))
+    if args.check:
+        with open(args.check) as record_file:
+            recorded = json.load(record_file)
+        differ = [name for name in recorded if orders.get(name) != recorded[name]]
+        for name in differ:
+            print('{} differs'.format(name))
+        print('{} of {} classes match'.format(len(recorded) - len(differ), len(recorded)))
+        if differ:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Float prop decoding, the engine's readers against the precomputed decoders
+
+Both read the same random bits for each encoding, the values have to come
+out the same and the time for each is reported:
+
+    python bench_floats.py
+"""
+
+import argparse
+import os
+import random
+import sys
+from collections import namedtuple
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import prop_decode
+from bit_reader import BitReader
+from prop_decode import (SPROP_COORD, SPROP_COORD_MP, SPROP_COORD_MP_LOWPRECISION,
+                         SPROP_COORD_MP_INTEGRAL, SPROP_NORMAL, SPROP_CELL_COORD,
+                         SPROP_CELL_COORD_LOWPRECISION, SPROP_CELL_COORD_INTEGRAL)
+
+VALUES = 100000
+
+SendProp = namedtuple('SendProp', ['type', 'flags', 'num_bits', 'low_value', 'high_value'])
+
+
+def float_prop(flags=0, num_bits=0, low_value=0.0, high_value=0.0):
+    return SendProp(prop_decode.DPT_Float, flags, num_bits, low_value, high_value)
+
+
+# name -> (prop, reference reader)
+ENCODINGS = {
+    'quantized 8': (float_prop(0, 8, 0.0, 360.0),),
+    'quantized 11': (float_prop(0, 11, -90.0, 90.0),),
+    'quantized 17': (float_prop(0, 17, -4096.0, 4096.0),),
+    'coord': (float_prop(SPROP_COORD), prop_decode.read_bit_coord),
+    'coord mp': (float_prop(SPROP_COORD_MP),
+                 lambda reader: prop_decode.read_bit_coord_mp(reader, False, False)),
+    'coord mp low': (float_prop(SPROP_COORD_MP_LOWPRECISION),
+                     lambda reader: prop_decode.read_bit_coord_mp(reader, False, True)),
+    'coord mp integral': (float_prop(SPROP_COORD_MP_INTEGRAL),
+                          lambda reader: prop_decode.read_bit_coord_mp(reader, True, False)),
+    'normal': (float_prop(SPROP_NORMAL), prop_decode.read_bit_normal),
+    'cell coord': (float_prop(SPROP_CELL_COORD, 9),
+                   lambda reader: prop_decode.read_bit_cell_coord(reader, 9, False, False)),
+    'cell coord low': (float_prop(SPROP_CELL_COORD_LOWPRECISION, 9),
+                       lambda reader: prop_decode.read_bit_cell_coord(reader, 9, False, True)),
+    'cell coord integral': (float_prop(SPROP_CELL_COORD_INTEGRAL, 9),
+                            lambda reader: prop_decode.read_bit_cell_coord(reader, 9, True, False)),
+}
+
+
+def read_values(read, buf, count):
+    """count values read with read, and the seconds it took"""
+    reader = BitReader(buf)
+    values = [None] * count
+    start = perf_counter()
+    for i in range(count):
+        values[i] = read(reader)
+    return values, perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='float prop decoding benchmark')
+    parser.add_argument('--values', type=int, default=VALUES)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rand = random.Random(args.seed)
+    # every encoding is at most 21 bits wide
+    buf = bytes(rand.getrandbits(8) for _ in range(args.values * 3 + 8))
+
+    print('{:<20} {:>10} {:>10} {:>8} {:>8}'.format('encoding', 'reference', 'precomp',
+                                                    'speedup', 'max diff'))
+    for name, (prop, *reference) in ENCODINGS.items():
+        read_reference = (reference[0] if reference else
+                          lambda reader: prop_decode.read_quantized_float(reader, prop))
+        expected, before = read_values(read_reference, buf, args.values)
+        values, after = read_values(prop_decode.float_decoder(prop), buf, args.values)
+        diff = max(abs(a - b) for a, b in zip(expected, values))
+        print('{:<20} {:>10.3f} {:>10.3f} {:>7.2f}x {:>8.2g}'.format(
+            name, before, after, before / after, diff))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Bytes per instance of the parser's record classes
+
+The "before" numbers come from copies of each class without __slots__,
+which is how they were defined before, and for the cmd info the old layout
+of six Vector/QAngle namedtuples per split_t is built as well:
+
+    python bench_memory.py
+"""
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import demo_parse_test
+from demo_parse_test import Vector, QAngle
+
+INSTANCES = 100000
+
+
+def without_slots(cls):
+    """copy of a slotted class that keeps its attributes in a __dict__"""
+    namespace = {name: value for name, value in vars(cls).items()
+                 if name not in cls.__slots__ and name != '__slots__'}
+    return type(cls.__name__, (), namespace)
+
+
+class EagerSplit():
+    """split_t the way it used to be, every vector built up front"""
+    def __init__(self, flags, values):
+        self.flags = flags
+        self.viewOrigin = Vector(*values[0:3])
+        self.viewAngles = QAngle(*values[3:6])
+        self.localViewAngles = QAngle(*values[6:9])
+        self.viewOrigin2 = Vector(*values[9:12])
+        self.viewAngles2 = QAngle(*values[12:15])
+        self.localViewAngles2 = QAngle(*values[15:18])
+
+
+class EagerCmdInfo():
+    """demo_cmd_info the way it used to be"""
+    def __init__(self, data_bytes):
+        values = demo_parse_test.CMD_INFO.unpack(data_bytes)
+        self.u = [EagerSplit(values[0], values[1:19]),
+                  EagerSplit(values[19], values[20:38])]
+
+
+CMD_INFO_BYTES = demo_parse_test.CMD_INFO.pack(0, *[float(i) for i in range(18)],
+                                               0, *[float(i) for i in range(18)])
+
+# name -> (class, constructor arguments)
+RECORDS = {'ServerClass': (demo_parse_test.ServerClass, ()),
+           'ExcludeEntry': (demo_parse_test.ExcludeEntry,
+                            ('m_vecOrigin', 'DT_BaseEntity', 'DT_CSPlayer')),
+           'FlattenedPropEntry': (demo_parse_test.FlattenedPropEntry, (None, None)),
+           'PlayerInfo': (demo_parse_test.PlayerInfo, ()),
+           'demo_cmd_info': (demo_parse_test.demo_cmd_info, (CMD_INFO_BYTES,))}
+
+BEFORE = {'demo_cmd_info': EagerCmdInfo}
+
+
+def bytes_per_instance(cls, args, count):
+    """memory allocated per instance while count of them are alive"""
+    instances = [None] * count
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        instances[i] = cls(*args)
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used / count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='record class memory benchmark')
+    parser.add_argument('--instances', type=int, default=INSTANCES)
+    args = parser.parse_args(argv)
+
+    print('{:<20} {:>10} {:>10} {:>8}'.format('class', 'before', 'after', 'saved'))
+    for name, (cls, cls_args) in RECORDS.items():
+        before = BEFORE.get(name) or without_slots(cls)
+        before_size = bytes_per_instance(before, cls_args, args.instances)
+        after_size = bytes_per_instance(cls, cls_args, args.instances)
+        print('{:<20} {:>10.0f} {:>10.0f} {:>7.0%}'.format(
+            name, before_size, after_size, 1 - after_size / before_size))
+
+if __name__ == '__main__':
+    main()
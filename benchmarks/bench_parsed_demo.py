@@ -0,0 +1,120 @@
+"""
+Saving and loading parsed demos against a full parse
+
+A synthetic demo (or --demo) is parsed end to end with DemoParser and
+written with parsed_demo.write. The container is loaded back with and
+without numpy, and every table has to hold what the parse produced: the
+sampled player tracks, the kill feed and its names, the phases and each
+game event type. Then the time to load the container and to read a column
+is printed:
+
+    python bench_parsed_demo.py
+    python bench_parsed_demo.py --ticks 20000     # 200k track rows
+"""
+
+import argparse
+import math
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import bench_parser
+import demo_parse_test
+import parsed_demo
+from demo_parser import DemoParser
+
+demo_parse_test.DEBUG = False
+
+
+def same(expected, column):
+    """compares a column with the values it was written from, NaN equals NaN"""
+    column = list(column)
+    if len(column) != len(expected):
+        return False
+    for value, got in zip(expected, column):
+        if isinstance(value, float) and math.isnan(value):
+            if not (isinstance(got, float) and math.isnan(got)):
+                return False
+        elif value != got:
+            return False
+    return True
+
+
+def expected_tables(header, records, feed, index, track_interval):
+    """table name -> columns, straight from the parse"""
+    by_type = parsed_demo.records_by_type(records)
+    tracks = parsed_demo.sample_tracks(by_type.get('tick', []), track_interval)
+    tables = {'players': parsed_demo.records_to_columns(by_type.get('player', [])),
+              'tracks': parsed_demo.records_to_columns(tracks),
+              'kills': parsed_demo.kill_columns(feed),
+              'weapons': {'name': list(feed.weapons)},
+              'kill_names': parsed_demo.kill_names(feed),
+              'phases': index.table()}
+    tables.update(parsed_demo.event_tables(by_type.get('game_event', [])))
+    return tables
+
+
+def check(path, tables):
+    """loads the container at path, exits on the first column that differs"""
+    with parsed_demo.ParsedDemo.load(path) as demo:
+        if set(demo.tables) != set(tables):
+            sys.exit('tables differ: {} and {}'.format(sorted(demo.tables), sorted(tables)))
+        for name, columns in tables.items():
+            table = demo.table(name)
+            for column_name, values in columns.items():
+                if not same(values, table[column_name]):
+                    sys.exit('{} {} differs'.format(name, column_name))
+    rows = sum(len(next(iter(columns.values()), [])) for columns in tables.values())
+    print('{} tables, {} rows, same as the parse ({})'.format(
+        len(tables), rows, 'numpy' if parsed_demo.numpy is not None else 'array'))
+
+
+def time_load(path):
+    start = perf_counter()
+    demo = parsed_demo.ParsedDemo.load(path)
+    loaded = perf_counter() - start
+    start = perf_counter()
+    demo.tracks['x']
+    column = perf_counter() - start
+    print('{} track rows: loaded in {:.2f}ms, x column read in {:.2f}ms'.format(
+        len(demo.tracks), loaded * 1000, column * 1000))
+    demo.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='checks and times parsed demo containers')
+    parser.add_argument('--demo', help='demo to use instead of a synthetic one')
+    parser.add_argument('--ticks', type=int, default=3000,
+                        help='length of the synthetic demo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--track-interval', type=int, default=parsed_demo.TRACK_INTERVAL,
+                        help='ticks between stored player positions')
+    args = parser.parse_args(argv)
+
+    path = args.demo or bench_parser.synthetic_path(args.ticks, args.seed)
+    container_path = os.path.join(tempfile.gettempdir(), 'bench_parsed_demo.parsed')
+
+    start = perf_counter()
+    everything = DemoParser().parse_everything(path)
+    parsed_demo.write(container_path, *everything, demo_parse_test.PARSER_VERSION,
+                      args.track_interval)
+    print('parsed and written in {:.3f}s, {} bytes'.format(perf_counter() - start,
+                                                          os.path.getsize(container_path)))
+
+    tables = expected_tables(*everything, args.track_interval)
+    check(container_path, tables)
+    numpy = parsed_demo.numpy
+    parsed_demo.numpy = None
+    try:
+        check(container_path, tables)
+    finally:
+        parsed_demo.numpy = numpy
+    time_load(container_path)
+    os.remove(container_path)
+
+if __name__ == '__main__':
+    main()
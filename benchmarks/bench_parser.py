@@ -0,0 +1,249 @@
+"""
+Parser benchmarks against a synthetic demo
+
+Each benchmark is run a few times over the same demo and the best time is
+reported as MB/s of demo data and ticks/s. Results can be saved as json and
+compared with a run from another commit:
+
+    python bench_parser.py --save before.json
+    (check out another commit)
+    python bench_parser.py --compare before.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+from bitstring import ConstBitStream
+
+import demo_parse_test
+import netmessages_public_pb2
+import prop_decode
+import synthetic_demo
+import wire
+
+demo_parse_test.DEBUG = False
+
+
+def synthetic_path(ticks, seed):
+    """a synthetic demo in the temp directory, written the first time it's asked for"""
+    # same parameters and generator version always give the same bytes,
+    # so runs are comparable
+    path = os.path.join(tempfile.gettempdir(),
+                        'synthetic_v{}_{}_{}.dem'.format(synthetic_demo.GENERATOR_VERSION,
+                                                         ticks, seed))
+    if not os.path.exists(path):
+        synthetic_demo.write_demo(path, ticks=ticks, seed=seed)
+    return path
+
+
+def load(path):
+    """reads the whole demo into memory so the timings don't include disk reads"""
+    with open(path, 'rb') as demo_file:
+        return ConstBitStream(bytes=demo_file.read())
+
+
+def packets(data_stream):
+    """yields the raw chunk of every packet frame, skipping everything else"""
+    data_stream.bytepos = synthetic_demo.HEADER_SIZE
+    while True:
+        cmd, tick, player_slot = demo_parse_test.read_cmd_header(data_stream)
+        if cmd in (synthetic_demo.DEM_SIGNON, synthetic_demo.DEM_PACKET):
+            demo_parse_test.read_cmd_info(data_stream)
+            demo_parse_test.read_sequence_info(data_stream)
+            size = demo_parse_test.read_int(data_stream)
+            yield tick, demo_parse_test.read_bytes(data_stream, size)
+        elif cmd == synthetic_demo.DEM_STOP:
+            return
+        elif cmd == 5:
+            demo_parse_test.read_user_cmd(data_stream)
+        elif cmd != synthetic_demo.DEM_SYNCTICK:
+            demo_parse_test.read_raw_data(data_stream)
+
+
+def messages(chunk):
+    """yields (cmd, payload) for every message in a packet chunk"""
+    chunk = memoryview(chunk)
+    for cmd, size, offset in wire.scan_messages(chunk):
+        yield cmd, chunk[offset:offset + size]
+
+
+def bench_frames(path):
+    """frame iteration, reads every frame without looking inside packets"""
+    data_stream = load(path)
+    ticks = 0
+    for tick, chunk in packets(data_stream):
+        ticks = tick
+    return ticks
+
+
+def bench_messages(path):
+    """frame iteration plus splitting packets into messages"""
+    data_stream = load(path)
+    ticks = 0
+    for tick, chunk in packets(data_stream):
+        ticks = tick
+        for cmd, payload in messages(chunk):
+            pass
+    return ticks
+
+
+def bench_events(path):
+    """decodes every wanted game event into a record, footsteps are dropped on the wire"""
+    demo_parse_test.reset_state()
+    data_stream = load(path)
+    wanted = demo_parse_test.WANTED_GAME_EVENT_IDS
+    ticks = 0
+    for tick, chunk in packets(data_stream):
+        ticks = tick
+        for cmd, payload in messages(chunk):
+            if cmd == 30:
+                msg = netmessages_public_pb2.CSVCMsg_GameEventList()
+                msg.ParseFromString(payload)
+                demo_parse_test.GAME_EVENT_LIST.MergeFrom(msg)
+                demo_parse_test.index_game_events()
+            elif cmd == 25:
+                eventid = wire.find_varint_field(payload, demo_parse_test.GAME_EVENT_ID_FIELD, 0)
+                if eventid not in wanted:
+                    continue
+                msg = netmessages_public_pb2.CSVCMsg_GameEvent()
+                msg.ParseFromString(payload)
+                descriptor = demo_parse_test.get_game_event_descriptor(msg)
+                demo_parse_test.game_event_record(msg, descriptor)
+    return ticks
+
+
+def load_data_tables(data_stream):
+    """parses the dem_datatables frame, the stream is left after it"""
+    data_stream.bytepos = synthetic_demo.HEADER_SIZE
+    while True:
+        cmd, tick, player_slot = demo_parse_test.read_cmd_header(data_stream)
+        if cmd == synthetic_demo.DEM_DATATABLES:
+            demo_parse_test.parse_data_table(demo_parse_test.read_raw_data(data_stream).bytes)
+            return
+        elif cmd in (synthetic_demo.DEM_SIGNON, synthetic_demo.DEM_PACKET):
+            demo_parse_test.read_cmd_info(data_stream)
+            demo_parse_test.read_sequence_info(data_stream)
+            demo_parse_test.read_raw_data(data_stream)
+        elif cmd != synthetic_demo.DEM_SYNCTICK:
+            demo_parse_test.read_raw_data(data_stream)
+
+
+def decode_entities(path):
+    data_stream = load(path)
+    load_data_tables(data_stream)
+    ticks = 0
+    for tick, chunk in packets(data_stream):
+        ticks = tick
+        for cmd, payload in messages(chunk):
+            if cmd == 26:
+                demo_parse_test.handle_svc_packet_entities(payload, len(payload), cmd)
+    return ticks
+
+
+def bench_entities(path):
+    """decodes every prop of every entity update"""
+    demo_parse_test.reset_state()
+    prop_decode.clear_subscriptions()
+    return decode_entities(path)
+
+
+def bench_props(path):
+    """entity updates with only the player positions subscribed, the rest is skipped"""
+    demo_parse_test.reset_state()
+    prop_decode.clear_subscriptions()
+    prop_decode.subscribe_props('CCSPlayer', ['m_vecOrigin', 'm_iTeamNum'])
+    try:
+        return decode_entities(path)
+    finally:
+        prop_decode.clear_subscriptions()
+
+
+BENCHMARKS = [('frames', bench_frames),
+              ('messages', bench_messages),
+              ('events', bench_events),
+              ('entities', bench_entities),
+              ('props', bench_props)]
+
+
+def run(path, repeat, selected=None):
+    """runs the benchmarks and returns their results keyed by name"""
+    size = os.path.getsize(path)
+    results = {}
+    for name, bench in BENCHMARKS:
+        if selected and name not in selected:
+            continue
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            ticks = bench(path)
+            elapsed = perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        results[name] = {'seconds': best,
+                         'mb_per_s': size / best / 1e6,
+                         'ticks_per_s': ticks / best}
+    return results
+
+
+def git_revision():
+    """commit being benchmarked, if there is one"""
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=HERE, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print('{:<12} {:>10} {:>10} {:>12} {:>9}'.format('benchmark', 'seconds',
+                                                     'MB/s', 'ticks/s', 'speedup'))
+    for name, result in results.items():
+        speedup = ''
+        if baseline and name in baseline:
+            speedup = '{:.2f}x'.format(baseline[name]['seconds'] / result['seconds'])
+        print('{:<12} {:>10.3f} {:>10.2f} {:>12.0f} {:>9}'.format(
+            name, result['seconds'], result['mb_per_s'], result['ticks_per_s'], speedup))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmarks the demo parser')
+    parser.add_argument('--demo', help='demo to use instead of a synthetic one')
+    parser.add_argument('--ticks', type=int, default=2000,
+                        help='length of the synthetic demo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--only', action='append', metavar='NAME',
+                        choices=[name for name, _ in BENCHMARKS])
+    parser.add_argument('--save', metavar='JSON', help='write the results to JSON')
+    parser.add_argument('--compare', metavar='JSON',
+                        help='show the speedup against results saved with --save')
+    args = parser.parse_args(argv)
+
+    path = args.demo or synthetic_path(args.ticks, args.seed)
+
+    results = run(path, args.repeat, args.only)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    print('{} ({} bytes) at {}'.format(path, os.path.getsize(path), git_revision()))
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as out_file:
+            json.dump({'revision': git_revision(),
+                       'demo': path,
+                       'size': os.path.getsize(path),
+                       'results': results}, out_file, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Entity state queries against the parser's own entity table
+
+A synthetic demo (or --demo) is decoded with an entity journal and the
+parser's live entity table is copied at a few ticks, around a snapshot and
+at the end. The journal is then opened with StateQuery and state_at has to
+give every copied table back. The journal keeps floats as float32s, so the
+live values are rounded the same way before they're compared. Then the
+time to open the journal and to answer random queries is printed:
+
+    python bench_state_query.py
+    python bench_state_query.py --demo match.dem --queries 500
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+import tempfile
+from time import perf_counter
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+
+import bench_parser
+import demo_parse_test
+import entity_journal
+import prop_decode
+from state_query import StateQuery
+
+demo_parse_test.DEBUG = False
+
+FLOAT32 = struct.Struct('<f')
+
+
+def float32(value):
+    return FLOAT32.unpack(FLOAT32.pack(value))[0]
+
+
+def stored(value):
+    """value the way the journal gives it back"""
+    if isinstance(value, float):
+        return float32(value)
+    if isinstance(value, tuple):
+        return tuple(float32(element) for element in value)
+    if isinstance(value, list):
+        return [stored(element) for element in value]
+    return value
+
+
+def journal_demo(path, journal_path, check_ticks, interval):
+    """
+    decodes the entities of the demo at path into a journal, returns the
+    live entity table at each of check_ticks as entity -> (class, props)
+    """
+    demo_parse_test.reset_state()
+    prop_decode.clear_subscriptions()
+    data_stream = bench_parser.load(path)
+    bench_parser.load_data_tables(data_stream)
+    journal = entity_journal.EntityJournal(journal_path, snapshot_interval=interval)
+    demo_parse_test.ENTITY_JOURNAL = journal
+    tables = {}
+    try:
+        for tick, chunk in bench_parser.packets(data_stream):
+            demo_parse_test.CURRENT_TICK = tick
+            for cmd, payload in bench_parser.messages(chunk):
+                if cmd == 26:
+                    demo_parse_test.handle_svc_packet_entities(payload, len(payload), cmd)
+            if tick in check_ticks:
+                tables[tick] = {index: (entity.u_class,
+                                        {prop: stored(value)
+                                         for prop, value in entity.props.items()})
+                                for index, entity in demo_parse_test.ENTITIES.items()}
+        journal.set_classes(demo_parse_test.journal_classes())
+    finally:
+        demo_parse_test.ENTITY_JOURNAL = None
+        journal.close()
+    return tables
+
+
+def check(query, tables):
+    """compares state_at with the copied tables, exits on the first difference"""
+    for tick, expected in sorted(tables.items()):
+        state = query.state_at(tick)
+        got = {entity: (entity_state.class_id, entity_state.props)
+               for entity, entity_state in state.items()}
+        if got != expected:
+            sys.exit('state_at({}) differs from the parser'.format(tick))
+        print('tick {}: {} entities, same as the parser'.format(tick, len(got)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='checks and times entity state queries')
+    parser.add_argument('--demo', help='demo to use instead of a synthetic one')
+    parser.add_argument('--ticks', type=int, default=3000,
+                        help='length of the synthetic demo')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--interval', type=int, default=entity_journal.SNAPSHOT_INTERVAL,
+                        help='ticks between journal snapshots')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    path = args.demo or bench_parser.synthetic_path(args.ticks, args.seed)
+    last_tick = demo_parse_test.get_demo_info(bench_parser.load(path)).ticks
+    interval = args.interval
+    check_ticks = {1, interval - 1, interval, interval + 1, last_tick // 2, last_tick}
+
+    journal_path = os.path.join(tempfile.gettempdir(), 'bench_state_query.journal')
+    start = perf_counter()
+    tables = journal_demo(path, journal_path, check_ticks, interval)
+    print('journal written in {:.3f}s, {} bytes'.format(perf_counter() - start,
+                                                         os.path.getsize(journal_path)))
+
+    start = perf_counter()
+    with StateQuery.open(journal_path) as query:
+        print('opened in {:.4f}s, {} snapshots'.format(perf_counter() - start,
+                                                       len(query.journal.snapshots)))
+        check(query, tables)
+
+        rand = random.Random(args.seed)
+        ticks = [rand.randint(1, last_tick) for _ in range(args.queries)]
+        start = perf_counter()
+        for tick in ticks:
+            query.state_at(tick)
+        elapsed = perf_counter() - start
+        print('{} random state_at queries, {:.2f}ms each'.format(
+            args.queries, elapsed / args.queries * 1000))
+    os.remove(journal_path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,522 @@
+"""
+Writes synthetic CSGO demos for benchmarking and for testing the parser
+without a real test.dem
+
+The output follows the layout of a real demo: the HL2DEMO header, a signon
+packet with the server info and game event list, the data tables, the
+string tables (with userinfo entries for every player) and then one packet
+per tick with a configurable mix of net messages. Packet entities are
+encoded the same way the engine does it against the generated data tables,
+so they can be decoded by a complete entity decoder. Like a real match, a
+player is replaced by a bot during warmup and another one leaves during the
+second round, so the player_connect and player_disconnect handling runs.
+
+usage: python synthetic_demo.py out.dem [--ticks N] [--seed N] ...
+"""
+
+import argparse
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
+
+import cstrike15_usermessages_public_pb2
+import netmessages_public_pb2
+
+# demo commands
+DEM_SIGNON = 1
+DEM_PACKET = 2
+DEM_SYNCTICK = 3
+DEM_DATATABLES = 6
+DEM_STOP = 7
+DEM_STRINGTABLES = 9
+
+# bumped whenever the bytes for the same options change, cached demos
+# are named after it. What changed:
+#   2  string table entries are bit packed null terminated strings
+#   3  players connect and disconnect
+GENERATOR_VERSION = 3
+
+HEADER_SIZE = 1072
+PLAYER_INFO_SIZE = 344
+
+# sendprop types and flags, see demo_parse_test
+DPT_Int = 0
+DPT_Float = 1
+DPT_Vector = 2
+SPROP_UNSIGNED = 1 << 0
+SPROP_NOSCALE = 1 << 2
+
+# game event key types
+KEY_STRING = 1
+KEY_FLOAT = 2
+KEY_LONG = 3
+KEY_SHORT = 4
+KEY_BYTE = 5
+KEY_BOOL = 6
+
+GAME_EVENTS = [('player_footstep', [('userid', KEY_SHORT)]),
+               ('weapon_fire', [('userid', KEY_SHORT),
+                                ('weapon', KEY_STRING),
+                                ('silenced', KEY_BOOL)]),
+               ('player_hurt', [('userid', KEY_SHORT),
+                                ('attacker', KEY_SHORT),
+                                ('health', KEY_BYTE),
+                                ('armor', KEY_BYTE),
+                                ('weapon', KEY_STRING),
+                                ('dmg_health', KEY_SHORT),
+                                ('dmg_armor', KEY_BYTE),
+                                ('hitgroup', KEY_BYTE)]),
+               ('player_death', [('userid', KEY_SHORT),
+                                 ('attacker', KEY_SHORT),
+                                 ('assister', KEY_SHORT),
+                                 ('weapon', KEY_STRING),
+                                 ('headshot', KEY_BOOL),
+                                 ('penetrated', KEY_SHORT)]),
+               ('round_announce_match_start', []),
+               ('round_start', [('timelimit', KEY_LONG),
+                                ('fraglimit', KEY_LONG),
+                                ('objective', KEY_STRING)]),
+               ('round_end', [('winner', KEY_BYTE),
+                              ('reason', KEY_BYTE),
+                              ('message', KEY_STRING)]),
+               ('round_officially_ended', []),
+               ('announce_phase_end', []),
+               ('cs_win_panel_match', []),
+               ('player_connect', [('name', KEY_STRING),
+                                   ('index', KEY_BYTE),
+                                   ('userid', KEY_SHORT),
+                                   ('networkid', KEY_STRING),
+                                   ('address', KEY_STRING)]),
+               ('player_disconnect', [('userid', KEY_SHORT),
+                                      ('reason', KEY_STRING),
+                                      ('name', KEY_STRING),
+                                      ('networkid', KEY_STRING)])]
+GAME_EVENT_IDS = dict((name, eventid) for eventid, (name, _) in enumerate(GAME_EVENTS))
+
+WEAPONS = ['ak47', 'm4a1', 'awp', 'deagle', 'usp_silencer', 'glock', 'knife']
+
+# message mix, average number of each per tick
+DEFAULT_MIX = {'player_footstep': 2.0,
+               'weapon_fire': 1.0,
+               'player_hurt': 0.2,
+               'player_death': 0.05,
+               'user_message': 0.05,
+               'voice_data': 0.5,
+               'sounds': 1.0,
+               'temp_entities': 0.5}
+
+
+class BitWriter():
+    """writes bits least significant first like the engine's bf_write"""
+    def __init__(self):
+        self.value = 0
+        self.bits = 0
+
+    def write_bits(self, value, n):
+        """writes the low n bits of value"""
+        self.value |= (value & ((1 << n) - 1)) << self.bits
+        self.bits += n
+
+    def write_bit(self, value):
+        self.write_bits(1 if value else 0, 1)
+
+    def write_byte(self, value):
+        self.write_bits(value, 8)
+
+    def write_word(self, value):
+        self.write_bits(value, 16)
+
+    def write_bytes(self, data):
+        for byte in data:
+            self.write_bits(byte, 8)
+
+    def write_string(self, string):
+        """null terminated string"""
+        self.write_bytes(string.encode('utf-8') + b'\x00')
+
+    def write_float(self, value):
+        self.write_bits(struct.unpack('<I', struct.pack('<f', value))[0], 32)
+
+    def write_ubit_var(self, value):
+        """inverse of read_ubit_var"""
+        if value < 16:
+            self.write_bits(value, 6)
+        elif value < 256:
+            self.write_bits((value & 15) | 16, 6)
+            self.write_bits(value >> 4, 4)
+        elif value < 4096:
+            self.write_bits((value & 15) | 32, 6)
+            self.write_bits(value >> 4, 8)
+        else:
+            self.write_bits((value & 15) | 48, 6)
+            self.write_bits(value >> 4, 28)
+
+    def write_field_index(self, index, last_index):
+        """writes a prop index in the 'new way' used by CSGO"""
+        if index == -1:
+            ret = 0xFFF
+        else:
+            ret = index - last_index - 1
+            if ret == 0:
+                self.write_bit(1)
+                return
+        self.write_bit(0)
+        if ret < 8:
+            self.write_bit(1)
+            self.write_bits(ret, 3)
+            return
+        self.write_bit(0)
+        if ret < 32:
+            self.write_bits(ret, 7)
+        elif ret < 128:
+            self.write_bits((ret & 31) | 32, 7)
+            self.write_bits(ret >> 5, 2)
+        elif ret < 512:
+            self.write_bits((ret & 31) | 64, 7)
+            self.write_bits(ret >> 5, 4)
+        else:
+            self.write_bits((ret & 31) | 96, 7)
+            self.write_bits(ret >> 5, 7)
+
+    def getvalue(self):
+        """bytes written so far, padded to a whole byte"""
+        return self.value.to_bytes((self.bits + 7) // 8, 'little')
+
+
+def varint(value):
+    """protobuf style varint32"""
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def net_message(cmd, msg):
+    """frames a message the way it is stored in a packet"""
+    data = msg.SerializeToString()
+    return varint(cmd) + varint(len(data)) + data
+
+
+def fixed_str(string, n):
+    """null padded string of n bytes"""
+    return string.encode('utf-8')[:n - 1].ljust(n, b'\x00')
+
+
+def player_props(extra_props):
+    """sendprops of the synthetic player class"""
+    props = [('m_vecOrigin', DPT_Vector, SPROP_NOSCALE, 0),
+             ('m_angEyeAngles[0]', DPT_Float, SPROP_NOSCALE, 0),
+             ('m_angEyeAngles[1]', DPT_Float, SPROP_NOSCALE, 0),
+             ('m_iHealth', DPT_Int, SPROP_UNSIGNED, 7),
+             ('m_iTeamNum', DPT_Int, SPROP_UNSIGNED, 6),
+             ('m_iAccount', DPT_Int, SPROP_UNSIGNED, 16)]
+    for i in range(extra_props):
+        if i % 2:
+            props.append(('m_flExtra{}'.format(i), DPT_Float, 0, 10))
+        else:
+            props.append(('m_iExtra{}'.format(i), DPT_Int, SPROP_UNSIGNED, 12))
+    return props
+
+
+class SyntheticDemo():
+    """builds the bytes of a synthetic demo"""
+    def __init__(self, ticks=6400, players=10, extra_props=40, mix=None,
+                 warmup_ticks=640, round_ticks=1280, seed=0):
+        self.ticks = ticks
+        self.players = players
+        self.props = player_props(extra_props)
+        self.mix = dict(DEFAULT_MIX if mix is None else mix)
+        self.warmup_ticks = warmup_ticks
+        self.round_ticks = round_ticks
+        self.random = random.Random(seed)
+        self.frames = 0
+        self.out = bytearray()
+
+    def header(self):
+        return struct.pack('<8sii260s260s260s260sfiii', b'HL2DEMO\x00', 4, 13753,
+                           fixed_str('synthetic', 260), fixed_str('GOTV Demo', 260),
+                           fixed_str('de_synthetic', 260), fixed_str('csgo', 260),
+                           self.ticks / 64.0, self.ticks, 0, 0)
+
+    def frame(self, cmd, tick, data=None):
+        """writes a frame header and the raw data that goes with it"""
+        self.frames += 1
+        self.out += struct.pack('<BiB', cmd, tick, 0)
+        if data is not None:
+            self.out += struct.pack('<i', len(data)) + data
+
+    def packet(self, cmd, tick, messages):
+        """writes a packet frame holding the framed messages"""
+        self.frames += 1
+        self.out += struct.pack('<BiB', cmd, tick, 0)
+        self.out += bytes(152)                  # democmdinfo_t
+        self.out += struct.pack('<ii', tick, tick)
+        chunk = b''.join(messages)
+        self.out += struct.pack('<i', len(chunk)) + chunk
+
+    def game_event_list(self):
+        msg = netmessages_public_pb2.CSVCMsg_GameEventList()
+        for eventid, (name, keys) in enumerate(GAME_EVENTS):
+            descriptor = msg.descriptors.add(eventid=eventid, name=name)
+            for key_name, key_type in keys:
+                descriptor.keys.add(type=key_type, name=key_name)
+        return msg
+
+    def game_event(self, event_name, **values):
+        """CSVCMsg_GameEvent with random values for the keys not given"""
+        eventid = GAME_EVENT_IDS[event_name]
+        msg = netmessages_public_pb2.CSVCMsg_GameEvent(eventid=eventid)
+        rand = self.random
+        for key_name, key_type in GAME_EVENTS[eventid][1]:
+            value = values.get(key_name)
+            key = msg.keys.add(type=key_type)
+            if key_type == KEY_STRING:
+                key.val_string = value if value is not None else rand.choice(WEAPONS)
+            elif key_type == KEY_FLOAT:
+                key.val_float = value if value is not None else rand.random()
+            elif key_type == KEY_LONG:
+                key.val_long = value if value is not None else rand.randint(0, 1000)
+            elif key_type == KEY_SHORT:
+                key.val_short = value if value is not None else rand.randint(2, self.players + 1)
+            elif key_type == KEY_BYTE:
+                key.val_byte = value if value is not None else rand.randint(0, 100)
+            elif key_type == KEY_BOOL:
+                key.val_bool = value if value is not None else rand.random() < 0.3
+        return net_message(25, msg)
+
+    def data_tables(self):
+        """dem_datatables: send tables followed by the server classes"""
+        table = netmessages_public_pb2.CSVCMsg_SendTable(net_table_name='DT_CSPlayer')
+        for name, prop_type, flags, num_bits in self.props:
+            table.props.add(type=prop_type, var_name=name, flags=flags,
+                            priority=128, num_bits=num_bits,
+                            low_value=0.0, high_value=360.0)
+        end = netmessages_public_pb2.CSVCMsg_SendTable(is_end=True)
+        writer = BitWriter()
+        writer.write_bytes(net_message(9, table))
+        writer.write_bytes(net_message(9, end))
+        writer.write_bits(1, 16)                # one server class
+        writer.write_bits(0, 16)
+        writer.write_string('CCSPlayer')
+        writer.write_string('DT_CSPlayer')
+        return writer.getvalue()
+
+    def player_info(self, index):
+        """binary player_info_t for a userinfo string table entry"""
+        data = struct.pack('<Q', 0) + struct.pack('>Q', 76561197960265728 + index)
+        data += fixed_str('player{}'.format(index), 128)
+        data += struct.pack('<i', index + 2)
+        data += fixed_str('STEAM_1:0:{}'.format(index), 33) + bytes(3)
+        data += struct.pack('<I', index) + fixed_str('', 128)
+        data += bytes(4 + 16 + 4) + struct.pack('<i', index)
+        assert len(data) == PLAYER_INFO_SIZE
+        return data
+
+    def string_tables(self):
+        """dem_stringtables with a userinfo table holding every player"""
+        writer = BitWriter()
+        writer.write_byte(1)
+        writer.write_string('userinfo')
+        writer.write_word(self.players)
+        for index in range(self.players):
+            writer.write_string(str(index))
+            writer.write_bit(1)
+            data = self.player_info(index)
+            writer.write_word(len(data))
+            writer.write_bytes(data)
+        writer.write_bit(0)     # no client side strings
+        return writer.getvalue()
+
+    def prop_value(self, writer, prop):
+        """writes a random value for a prop"""
+        name, prop_type, flags, num_bits = prop
+        rand = self.random
+        if prop_type == DPT_Int:
+            writer.write_bits(rand.getrandbits(num_bits), num_bits)
+        elif prop_type == DPT_Float and flags & SPROP_NOSCALE:
+            writer.write_float(rand.uniform(-180, 180))
+        elif prop_type == DPT_Float:
+            writer.write_bits(rand.getrandbits(num_bits), num_bits)
+        else:
+            for _ in range(3):
+                writer.write_float(rand.uniform(-4096, 4096))
+
+    def packet_entities(self, full_update):
+        """CSVCMsg_PacketEntities with every player entering or changing"""
+        writer = BitWriter()
+        for player in range(self.players):
+            # entity index is always the next one, starting at 1 like the
+            # players' entities do
+            writer.write_ubit_var(0 if player else 1)
+            writer.write_bit(0)             # doesn't leave the pvs
+            writer.write_bit(full_update)   # enters the pvs on a full update
+            if full_update:
+                writer.write_bits(0, 1)     # server class, one class needs one bit
+                writer.write_bits(self.random.getrandbits(10), 10)
+                changed = list(range(len(self.props)))
+            else:
+                count = self.random.randint(1, len(self.props))
+                changed = sorted(self.random.sample(range(len(self.props)), count))
+            writer.write_bit(1)             # new way field indices
+            last_index = -1
+            for index in changed:
+                writer.write_field_index(index, last_index)
+                last_index = index
+            writer.write_field_index(-1, last_index)
+            for index in changed:
+                self.prop_value(writer, self.props[index])
+        msg = netmessages_public_pb2.CSVCMsg_PacketEntities(
+            max_entries=self.players + 1, updated_entries=self.players,
+            is_delta=not full_update, entity_data=writer.getvalue())
+        return net_message(26, msg)
+
+    def random_messages(self, name):
+        """messages for one kind in the mix, the count is random around the mix value"""
+        average = self.mix.get(name, 0)
+        count = int(average) + (self.random.random() < average - int(average))
+        rand = self.random
+        messages = []
+        for _ in range(count):
+            if name in GAME_EVENT_IDS:
+                messages.append(self.game_event(name))
+            elif name == 'user_message':
+                say = cstrike15_usermessages_public_pb2.CCSUsrMsg_SayText2(
+                    ent_idx=rand.randint(1, self.players), chat=True,
+                    msg_name='Cstrike_Chat_All', params=['player', 'gg'])
+                msg = netmessages_public_pb2.CSVCMsg_UserMessage(
+                    msg_type=6, msg_data=say.SerializeToString())
+                messages.append(net_message(23, msg))
+            elif name == 'voice_data':
+                msg = netmessages_public_pb2.CSVCMsg_VoiceData(
+                    client=rand.randint(0, self.players - 1),
+                    voice_data=bytes(rand.getrandbits(8) for _ in range(rand.randint(64, 512))))
+                messages.append(net_message(15, msg))
+            elif name == 'sounds':
+                msg = netmessages_public_pb2.CSVCMsg_Sounds()
+                for _ in range(rand.randint(1, 4)):
+                    msg.sounds.add(origin_x=rand.randint(-4096, 4096),
+                                   origin_y=rand.randint(-4096, 4096),
+                                   origin_z=rand.randint(-512, 512),
+                                   sound_num=rand.randint(0, 2000))
+                messages.append(net_message(17, msg))
+            elif name == 'temp_entities':
+                msg = netmessages_public_pb2.CSVCMsg_TempEntities(
+                    num_entries=1,
+                    entity_data=bytes(rand.getrandbits(8) for _ in range(rand.randint(8, 64))))
+                messages.append(net_message(27, msg))
+        return messages
+
+    def phase_events(self, tick):
+        """round and match phase events that happen on this tick"""
+        events = []
+        if tick == self.warmup_ticks:
+            events.append(self.game_event('round_announce_match_start'))
+        if tick >= self.warmup_ticks and self.round_ticks:
+            offset = (tick - self.warmup_ticks) % self.round_ticks
+            round_number = (tick - self.warmup_ticks) // self.round_ticks
+            if offset == 0:
+                events.append(self.game_event('round_start', objective='BOMB TARGET'))
+            elif offset == self.round_ticks - 64:
+                events.append(self.game_event('round_end', winner=2 + round_number % 2))
+            elif offset == self.round_ticks - 1:
+                events.append(self.game_event('round_officially_ended'))
+                if round_number == 14:
+                    events.append(self.game_event('announce_phase_end'))
+        return events
+
+    def connect_events(self, tick):
+        """
+        the last player is replaced by a bot halfway through warmup, and the
+        first player leaves halfway through the second round
+        """
+        events = []
+        last = self.players - 1
+        if tick == self.warmup_ticks // 2:
+            events.append(self.game_event('player_disconnect', userid=last + 2,
+                                          reason='Kicked by Console',
+                                          name='player{}'.format(last),
+                                          networkid='STEAM_1:0:{}'.format(last)))
+            events.append(self.game_event('player_connect', name='BOT Zed', index=last,
+                                          userid=self.players + 2, networkid='BOT',
+                                          address=''))
+        elif tick == self.warmup_ticks + self.round_ticks + self.round_ticks // 2:
+            events.append(self.game_event('player_disconnect', userid=2, reason='Disconnect',
+                                          name='player0', networkid='STEAM_1:0:0'))
+        return events
+
+    def build(self):
+        """the whole demo as bytes"""
+        self.out = bytearray(self.header())
+        server_info = netmessages_public_pb2.CSVCMsg_ServerInfo(
+            protocol=13753, max_clients=self.players, max_classes=1,
+            tick_interval=1 / 64.0, game_dir='csgo', map_name='de_synthetic')
+        self.packet(DEM_SIGNON, 0, [net_message(8, server_info),
+                                    net_message(30, self.game_event_list())])
+        self.frame(DEM_DATATABLES, 0, self.data_tables())
+        self.frame(DEM_STRINGTABLES, 0, self.string_tables())
+        self.frame(DEM_SYNCTICK, 0)
+
+        mix_names = sorted(self.mix)
+        for tick in range(1, self.ticks + 1):
+            messages = [net_message(4, netmessages_public_pb2.CNETMsg_Tick(tick=tick))]
+            messages.append(self.packet_entities(tick == 1))
+            messages.extend(self.phase_events(tick))
+            messages.extend(self.connect_events(tick))
+            for name in mix_names:
+                messages.extend(self.random_messages(name))
+            self.packet(DEM_PACKET, tick, messages)
+
+        self.frame(DEM_STOP, self.ticks)
+        # the frame count in the header is only known at the end
+        struct.pack_into('<i', self.out, HEADER_SIZE - 8, self.frames)
+        return bytes(self.out)
+
+
+def write_demo(path, **options):
+    """writes a synthetic demo to path, options go to SyntheticDemo"""
+    data = SyntheticDemo(**options).build()
+    with open(path, 'wb') as demo_file:
+        demo_file.write(data)
+    return len(data)
+
+
+def parse_mix(values):
+    """turns name=count pairs from the command line into a message mix"""
+    mix = dict(DEFAULT_MIX)
+    for value in values or []:
+        name, _, count = value.partition('=')
+        if name not in mix:
+            raise ValueError('unknown message type {}'.format(name))
+        mix[name] = float(count)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='writes a synthetic demo')
+    parser.add_argument('path')
+    parser.add_argument('--ticks', type=int, default=6400)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--extra-props', type=int, default=40,
+                        help='props on the player class besides the usual ones')
+    parser.add_argument('--mix', action='append', metavar='NAME=COUNT',
+                        help='average count per tick of a message type, one of: '
+                             + ', '.join(sorted(DEFAULT_MIX)))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    size = write_demo(args.path, ticks=args.ticks, players=args.players,
+                      extra_props=args.extra_props, mix=parse_mix(args.mix),
+                      seed=args.seed)
+    print('wrote {} ({} bytes)'.format(args.path, size))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+asyncio interface to the parser
+
+    async for record_type, record in parse_async('match.dem'):
+        ...
+
+The file is read in a worker thread and decoding runs in an executor, so
+the event loop is never blocked. The records of every frame go through an
+unbounded asyncio.Queue as soon as the frame is decoded.
+
+Parser state lives in module globals, so decodes in thread executors are
+serialized with demo_parser.PARSE_LOCK. The decoding thread never waits on
+a consumer while it holds the lock: a consumer that falls behind only lets
+its own demo's records pile up in its queue, and the other demos keep
+decoding. A ProcessPoolExecutor decodes demos in parallel, but then the
+records of a demo arrive all at once when it is done instead of streaming.
+"""
+
+import asyncio
+import concurrent.futures
+import threading
+
+import demo_parser
+
+_END = object()
+_DEFAULT_EXECUTOR = None
+
+
+class DecodeCancelled(Exception):
+    """raised inside the decoding thread when the consumer went away"""
+
+
+def default_executor():
+    """
+    single thread executor shared by every parse_async call, more threads
+    would only wait on PARSE_LOCK
+    """
+    global _DEFAULT_EXECUTOR
+    if _DEFAULT_EXECUTOR is None:
+        _DEFAULT_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='demoparse')
+    return _DEFAULT_EXECUTOR
+
+
+def read_source(source):
+    """bytes of a path or a binary file object"""
+    if hasattr(source, 'read'):
+        return source.read()
+    with open(source, 'rb') as demo_file:
+        return demo_file.read()
+
+
+def decode_into(data, path, put, cancelled=None):
+    """
+    parses data in the calling thread, handing the records of every frame
+    to put as a list. put must not block, PARSE_LOCK is held meanwhile.
+    Stops with DecodeCancelled once cancelled (a threading.Event) is set.
+    """
+    with demo_parser.PARSE_LOCK:
+        parser = demo_parser.DemoParser()
+        for records in parser.iter_bytes(data, path):
+            if cancelled is not None and cancelled.is_set():
+                raise DecodeCancelled()
+            put(records)
+
+
+def parse_records(data, path):
+    """parses data and returns all of its records, for process executors"""
+    records = []
+    decode_into(data, path, records.extend)
+    return records
+
+
+async def parse_async(source, executor=None):
+    """
+    async generator of (record_type, record) for the demo in source, which
+    can be a path, a binary file object or the bytes of a demo
+    """
+    loop = asyncio.get_running_loop()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        data = bytes(source)
+        path = '<memory>'
+    else:
+        data = await asyncio.to_thread(read_source, source)
+        path = getattr(source, 'name', source)
+        if not isinstance(path, str):
+            path = '<file>'
+
+    if isinstance(executor, concurrent.futures.ProcessPoolExecutor):
+        for record in await loop.run_in_executor(executor, parse_records, data, path):
+            yield record
+        return
+
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item):
+        """called from the decoding thread, never waits on the consumer"""
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    def decode():
+        try:
+            decode_into(data, path, put, cancelled)
+        finally:
+            put(_END)
+
+    future = loop.run_in_executor(executor or default_executor(), decode)
+    try:
+        while True:
+            records = await queue.get()
+            if records is _END:
+                break
+            for record in records:
+                yield record
+        await future
+    finally:
+        if not future.done():
+            # the consumer stopped early, the decoding thread stops at the
+            # next frame instead of decoding the rest of the demo for nobody
+            cancelled.set()
+            future.add_done_callback(lambda done: done.exception())
@@ -0,0 +1,122 @@
+"""
+Bit reader for the engine's bit packed data (entity updates, string tables)
+
+Bits are read least significant first like the engine's CBitRead, which
+isn't how bitstring reads them. The reader works on bytes or a memoryview
+without copying: every read unpacks the 8 bytes around the cursor and
+shifts the wanted bits out of them.
+"""
+
+import struct
+
+WORD = struct.Struct('<Q')
+FLOAT = struct.Struct('<f')
+MAX_READ_BITS = 57      # the most bits that always fit in one 8 byte window
+
+
+class BitReader():
+    """reads bits from buf starting at bit pos, least significant bit first"""
+    __slots__ = ('buf', 'pos', 'size', 'bits')
+
+    def __init__(self, buf, pos=0):
+        self.buf = buf
+        self.pos = pos
+        self.size = len(buf)
+        self.bits = self.size * 8
+
+    def bits_left(self):
+        return self.bits - self.pos
+
+    def seek(self, pos):
+        self.pos = pos
+
+    def skip(self, count):
+        """moves the cursor count bits ahead without reading them"""
+        self.pos += count
+        if self.pos > self.bits:
+            raise EOFError('skipped past the end of the buffer')
+
+    def read_bits(self, count):
+        """reads an unsigned number of count bits"""
+        pos = self.pos
+        end = pos + count
+        if end > self.bits:
+            raise EOFError('read past the end of the buffer')
+        if count > MAX_READ_BITS:
+            low = self.read_bits(32)
+            return low | (self.read_bits(count - 32) << 32)
+        byte = pos >> 3
+        if byte + 8 <= self.size:
+            word = WORD.unpack_from(self.buf, byte)[0]
+        else:
+            word = int.from_bytes(self.buf[byte:byte + 8], 'little')
+        self.pos = end
+        return (word >> (pos & 7)) & ((1 << count) - 1)
+
+    read_ubit_long = read_bits
+
+    def read_bit(self):
+        pos = self.pos
+        if pos >= self.bits:
+            raise EOFError('read past the end of the buffer')
+        self.pos = pos + 1
+        return (self.buf[pos >> 3] >> (pos & 7)) & 1
+
+    def read_signed(self, count):
+        """reads a two's complement number of count bits"""
+        value = self.read_bits(count)
+        if value & (1 << (count - 1)):
+            value -= 1 << count
+        return value
+
+    def read_ubit_var(self):
+        """reads the engine's UBitVar, 6 bits with 4, 8 or 28 more after them"""
+        ret = self.read_bits(6)
+        extra = ret & (16 | 32)
+        if extra == 16:
+            ret = (ret & 15) | (self.read_bits(4) << 4)
+        elif extra == 32:
+            ret = (ret & 15) | (self.read_bits(8) << 4)
+        elif extra == 48:
+            ret = (ret & 15) | (self.read_bits(32 - 4) << 4)
+        return ret
+
+    def read_var_int32(self):
+        """reads a protobuf style varint that was written into the bits"""
+        result = 0
+        for shift in range(0, 35, 7):
+            byte = self.read_bits(8)
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                break
+        return result & 0xffffffff
+
+    def read_signed_var_int32(self):
+        """reads a zigzag encoded varint"""
+        value = self.read_var_int32()
+        return (value >> 1) ^ -(value & 1)
+
+    def read_float(self):
+        """reads a 32 bit ieee float"""
+        return FLOAT.unpack(self.read_bits(32).to_bytes(4, 'little'))[0]
+
+    def read_bytes(self, count):
+        """
+        reads count bytes as bytes, a single slice copy when the cursor is
+        byte aligned and a byte at a time when it isn't
+        """
+        if not self.pos & 7:
+            start = self.pos >> 3
+            self.skip(count * 8)
+            return bytes(self.buf[start:start + count])
+        return bytes(self.read_bits(8) for _ in range(count))
+
+    def read_string(self, max_length):
+        """reads a null terminated string of at most max_length bytes"""
+        chars = bytearray()
+        for _ in range(max_length):
+            char = self.read_bits(8)
+            if not char:
+                break
+            chars.append(char)
+        return chars.decode('utf-8', 'replace')
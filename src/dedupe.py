@@ -0,0 +1,97 @@
+"""
+Finds demos that were received more than once under different names
+
+    demoparse dedupe incoming/ more.dem
+
+Files are only compared when their sizes match. Files of the same size get
+a quick hash of the header plus a few evenly spaced samples, and only the
+ones whose quick hashes collide are hashed in full. Hashing runs on a
+thread pool since hashlib and file reads both let go of the GIL.
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+from collections import defaultdict
+
+from result_cache import file_digest
+
+HEADER_SIZE = 1072
+QUICK_SAMPLES = 16              # samples read besides the header
+QUICK_SAMPLE_SIZE = 64 * 1024   # bytes per sample
+DEDUPE_WORKERS = 8
+
+
+def quick_digest(path, samples=QUICK_SAMPLES, sample_size=QUICK_SAMPLE_SIZE):
+    """hash of the size, header and samples spread over the file"""
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode('ascii'))
+    with open(path, 'rb') as demo_file:
+        digest.update(demo_file.read(HEADER_SIZE))
+        if size > HEADER_SIZE:
+            step = max((size - HEADER_SIZE) // samples, 1)
+            for offset in range(HEADER_SIZE, size, step):
+                demo_file.seek(offset)
+                digest.update(demo_file.read(sample_size))
+    return digest.hexdigest()
+
+
+def group_by(paths, key, executor):
+    """groups paths by key(path), dropping groups with only one path"""
+    groups = defaultdict(list)
+    for path, value in zip(paths, executor.map(key, paths)):
+        groups[value].append(path)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def find_duplicates(paths, quick=True, workers=DEDUPE_WORKERS):
+    """lists of paths whose contents are identical, each sorted"""
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        candidates = group_by(list(paths), os.path.getsize, executor)
+        if quick:
+            candidates = [narrowed for group in candidates
+                          for narrowed in group_by(group, quick_digest, executor)]
+        duplicates = [sorted(narrowed) for group in candidates
+                      for narrowed in group_by(group, file_digest, executor)]
+    return sorted(duplicates)
+
+
+def demo_paths(paths):
+    """files given directly, plus every .dem under directories"""
+    found = []
+    for path in paths:
+        if not os.path.isdir(path):
+            found.append(path)
+            continue
+        for root, _, names in os.walk(path):
+            found.extend(os.path.join(root, name) for name in names
+                         if name.endswith('.dem'))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='demoparse dedupe',
+                                     description='finds duplicate demos')
+    parser.add_argument('paths', nargs='+', help='demos or directories of demos')
+    parser.add_argument('--no-quick', action='store_true',
+                        help='hash whole files without the sampled pre-check')
+    parser.add_argument('--workers', type=int, default=DEDUPE_WORKERS)
+    parser.add_argument('--json', action='store_true',
+                        help='print the groups as a json list of lists')
+    args = parser.parse_args(argv)
+
+    groups = find_duplicates(demo_paths(args.paths), not args.no_quick, args.workers)
+    if args.json:
+        print(json.dumps(groups))
+        return
+    for group in groups:
+        print('duplicates:')
+        for path in group:
+            print('    {}'.format(path))
+    print('{} duplicate groups'.format(len(groups)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
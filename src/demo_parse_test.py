@@ -8,26 +8,57 @@ TODO: Move stuff around to make it behave like python
 TODO: Look into using `construct` module instead of bitstring
 """
 
+import argparse
+import importlib
 import socket
+import sys
+import struct
 from collections import namedtuple
+from time import perf_counter
 
 import cstrike15_usermessages_public_pb2
 import netmessages_public_pb2
+import output_sinks
+import prop_decode
+import wire
+from bit_reader import BitReader
 
 from bitstring import ConstBitStream
+from google.protobuf import text_format
 
 DEBUG = True
 
+# bump whenever the records that come out of a demo change, cached results
+# from older versions are ignored. What changed:
+#   2  string tables are read, player records are emitted
+#   3  player_connect and player_disconnect update PLAYER_INFOS
+#   4  those two are decoded in skipped warmup frames too
+#   5  kill feed names are kept after a player disconnects
+#   6  round chunks include their end tick
+#   7  user message records are decoded with the right class
+#   8  ignored game events still update players, phases and the kill feed
+#   9  players that connect get a player record
+#  10  kill records keep the ids of players that can't be looked up
+PARSER_VERSION = 10
+
+# profiling.Profiler that counts messages and time when it's set, see --profile
+PROFILER = None
+
 NET_MAX_PAYLOAD = 262144 - 4
 DEMO_BUFFER_SIZE = 2 * 1024 * 1024
 
 MAX_PLAYER_NAME_LENGTH = 128
+STEAM_ID_BASE = 76561197960265728     # xuid of steam account 0
 MAX_CUSTOM_FILES = 4
 SIGNED_GUID_LEN = 32
 
 ENTITY_SENTINEL = 9999
+MAX_EDICT_BITS = 11
+MAX_EDICTS = 1 << MAX_EDICT_BITS
 
 MAX_STRING_TABLES = 64  # can probably be deleted at some point
+STRING_TABLE_MAX_NAME = 256     # buffer sizes demoinfogo reads the strings into
+STRING_TABLE_MAX_STRING = 4096
 
 MAX_SPLITSCREEN_CLIENTS = 2
 
@@ -44,8 +75,9 @@ FHDR_ENTERPVS = 4
 
 SERVER_CLASSES = []     # list of ServerClass
 DATA_TABLES = []        # list of CSVCMsg_SendTable
+DATA_TABLE_INDEX = {}   # net_table_name -> index in DATA_TABLES
 CURRENT_EXCLUDES = []   # list of ExcludeEntry
-ENTITIES = []           # list of EntityEntry
+ENTITIES = {}           # entity index -> EntityEntry
 PLAYER_INFOS = []       # list of player_info
 
 STRING_TABLES = []      # list of StringTable
@@ -54,6 +86,12 @@ STRING_TABLES = []      # list of StringTable
 # TODO: make naming consistent
 DUMP_GAME_EVENTS = False
 DUMP_FOOTSTEP_EVENTS = False
+# names of game events that aren't output. They aren't decoded either, unless
+# the parser's own state needs them, see index_game_events
+IGNORED_GAME_EVENTS = set()
+# ids of the user messages that get decoded, None decodes all of them. The
+# others are dropped after reading msg_type, see user_message_id for names
+SUBSCRIBED_USER_MESSAGES = None
 SHOW_EXTRA_PLAYER_INFO_IN_GAME_EVENTS = False
 DUMP_DEATHS = False
 DUMP_WARMUP_DEATHS = False
@@ -61,10 +99,86 @@ DUMP_STRING_TABLES = False
 DUMP_DATA_TABLES = False
 DUMP_PACKET_ENTITIES = False
 DUMP_NET_MESSAGES = False
+DUMP_PLAYER_TRACKS = False      # only goes to OUTPUT_SINK, one row per player per packet
+
+# net message ids in SKIP_NET_MESSAGES are stepped over without being read,
+# BULKY_NET_MESSAGES are the big ones that nothing here uses
+BULKY_NET_MESSAGES = {netmessages_public_pb2.svc_VoiceData,
+                      netmessages_public_pb2.svc_Sounds,
+                      netmessages_public_pb2.svc_TempEntities,
+                      netmessages_public_pb2.svc_BSPDecal}
+SKIP_NET_MESSAGES = set()
+SKIPPED_BYTES = 0
+
+# frames with an offset in one of the [start, end) ranges in SKIP_FRAME_RANGES
+# only get the net messages in STATE_NET_MESSAGES decoded, the ones that
+# later frames depend on. Used with phases.PhaseIndex to step over warmup.
+SKIP_FRAME_RANGES = []
+STATE_NET_MESSAGES = {netmessages_public_pb2.svc_ServerInfo,
+                      netmessages_public_pb2.svc_SendTable,
+                      netmessages_public_pb2.svc_ClassInfo,
+                      netmessages_public_pb2.svc_CreateStringTable,
+                      netmessages_public_pb2.svc_UpdateStringTable,
+                      netmessages_public_pb2.svc_PacketEntities,
+                      netmessages_public_pb2.svc_GameEventList}
+# game events that change PLAYER_INFOS, they're decoded in state only frames
+# as well since the rest of the demo needs them
+STATE_GAME_EVENTS = ('player_connect', 'player_disconnect')
+# game events PHASE_INDEX and the match start check need
+PHASE_GAME_EVENTS = ('round_announce_match_start', 'round_start', 'round_officially_ended',
+                     'announce_phase_end', 'cs_win_panel_match')
+
+# structured output, OUTPUT_FORMAT is one of output_sinks.SINK_TYPES or None
+# to keep printing everything
+OUTPUT_FORMAT = None
+OUTPUT_DIR = 'output'
+OUTPUT_SINK = None
+
+# every game event goes to parquet files in PARQUET_DIR when it's set
+PARQUET_DIR = None
+EVENT_EXPORTER = None
+
+# kill_feed.KillFeed that every player_death gets recorded into when it's set
+KILL_FEED = None
+
+# phases.PhaseIndex that gets the warmup, halves and rounds when it's set
+PHASE_INDEX = None
+
+# entity_journal.EntityJournal that every entity change is written to when it's set
+ENTITY_JOURNAL = None
 
 # these shouldn't be globals, but there isn't a demo object yet
 GAME_EVENT_LIST = netmessages_public_pb2.CSVCMsg_GameEventList()
+GAME_EVENT_DESCRIPTORS = {}     # eventid -> descriptor from GAME_EVENT_LIST
+WANTED_GAME_EVENT_IDS = set()   # ids of the events that get decoded at all
+STATE_GAME_EVENT_IDS = set()    # ids of STATE_GAME_EVENTS
+GAME_EVENT_ID_FIELD = 2         # CSVCMsg_GameEvent.eventid
+
+USER_MESSAGE_TYPE_FIELD = 1     # CSVCMsg_UserMessage.msg_type
+USER_MESSAGE_DATA_FIELD = 2     # CSVCMsg_UserMessage.msg_data
+USER_MESSAGE_PREFIX = 'CS_UM_'
+# ECstrike15UserMessages value -> CCSUsrMsg_ class, and name without CS_UM_ -> value
+USER_MESSAGE_TYPES = {}
+USER_MESSAGE_IDS = {}
+for _name, _value in cstrike15_usermessages_public_pb2.ECstrike15UserMessages.items():
+    _short_name = _name[len(USER_MESSAGE_PREFIX):]
+    USER_MESSAGE_IDS[_short_name] = _value
+    if hasattr(cstrike15_usermessages_public_pb2, 'CCSUsrMsg_' + _short_name):
+        USER_MESSAGE_TYPES[_value] = getattr(cstrike15_usermessages_public_pb2,
+                                             'CCSUsrMsg_' + _short_name)
 MATCH_START_OCCURED = False
+CURRENT_TICK = 0
+CURRENT_FRAME_OFFSET = 0    # byte offset in the file of the frame being handled
+
+# attribute of CSVCMsg_GameEvent.key_t that holds the value for each key type
+GAME_EVENT_KEY_FIELDS = {1: 'val_string',
+                         2: 'val_float',
+                         3: 'val_long',
+                         4: 'val_short',
+                         5: 'val_byte',
+                         6: 'val_bool',
+                         7: 'val_uint64',
+                         8: 'val_wstring'}
 
 # these two seem to be the same thing, but they're differentiated in C++
 Vector = namedtuple('Vector', ['x', 'y', 'z'])
@@ -92,11 +206,18 @@ SPROP_INSIDEARRAY = 1 << 8      # property is inside array, shouldn't flatten
 SPROP_COLLAPSIBLE = 1 << 11     # in C++ is set if it's a database with an
                                 # offset of 0 that doesn't change the pointer
                                 # not sure what this does in python
+SPROP_CHANGES_OFTEN = 1 << 18   # sorted to the front with the priority 64 props
+# the rest of the flags are only needed for decoding, they're in prop_decode
 
 # TODO: rename class and methods to be more pythonic
 # TODO: evaluate moving to another file
+# the record classes below have __slots__, there are a lot of them and the
+# per instance __dict__ was most of their size
+
 class ServerClass():
     """data storage of something"""
+    __slots__ = ('nClassID', 'strName', 'strDTName', 'nDataTable', 'flattened_props')
+
     def __init__(self):
         """set the default values, allocate space for array"""
         self.nClassID = None
@@ -108,6 +229,8 @@ class ServerClass():
 
 class ExcludeEntry():
     """data storage for exclude entry"""
+    __slots__ = ('var_name', 'DTName', 'DTExcluding')
+
     def __init__(self, var_name, DTName, DTExcluding):
         """sets initial values"""
         self.var_name = var_name
@@ -116,11 +239,31 @@ class ExcludeEntry():
 
 class FlattenedPropEntry():
     """data storage for flattened properties"""
+    __slots__ = ('prop', 'array_element_prop')
+
     def __init__(self, prop, array_element_prop):
         """sets initial values"""
         self.prop = prop
         self.array_element_prop = array_element_prop
 
+class EntityEntry():
+    """an entity, its props are kept as prop index -> value"""
+    __slots__ = ('nEntity', 'u_class', 'u_serial_num', 'props')
+
+    def __init__(self, nEntity, u_class, u_serial_num):
+        self.nEntity = nEntity
+        self.u_class = u_class
+        self.u_serial_num = u_serial_num
+        self.props = {}
+
+    def find_prop(self, name):
+        """value of the prop called name, None if it hasn't been read"""
+        decoder = prop_decode.class_decoder(SERVER_CLASSES[self.u_class])
+        index = decoder.prop_indices.get(name)
+        if index is None:
+            return None
+        return self.props.get(index)
+
 class DemoInfo():
     """data storage for basic info about the demo contained in the header"""
     def __init__(self):
@@ -140,6 +283,10 @@ class DemoInfo():
 
 class PlayerInfo():
     """storage class for data about player"""
+    __slots__ = ('version', 'xuid', 'name', 'userID', 'guid', 'friendsID',
+                 'friendsName', 'fakeplayer', 'ishltv', 'custom_files',
+                 'files_downloaded', 'entityID')
+
     def __init__(self, data=None):
         """try to parse from raw data, probably won't work"""
         if data is None:
@@ -173,44 +320,62 @@ class PlayerInfo():
             pad_stream(data, n=24)
             self.entityID = read_int(data)
 
+SPLIT_T = struct.Struct('<i18f')     # flags and six vectors of three floats
+CMD_INFO = struct.Struct('<i18fi18f')   # two split_t, one per splitscreen player
+
 class split_t():
-    """data storage and parsing for a view angle"""
-    def __init__(self, data_bytes):
-        """parses bytes to view angles"""
-        self.flags = read_int(data_bytes)
-
-        # original origin/view angles
-        self.viewOrigin = Vector(read_float(data_bytes),
-                                 read_float(data_bytes),
-                                 read_float(data_bytes))
-        self.viewAngles = QAngle(read_float(data_bytes),
-                                 read_float(data_bytes),
-                                 read_float(data_bytes))
-        self.localViewAngles = QAngle(read_float(data_bytes),
-                                      read_float(data_bytes),
-                                      read_float(data_bytes))
-
-        # resampled origin/view angles
-        self.viewOrigin2 = Vector(read_float(data_bytes),
-                                  read_float(data_bytes),
-                                  read_float(data_bytes))
-        self.viewAngles2 = QAngle(read_float(data_bytes),
-                                  read_float(data_bytes),
-                                  read_float(data_bytes))
-        self.localViewAngles2 = QAngle(read_float(data_bytes),
-                                       read_float(data_bytes),
-                                       read_float(data_bytes))
+    """
+    view origin and angles for one player, the floats are kept in one tuple
+    and the Vectors/QAngles are only built when they are asked for
+    """
+    __slots__ = ('flags', 'values')
+
+    def __init__(self, flags, values):
+        """values are the 18 floats in file order"""
+        self.flags = flags
+        self.values = values
+
+    @classmethod
+    def from_bytes(cls, data_bytes):
+        values = SPLIT_T.unpack(data_bytes)
+        return cls(values[0], values[1:])
+
+    # original origin/view angles
+    @property
+    def viewOrigin(self):
+        return Vector(*self.values[0:3])
+
+    @property
+    def viewAngles(self):
+        return QAngle(*self.values[3:6])
+
+    @property
+    def localViewAngles(self):
+        return QAngle(*self.values[6:9])
+
+    # resampled origin/view angles
+    @property
+    def viewOrigin2(self):
+        return Vector(*self.values[9:12])
+
+    @property
+    def viewAngles2(self):
+        return QAngle(*self.values[12:15])
+
+    @property
+    def localViewAngles2(self):
+        return QAngle(*self.values[15:18])
 
 
 class demo_cmd_info():
     """data storage and parsing for a demo_cmd"""
+    __slots__ = ('u',)
+
     def __init__(self, data_bytes):
-        """takes in ConstBitStream and creates the demo_cmd_info class"""
-        self.u = []
-        split_t_data = ConstBitStream(read_bytes(data_bytes, 76))
-        self.u.append(split_t(split_t_data))
-        split_t_data = ConstBitStream(read_bytes(data_bytes, 76))
-        self.u.append(split_t(split_t_data))
+        """takes the 152 bytes of a demo_cmd_info, unpacks them all at once"""
+        values = CMD_INFO.unpack(data_bytes)
+        self.u = (split_t(values[0], values[1:19]),
+                  split_t(values[19], values[20:38]))
 
 def read_str(data_stream, n=260):
     """reads a string of n bytes, decodes it as utf-8 and strips null bytes"""
@@ -323,7 +488,7 @@ def read_raw_data(data_stream):
     """read a something (frame?) of bytes from the file"""
     size = read_int(data_stream)
 
-    return data_stream.read(size)
+    return data_stream.read(size * 8)
 
 def read_user_cmd(data_stream):
     """I don't think this is actually used to collect data"""
@@ -403,59 +568,60 @@ def read_cmd_header(data_stream):
 
 def read_cmd_info(data_stream):
     """gets data from from a cmd"""
-    demo_cmd_bytes = ConstBitStream(read_bytes(data_stream, 152))
-    return demo_cmd_info(demo_cmd_bytes)
+    return demo_cmd_info(read_bytes(data_stream, CMD_INFO.size))
+
+def read_from_buffer(data_bytes, pos):
+    """reads a varint size and that many bytes after it, returns (bytes, new pos)"""
+    size, pos = wire.read_varint(data_bytes, pos)
+    return data_bytes[pos:pos + size], pos + size
 
-def read_from_buffer(data_bytes):
-    """takes a bytesio file and reads a different something"""
-    table_size = read_varint32(data_bytes)
-    data_read = read_raw_data(data_stream)
-    return data_read
+def read_cstring(data_bytes, pos):
+    """reads a null terminated string, returns (string, new pos)"""
+    end = data_bytes.index(b'\0', pos)
+    return data_bytes[pos:end].decode('utf-8', 'replace'), end + 1
 
 def recv_table_read_infos(msg):
     """extracts data from the msg object, which is a CSVCMsg_SendTable()"""
     if DUMP_DATA_TABLES:
-        print('{}:{}'.format(msg.net_table_name(), msg.props_size()))
-        for iProp in range(msg.props_size()):
-            send_prop = msg.props(iProp)
-
-            exclude = send_prop.flags() & SPROP_EXCLUDE
-            flags_in_array = send_prop.flags() & SPROP_INSIDEARRAY
+        print('{}:{}'.format(msg.net_table_name, len(msg.props)))
+        for send_prop in msg.props:
+            exclude = send_prop.flags & SPROP_EXCLUDE
+            flags_in_array = send_prop.flags & SPROP_INSIDEARRAY
             in_array_str = ' inside array' if flags_in_array else ''
 
             # this uses send_prop.type() in c++
-            if send_prop.type() == SEND_PROP_TYPE.DPT_DataTable or exclude:
-                print('{}:{:6}:{}:{}{}'.format(send_prop.type(),
-                                               send_prop.flags(),
-                                               send_prop.var_name(),
-                                               send_prop.dt_name(),
+            if send_prop.type == SEND_PROP_TYPE.DPT_DataTable or exclude:
+                print('{}:{:6}:{}:{}{}'.format(send_prop.type,
+                                               send_prop.flags,
+                                               send_prop.var_name,
+                                               send_prop.dt_name,
                                                ' exclude' if exclude else ''))
-            elif send_prop.type() == SEND_PROP_TYPE.DPT_Array:
-                print('{}:{:6}:{}[{}]'.format(send_prop.type(),
-                                              send_prop.flags(),
-                                              send_prop.var_name(),
-                                              send_prop.num_elements()))
+            elif send_prop.type == SEND_PROP_TYPE.DPT_Array:
+                print('{}:{:6}:{}[{}]'.format(send_prop.type,
+                                              send_prop.flags,
+                                              send_prop.var_name,
+                                              send_prop.num_elements))
             else:
-                print('{}:{:6}:{}:{},{},{:8},{}'.format(send_prop.type(),
-                                                        send_prop.flags(),
-                                                        send_prop.var_name(),
-                                                        send_prop.low_value(),
-                                                        send_prop.high_value(),
-                                                        send_prop.num_bits(),
+                print('{}:{:6}:{}:{},{},{:8},{}'.format(send_prop.type,
+                                                        send_prop.flags,
+                                                        send_prop.var_name,
+                                                        send_prop.low_value,
+                                                        send_prop.high_value,
+                                                        send_prop.num_bits,
                                                         in_array_str))
 
 def get_table_by_name(name):
     """finds a table given a string name"""
-    for i in range(len(DATA_TABLES)):
-        if DATA_TABLES[i].net_table_name() == name:
-            return DATA_TABLES[i]
-    return None
+    index = DATA_TABLE_INDEX.get(name)
+    if index is None:
+        return None
+    return DATA_TABLES[index]
 
-def is_prop_included(pTable, send_prop):
-    """determines if prop is included??"""
-    for i in range(len(CURRENT_EXCLUDES)):
-        if (pTable.net_table_name() == CURRENT_EXCLUDES[i].DTName and
-                send_prop.var_name() == CURRENT_EXCLUDES[i].var_name):
+def is_prop_excluded(pTable, send_prop):
+    """determines if prop was excluded by one of CURRENT_EXCLUDES"""
+    for exclude in CURRENT_EXCLUDES:
+        if (pTable.net_table_name == exclude.DTName and
+                send_prop.var_name == exclude.var_name):
             return True
     return False
 
@@ -464,39 +630,37 @@ def gather_excludes(data_table):
     finds excludes for the particular data table
     not sure why this needs to be called seperately for each table
     """
-    for i in range(data_table.props_size()):
-        send_prop = data_table[i]   # may not work
-
-        if send_prop.flags() & SPROP_EXCLUDE:
-            CURRENT_EXCLUDES.append(ExcludeEntry(send_prop.var_name(),
-                                                 send_prop.dt_name(),
-                                                 data_table.net_table_name()))
-
-        if send_prop.type() == SEND_PROP_TYPE.DPT_DataTable:
-            sub_table = get_table_by_name(send_prop.dt_name())
+    for send_prop in data_table.props:
+        if send_prop.flags & SPROP_EXCLUDE:
+            CURRENT_EXCLUDES.append(ExcludeEntry(send_prop.var_name,
+                                                 send_prop.dt_name,
+                                                 data_table.net_table_name))
+
+        if send_prop.type == SEND_PROP_TYPE.DPT_DataTable:
+            sub_table = get_table_by_name(send_prop.dt_name)
             if sub_table is not None:
                 gather_excludes(sub_table)
 
 def gather_props_iterate_props(pTable, server_class, flattened_props):
     """iterates over something, part of gather_props"""
-    for i in range(pTable.props_size()):
-        send_prop = pTable[i]   # C++: pTable->props( iProp )
-        if (send_prop.flags() & SPROP_INSIDEARRAY or
-                send_prop.flags() & SPROP_EXCLUDE or
+    for i, send_prop in enumerate(pTable.props):
+        if (send_prop.flags & SPROP_INSIDEARRAY or
+                send_prop.flags & SPROP_EXCLUDE or
                 is_prop_excluded(pTable, send_prop)):
             continue
-        if send_prop.type() == SEND_PROP_TYPE.DPT_DataTable:
-            sub_table = get_table_by_name(send_prop.dt_name())
+        if send_prop.type == SEND_PROP_TYPE.DPT_DataTable:
+            sub_table = get_table_by_name(send_prop.dt_name)
 
             if sub_table is not None:
-                if send_prop.flags() & SPROP_COLLAPSIBLE:
+                if send_prop.flags & SPROP_COLLAPSIBLE:
                     gather_props_iterate_props(sub_table, server_class,
                                                flattened_props)
                 else:
                     gather_props(sub_table, server_class)
         else:
-            if send_prop.type() == SEND_PROP_TYPE.DPT_Array:
-                flattened_props.append(FlattenedPropEntry(send_prop, pTable[i-1]))
+            if send_prop.type == SEND_PROP_TYPE.DPT_Array:
+                # the element prop is the one right before the array
+                flattened_props.append(FlattenedPropEntry(send_prop, pTable.props[i-1]))
             else:
                 flattened_props.append(FlattenedPropEntry(send_prop, None))
 
@@ -512,87 +676,85 @@ def gather_props(pTable, server_class):
 
     #not sure what happens to flattened_props here
 
+def sort_props_by_priority(flattened_props):
+    """
+    puts the props in the order the server numbers them, in place. For each
+    priority from lowest to highest the matching props are swapped to the
+    front in one pass, props that change often count as priority 64.
+
+    The engine does the same swaps but starts its scan over after each one,
+    the swaps aren't stable so a plain sort would give different indices.
+    """
+    priorities = {64}
+    for flattened_prop in flattened_props:
+        priorities.add(flattened_prop.prop.priority)
+
+    start = 0
+    for priority in sorted(priorities):
+        for current_prop in range(start, len(flattened_props)):
+            prop = flattened_props[current_prop].prop
+            if prop.priority == priority or (priority == 64 and
+                                             prop.flags & SPROP_CHANGES_OFTEN):
+                if start != current_prop:
+                    flattened_props[start], flattened_props[current_prop] = \
+                        flattened_props[current_prop], flattened_props[start]
+                start += 1
+
 def flatten_data_table(server_class):
     """flattens a data table?"""
     table = DATA_TABLES[SERVER_CLASSES[server_class].nDataTable]
-    table.clear()      # TODO: make more pythonic
+    CURRENT_EXCLUDES.clear()
     gather_excludes(table)
 
     gather_props(table, server_class)
 
-    priorities = []
-    priorities.append(64)
-
-
-    for flattened_prop in flattened_props:
-        priority = flattened_prop.priority()
-
-        if priority not in priorities:
-            priorities.append(priority)
-
-    priorities.sort()
+    flattened_props = SERVER_CLASSES[server_class].flattened_props
+    sort_props_by_priority(flattened_props)
 
-    # sort flattened_props by property
-    start = 0
-    for priority in priorities:
-        while True:
-            current_prop = start
-            while current_prop < len(flattened_props):
-                prop = flattened_props[current_prop].prop   # maybe not .prop?
-                sprop_flags = SPROP_CHANGES_OFTEN & prop.flags()
-                if prop.priority() == priority or (priority == 64 and sprop_flags):
-                    if start != current_prop:
-                        flattened_props[start], flattened_props[current_prop] = flattened_props[current_prop], flattened_props[start]
-                    start += 1
-                    break
-                current_prop += 1
-            if current_prop == len(flattened_props):
-                break
+    prop_decode.precompute_floats(flattened_props)
 
 def parse_data_table(data_table_bytes):
-    """reads and parses a data table"""
-    msg = netmessages_public_pb2.CSVCMsg_SendTable()
+    """reads and parses a data table, data_table_bytes is the whole dem_datatables frame"""
+    global SERVER_CLASS_BITS
+    pos = 0
     while True:
-        data_type = read_varint32(data_table_bytes) # intentionally ignored
-        data_read = read_from_buffer(data_table_bytes)  #this may silently fail
-        
-        msg.ParseFromString(data_read)  # probably wrong, but is my best guess
-        # this is ParseFromArray in demofiledump.cpp but that doesn't seem to
-        # exist.
+        data_type, pos = wire.read_varint(data_table_bytes, pos)   # intentionally ignored
+        data_read, pos = read_from_buffer(data_table_bytes, pos)
 
-        if msg.is_end():
-            # not really sure how this is defined or how it works
+        msg = netmessages_public_pb2.CSVCMsg_SendTable()
+        msg.ParseFromString(data_read)
+        if msg.is_end:
             break
 
         recv_table_read_infos(msg)
 
+        DATA_TABLE_INDEX[msg.net_table_name] = len(DATA_TABLES)
         DATA_TABLES.append(msg)
 
-    server_classes = read_short(data_table_bytes)
+    server_classes, = struct.unpack_from('<h', data_table_bytes, pos)
+    pos += 2
 
     # c++ contains assert here, ignoring for now
 
     for i in range(server_classes):
         entry = ServerClass()
-        entry.nClassID = read_short(demo_file)
+        entry.nClassID, = struct.unpack_from('<h', data_table_bytes, pos)
+        pos += 2
 
         if (entry.nClassID >= server_classes):
             raise IndexError('invalid class index {}'.format(entry.nClassID))
-        read_str(entry.strName, len(entry.strName))
-        read_str(entry.strDTName, len(entry.strDTName))
+        entry.strName, pos = read_cstring(data_table_bytes, pos)
+        entry.strDTName, pos = read_cstring(data_table_bytes, pos)
 
         # ?? find the data table by name
-        entry.nDataTable = -1
-        for j in range(len(DATA_TABLES)):
-            if entry.strDTName == DATA_TABLES[j].net_table_name():
-                entry.nDataTable = j
-                break
+        entry.nDataTable = DATA_TABLE_INDEX.get(entry.strDTName, -1)
 
         if DUMP_DATA_TABLES:
             print('class:{}:{}:{}({})'.format(entry.nClassID,
                                               entry.strName,
                                               entry.strDTName,
                                               entry.nDataTable))
+        SERVER_CLASSES.append(entry)
     if DUMP_DATA_TABLES:
         print('Flattening data tables...')
 
@@ -602,14 +764,8 @@ def parse_data_table(data_table_bytes):
     if DUMP_DATA_TABLES:    # not sure what the point of this is
         print('Done')
 
-    temp = server_classes
-    SERVER_CLASS_BITS = 0
-    temp >>= 1
-    while temp:
-        temp >>= 1
-        SERVER_CLASS_BITS += 1
-    SERVER_CLASS_BITS += 1
-    return msg
+    SERVER_CLASS_BITS = server_classes.bit_length()
+    prop_decode.clear_compiled()
 
 def find_player_by_entity(entityID):
     """search through PLAYER_INFOS for an ID of entityID"""
@@ -618,9 +774,33 @@ def find_player_by_entity(entityID):
             return index
     return None
 
-def dump_string_table(data_table_bytes, is_user_info):
-    """parses an individual string table"""
-    numstrings = read_word(data_table_bytes)
+def player_info_record(player_info):
+    """turns a PlayerInfo into a record for an output sink"""
+    return {'tick': CURRENT_TICK,
+            'entity': player_info.entityID,
+            'userid': player_info.userID,
+            'xuid': player_info.xuid,
+            'name': player_info.name,
+            'guid': player_info.guid,
+            'friends_id': player_info.friendsID,
+            'fakeplayer': player_info.fakeplayer,
+            'ishltv': player_info.ishltv}
+
+def dump_string_entry(index, stringname, user_data_size=None):
+    """prints or emits a single entry of a string table"""
+    if OUTPUT_SINK is not None:
+        emit('string_table_entry', {'tick': CURRENT_TICK,
+                                    'index': index,
+                                    'name': stringname,
+                                    'user_data_size': user_data_size or 0})
+    elif user_data_size is None:
+        print(' {}, {}'.format(index, stringname))
+    else:
+        print(' {}, {}, userdata[{}]'.format(index, stringname, user_data_size))
+
+def dump_string_table(reader, is_user_info):
+    """parses an individual string table, reader is a BitReader over the frame"""
+    numstrings = reader.read_bits(16)
 
     if DUMP_STRING_TABLES:
         print(numstrings)
@@ -631,21 +811,22 @@ def dump_string_table(data_table_bytes, is_user_info):
         PLAYER_INFOS.clear()
 
     for i in range(numstrings):
-        stringname = read_str(data_table_bytes, n=4096)
-        assert(len(stringname) < 100)       # probably shouldn't be here
+        stringname = reader.read_string(STRING_TABLE_MAX_STRING)
 
-        if read_bit(data_table_bytes):
-            user_data_size = read_word(data_table_bytes)
+        if reader.read_bit():
+            user_data_size = reader.read_bits(16)
             assert(user_data_size > 0)
-            data = read_bytes(user_data_size)
+            data = reader.read_bytes(user_data_size)
 
             if is_user_info and data is not None:
-                player_info = PlayerInfo(data)
+                player_info = PlayerInfo(ConstBitStream(bytes=data))
                 player_info.entityID = i
 
                 existing = find_player_by_entity(i)
                 if existing is None:
-                    if DUMP_STRING_TABLES:
+                    if OUTPUT_SINK is not None:
+                        emit('player', player_info_record(player_info))
+                    elif DUMP_STRING_TABLES:
                         print('adding player entity {} info:'.format(i))
                         print('xuid:{}'.format(player_info.xuid))
                         print('name:{}'.format(player_info.name))
@@ -661,38 +842,42 @@ def dump_string_table(data_table_bytes, is_user_info):
                     PLAYER_INFOS[existing] = player_info
             else:
                 if DUMP_STRING_TABLES:
-                    print(' {}, {}, userdata[{}]'.format(i, stringname,
-                                                         user_data_size))
+                    dump_string_entry(i, stringname, user_data_size)
         else:
             if DUMP_STRING_TABLES:
-                print(' {}, {}'.format(i, stringname))
+                dump_string_entry(i, stringname)
 
-    if read_bit(data_table_bytes):
-        numstrings = read_word(data_table_bytes)
+    # client side strings
+    if reader.read_bit():
+        numstrings = reader.read_bits(16)
         for i in range(numstrings):
-            stringname = read_str(data_table_bytes, n=4096)
-            if read_bit(data_table_bytes):
-                user_data_size = read_word(data_table_bytes)
+            stringname = reader.read_string(STRING_TABLE_MAX_STRING)
+            if reader.read_bit():
+                user_data_size = reader.read_bits(16)
                 assert(user_data_size > 0)
 
-                data = read_bytes(data_table_bytes, n=user_data_size)
+                data = reader.read_bytes(user_data_size)
 
                 if i >= 2:
                     if DUMP_STRING_TABLES:
-                        print(' {}, {}, userdata[{}]'.format(i, stringname,
-                                                             user_data_size))
+                        dump_string_entry(i, stringname, user_data_size)
             else:
                 if i >= 2:
                     if DUMP_STRING_TABLES:
-                        print(' {}, {}'.format(i, stringname))
+                        dump_string_entry(i, stringname)
 
 
 def dump_string_tables(data_table_bytes):
-    """seperates out string tables and then passes them to dump_string_table"""
-    num_tables = read_byte(data_table_bytes)
+    """
+    seperates out string tables and then passes them to dump_string_table,
+    the frame is bit packed like the engine's bf_read so it's read with a
+    BitReader, strings are null terminated
+    """
+    reader = BitReader(data_table_bytes)
+    num_tables = reader.read_bits(8)
 
     for i in range(num_tables):
-        tablename = read_str(data_table_bytes, n=256)
+        tablename = reader.read_string(STRING_TABLE_MAX_NAME)
 
         if DUMP_STRING_TABLES:
             print('ReadStringTable:{}'.format(tablename))
@@ -700,7 +885,7 @@ def dump_string_tables(data_table_bytes):
         # might be issues coming from tablename being padded with null bytes
         is_user_info = tablename == 'userinfo'
 
-        dump_string_table(data_table_bytes, is_user_info)
+        dump_string_table(reader, is_user_info)
 
 def read_sequence_info(data_stream):
     """takes bytes in and reads two ints"""
@@ -708,106 +893,119 @@ def read_sequence_info(data_stream):
     sequence_num_out = read_int(data_stream)
     return (sequence_num_in, sequence_num_out)
 
+def emit(record_type, record):
+    """hands a record to OUTPUT_SINK if there is one"""
+    if OUTPUT_SINK is not None:
+        OUTPUT_SINK.write(record_type, record)
+
 def demo_msg_print(msg, size):
     """prints out some debug info, designed to be similar to the c version"""
+    if OUTPUT_SINK is not None:
+        emit('net_message', {'tick': CURRENT_TICK,
+                             'type': type(msg).__name__,
+                             'size': size,
+                             'data': text_format.MessageToString(msg, as_one_line=True)})
+        return
     print('--- {} ({} bytes) --------'.format(type(msg), size))
     print(msg)      # should be defined but may not actually work
 
-def print_user_message(user_msg):
+def user_message_id(name):
+    """id of a user message given its name (SayText2 or CS_UM_SayText2) or id"""
+    if name.isdigit():
+        return int(name)
+    try:
+        return USER_MESSAGE_IDS[name[len(USER_MESSAGE_PREFIX):]
+                                if name.startswith(USER_MESSAGE_PREFIX) else name]
+    except KeyError:
+        raise ValueError('unknown user message {}'.format(name))
+
+def decode_user_message(payload):
+    """
+    reads msg_type and msg_data straight from the CSVCMsg_UserMessage bytes
+    and returns (msg_type, message). The inner message is only decoded for
+    types in SUBSCRIBED_USER_MESSAGES, otherwise message is a memoryview of
+    msg_data that points into payload.
+    """
+    msg_type = 0
+    msg_data = memoryview(b'')
+    for field, value in wire.iter_fields(payload):
+        if field == USER_MESSAGE_TYPE_FIELD:
+            msg_type = value
+        elif field == USER_MESSAGE_DATA_FIELD:
+            msg_data = value
+    if SUBSCRIBED_USER_MESSAGES is not None and msg_type not in SUBSCRIBED_USER_MESSAGES:
+        return msg_type, msg_data
+    message_type = USER_MESSAGE_TYPES.get(msg_type)
+    if message_type is None:
+        return msg_type, msg_data
+    msg = message_type()
+    msg.ParseFromString(msg_data)
+    return msg_type, msg
+
+def print_user_message(payload):
     """parses and then prints user message"""
-    cmd = user_msg.msg_type
-    size_um = len(user_msg.msg_data)
-    types = [cstrike15_usermessages_public_pb2.CCSUsrMsg_VGUIMenu,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_Geiger,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_Train,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_HudText,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_SayText,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_SayText2,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_TextMsg,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_HudMsg,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ResetHud,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_GameTitle,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_Shake,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_Fade,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_Rumble,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_CloseCaption,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_CloseCaptionDirect,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_SendAudio,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_RawAudio,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_VoiceMask,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_RequestState,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_Damage,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_RadioText,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_HintText,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_KeyHintText,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ProcessSpottedEntityUpdate,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ReloadEffect,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_AdjustMoney,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_StopSpectatorMode,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_KillCam,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_DesiredTimescale,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_CurrentTimescale,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_AchievementEvent,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_MatchEndConditions,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_DisconnectToLobby,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_PlayerStatsUpdate,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_DisplayInventory,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_WarmupHasEnded,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ClientInfo,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_XRankGet,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_XRankUpd,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_CallVoteFailed,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_VoteStart,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_VotePass,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_VoteFailed,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_VoteSetup,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ServerRankRevealAll,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_SendLastKillerDamageToClient,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ServerRankUpdate,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ItemPickup,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ShowMenu,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_BarTime,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_AmmoDenied,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_MarkAchievement,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_MatchStatsUpdate,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ItemDrop,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_GlowPropTurnOff,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_SendPlayerItemDrops,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_RoundBackupFilenames,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_SendPlayerItemFound,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ReportHit,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_XpUpdate,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_QuestProgress,
-             cstrike15_usermessages_public_pb2.CCSUsrMsg_ScoreLeaderboardData]
-    msg = types[cmd]()
-    msg.ParseFromString(user_msg.msg_data)
-    demo_msg_print(msg, um_size)
+    msg_type, msg = decode_user_message(payload)
+    if not isinstance(msg, memoryview):
+        demo_msg_print(msg, msg.ByteSize())
+    return msg_type, msg
 
-def dump_user_message(data_stream, size):
+def dump_user_message(payload, size):
     """deals with the user message type of packets"""
-    user_msg = netmessages_public_pb2.CSVCMsg_UserMessage()
-    user_msg.ParseFromString(read_bytes(data_stream, size))
-    print_user_message(msg)
+    global SKIPPED_BYTES
+    if SUBSCRIBED_USER_MESSAGES is None and PROFILER is None:
+        print_user_message(payload)
+        return
+    # msg_type is only read from the wire once, for both of these
+    msg_type = wire.find_varint_field(payload, USER_MESSAGE_TYPE_FIELD, 0)
+    if SUBSCRIBED_USER_MESSAGES is not None and msg_type not in SUBSCRIBED_USER_MESSAGES:
+        SKIPPED_BYTES += size
+        if PROFILER is not None:
+            PROFILER.add('skipped', profiling_user_message_key(msg_type), size, 0)
+        return
+    if PROFILER is None:
+        print_user_message(payload)
+    else:
+        PROFILER.time('user_message', msg_type, size, print_user_message, payload)
+
+def profiling_user_message_key(msg_type):
+    """name of a user message for the profiler's skipped category"""
+    message_type = USER_MESSAGE_TYPES.get(msg_type)
+    return msg_type if message_type is None else message_type.__name__
 
-def handle_svc_user_message(data_stream, size, cmd):
+def handle_svc_user_message(payload, size, cmd):
     """handles a packet of type svc_user_message"""
-    dump_user_messages(data_stream, size)
+    dump_user_message(payload, size)
+
+def index_game_events():
+    """
+    fills GAME_EVENT_DESCRIPTORS, WANTED_GAME_EVENT_IDS and
+    STATE_GAME_EVENT_IDS from GAME_EVENT_LIST, footsteps are only wanted
+    with DUMP_FOOTSTEP_EVENTS. The events the parser's state depends on are
+    wanted even when they're in IGNORED_GAME_EVENTS, they're just not output.
+    """
+    ignored = set(IGNORED_GAME_EVENTS)
+    if not DUMP_FOOTSTEP_EVENTS:
+        ignored.add('player_footstep')
+    ignored.difference_update(STATE_GAME_EVENTS, PHASE_GAME_EVENTS)
+    if KILL_FEED is not None or DUMP_DEATHS:
+        ignored.discard('player_death')
+    GAME_EVENT_DESCRIPTORS.clear()
+    WANTED_GAME_EVENT_IDS.clear()
+    STATE_GAME_EVENT_IDS.clear()
+    for descriptor in GAME_EVENT_LIST.descriptors:
+        GAME_EVENT_DESCRIPTORS[descriptor.eventid] = descriptor
+        if descriptor.name not in ignored:
+            WANTED_GAME_EVENT_IDS.add(descriptor.eventid)
+        if descriptor.name in STATE_GAME_EVENTS:
+            STATE_GAME_EVENT_IDS.add(descriptor.eventid)
 
 def get_game_event_descriptor(msg):
     """finds the descriptor in GAME_EVENT_LIST"""
     #TODO: add demo class or object and change this function
-    found = False
-    for i in range(len(GAME_EVENT_LIST.descriptors)):
-        descriptor = GAME_EVENT_LIST.descriptors[i]
-        if descriptor.eventid == msg.eventid:
-            found = True
-            break
-
-    if not found:
-        if DUMP_GAME_EVENTS:
-            print(msg)
-        return None
-    return GAME_EVENT_LIST.descriptors[i]
+    descriptor = GAME_EVENT_DESCRIPTORS.get(msg.eventid)
+    if descriptor is None and DUMP_GAME_EVENTS:
+        print(msg)
+    return descriptor
 
 def find_player_info(index):
     """given an index goes and gets information about a player"""
@@ -815,53 +1013,85 @@ def find_player_info(index):
         if player.userID == index:
             return player
 
-def show_player_info(field, index, show_details=True, bCSV=False):
-    """prints some stuff about a player"""
+def game_event_key_value(key_value):
+    """gets the value out of a CSVCMsg_GameEvent.key_t based on its type"""
+    return getattr(key_value, GAME_EVENT_KEY_FIELDS.get(key_value.type, 'val_string'))
+
+def game_event_record(msg, descriptor):
+    """turns a game event into a record for an output sink"""
+    record = {'tick': CURRENT_TICK}
+    for key, key_value in zip(descriptor.keys, msg.keys):
+        record[key.name] = game_event_key_value(key_value)
+    return record
+
+PLAYER_RECORD_FIELDS = ('name', 'id', 'x', 'y', 'z', 'pitch', 'yaw', 'team')
+
+def get_player_record(field, index, show_details=True):
+    """
+    collects the name, position, view angles and team of a player into a
+    dict with the keys prefixed by field, returns None for unknown players
+    """
     player_info = find_player_info(index)
     if player_info is None:
+        return None
+    record = {field + '_name': player_info.name, field + '_id': index}
+
+    if show_details:
+        x, y, z, pitch, yaw, team = player_state(player_info)
+        record[field + '_x'] = x
+        record[field + '_y'] = y
+        record[field + '_z'] = z
+        record[field + '_pitch'] = pitch
+        record[field + '_yaw'] = yaw
+        record[field + '_team'] = None if team is None else 'T' if team == 2 else 'CT'
+    return record
+
+def player_state(player_info):
+    """
+    (x, y, z, pitch, yaw, team number) of a player's entity, anything that
+    isn't known is None
+    """
+    x = y = z = None
+    entity = find_entity(player_info.entityID + 1)
+    if entity is None:
+        return x, y, z, None, None, None
+    origin = entity.find_prop('m_vecOrigin')
+    if origin is not None:
+        x = origin[0]
+        y = origin[1]
+        # players send the origin as an xy vector and a separate z
+        z = entity.find_prop('m_vecOrigin[2]')
+        if z is None and len(origin) > 2:
+            z = origin[2]
+    return (x, y, z,
+            entity.find_prop('m_angEyeAngles[0]'),
+            entity.find_prop('m_angEyeAngles[1]'),
+            entity.find_prop('m_iTeamNum'))
+
+def show_player_info(field, index, show_details=True, bCSV=False):
+    """prints some stuff about a player"""
+    record = get_player_record(field, index, show_details)
+    if record is None:
         return False
     if bCSV:
-        print('{}, {}, {}'.format(field, player_info.name, index), end='')
-    else:
-        print(' {}: {} (id:{})'.format(field, player_info, index))
-    
-    if show_details:
-        entity_index = player_info.entityID + 1
-        entity = find_entity(entity_index)
-        assert(entity is not None)
-        XYProp = entity.FindProp("m_vecOrigin")
-        ZProp = entity.FindProp("m_vecOrigin[2]")
-        if (XYProp is not None and ZProp is not None):
-            if bCSV:
-                print(', {}, {}, {}'.format(XYProp.m_pPropValue.m_value.m_vector.x,
-                                            XYProp.m_pPropValue.m_value.m_vector.y,
-                                            XYProp.m_pPropValue.m_value.m_vector.z),
-                      end='')
-            else:
-                print(' position: {}, {}, {}'.format(XYProp.m_pPropValue.m_value.m_vector.x,
-                                                     XYProp.m_pPropValue.m_value.m_vector.y,
-                                                     XYProp.m_pPropValue.m_value.m_vector.z))
-        angle0Prop = entity.FindProp('m_angEyeAngles[0]')
-        angle1Prop = entity.FindProp('m_angEyeAngles[1]')
-        if angle0Prop is not None and angle1Prop is not None:
-            if bCSV:
-                print(', {}, {}'.format(angle0Prop.m_pPropValue.m_value.m_float,
-                                        angle1Prop.m_pPropValue.m_value.m_float),
-                                        end = '')
-            else:
-                print(' facing: pitch:{}, yaw:{}'.format(angle0Prop.m_pPropValue.m_value.m_float,
-                                                         angle1Prop.m_pPropValue.m_value.m_float))
-        team_prop = entity.FindProp('m_iTeamNum')
-        if team_prop is not None:
-            if bCSV:
-                print(', {}'.format('T' if team_prop.m_pPropValue.m_value.m_int == 2 else 'CT'),
-                      end='')
-            else:
-                print(' team: {}'.format('T' if team_prop.m_pPropValue.m_value.m_int == 2 else 'CT'))
+        values = [value for value in record.values() if value is not None]
+        print(', '.join(str(value) for value in [field] + values), end='')
+        return True
+
+    print(' {}: {} (id:{})'.format(field, record[field + '_name'], index))
+    if record.get(field + '_x') is not None:
+        print(' position: {}, {}, {}'.format(record[field + '_x'],
+                                             record[field + '_y'],
+                                             record[field + '_z']))
+    if record.get(field + '_pitch') is not None:
+        print(' facing: pitch:{}, yaw:{}'.format(record[field + '_pitch'],
+                                                 record[field + '_yaw']))
+    if record.get(field + '_team') is not None:
+        print(' team: {}'.format(record[field + '_team']))
     return True
 
-def handle_player_death(msg, descriptor):
-    """finds info about player death event"""
+def player_death_keys(msg, descriptor):
+    """(userid, attacker, assister, weapon, headshot) of a player_death event"""
     userid = -1
     attackerid = -1
     assisterid = 0
@@ -869,19 +1099,59 @@ def handle_player_death(msg, descriptor):
     headshot = False
     for i in range(len(msg.keys)):
         key = descriptor.keys[i]
-        key_value = msg.keys[i]
+        key_value = game_event_key_value(msg.keys[i])
 
         if key.name == 'userid':
-            userid = key_value.data
+            userid = key_value
         elif key.name == 'attacker':
-            attackerid = key_value.data
+            attackerid = key_value
         elif key.name == 'assister':
-            assisterid = key_value.data
+            assisterid = key_value
         elif key.name == 'weapon':
-            weapon_name = key_value.data
+            weapon_name = key_value
         elif key.name == 'headshot':
-            headshot = key_value.data
-    
+            headshot = key_value
+    return userid, attackerid, assisterid, weapon_name, headshot
+
+def record_kill(msg, descriptor):
+    """
+    adds a player_death event to KILL_FEED, the names the players have now
+    are remembered so they're still there after a disconnect
+    """
+    userid, attackerid, assisterid, weapon_name, headshot = player_death_keys(msg, descriptor)
+    victim = find_player_info(userid)
+    attacker = find_player_info(attackerid)
+    assister = find_player_info(assisterid) if assisterid else None
+    for player_id, player_info in ((userid, victim), (attackerid, attacker),
+                                   (assisterid, assister)):
+        if player_info is not None:
+            KILL_FEED.name_player(player_id, player_info.name)
+    KILL_FEED.add(CURRENT_TICK, userid, attackerid, assisterid, weapon_name, headshot,
+                  None if victim is None else player_state(victim),
+                  None if attacker is None else player_state(attacker))
+
+def handle_player_death(msg, descriptor):
+    """finds info about player death event"""
+    userid, attackerid, assisterid, weapon_name, headshot = player_death_keys(msg, descriptor)
+
+    if OUTPUT_SINK is not None:
+        # every kill record gets the same columns, the ids come from the event
+        # and whatever can't be looked up for a missing player is None
+        record = {'tick': CURRENT_TICK}
+        for field, index in (('victim', userid),
+                             ('attacker', attackerid),
+                             ('assister', assisterid)):
+            player_record = get_player_record(field, index)
+            if player_record is None:
+                player_record = {field + '_' + name: None
+                                 for name in PLAYER_RECORD_FIELDS}
+                player_record[field + '_id'] = index
+            record.update(player_record)
+        record['weapon'] = weapon_name
+        record['headshot'] = headshot
+        emit('kill', record)
+        return
+
     show_player_info('victim', userid, True, True)
     print(', ', end='')
     show_player_info('attacker', attackerid, True, True)
@@ -891,6 +1161,29 @@ def handle_player_death(msg, descriptor):
         show_player_info('assister', assisterid, True, True)
     print()
 
+def dump_player_tracks():
+    """emits the position, view angles and team of every player this tick"""
+    for player_info in PLAYER_INFOS:
+        if player_info.userID is None or player_info.userID < 0:
+            continue
+        record = get_player_record('player', player_info.userID)
+        if record is None:
+            continue
+        track = {'tick': CURRENT_TICK}
+        for name in PLAYER_RECORD_FIELDS:
+            track[name] = record['player_' + name]
+        emit('tick', track)
+
+def steam_account_id(networkid):
+    """account id out of a STEAM_X:Y:Z networkid, None if it isn't one"""
+    if not networkid or not networkid.startswith('STEAM_'):
+        return None
+    try:
+        _, low_bit, rest = networkid.split(':')
+        return int(rest) * 2 + int(low_bit)
+    except ValueError:
+        return None
+
 def handle_player_connect_events(msg, descriptor):
     """deals with sorting out when players both connect and disconnect"""
     player_disconnect = (descriptor.name == 'player_disconnect')
@@ -902,90 +1195,136 @@ def handle_player_connect_events(msg, descriptor):
     name = None
     bot = False
     reason = None
+    networkid = None
     
     for i in range(len(msg.keys)):
         key = descriptor.keys[i]
-        key_value = msg.keys[i]
+        key_value = game_event_key_value(msg.keys[i])
 
         if key.name == 'userid':
-            userid = key.value
+            userid = key_value
         elif key.name == 'index':
-            index = key.value
+            index = key_value
         elif key.name == 'name':
-            name = key.value
+            name = key_value
         elif key.name == 'networkid':
-            print(key.value)        # this is to help with debugging
-            bot = bool(key.value == 'BOT')
+            if DEBUG:
+                print(key_value)        # this is to help with debugging
+            networkid = key_value
+            bot = bool(key_value == 'BOT')
         elif key.name == 'bot':
-            bot = key.value
+            bot = key_value
         elif key.name == 'reason':
-            reason = key.value
+            reason = key_value
 
     if player_disconnect:
-        if DUMP_GAME_EVENTS:
+        if DUMP_GAME_EVENTS and OUTPUT_SINK is None:
             print('Player {} (id:{}) has disconnected. Reason: {}'.format(name, userid, reason))
         player_info = find_player_info(userid)
         if player_info is not None:     # mark player spot as epmty
             player_info.name = 'disconnected'
-            player_info.userid = -1
-            player_info.guid[0] = 0
+            player_info.userID = -1
+            player_info.guid = ''
     else:
         new_player = PlayerInfo()
         new_player.userID = userid
         new_player.name = name
         new_player.fakeplayer = bot
+        new_player.ishltv = False
         if bot:
             new_player.guid = 'bot'
+            new_player.xuid = 0
+            new_player.friendsID = 0
+        else:
+            new_player.guid = networkid
+            new_player.friendsID = steam_account_id(networkid)
+            if new_player.friendsID is not None:
+                new_player.xuid = STEAM_ID_BASE + new_player.friendsID
 
         new_player.entityID = index
         
         existing = find_player_by_entity(index)
+        emit('player', player_info_record(new_player))
 
         if existing is None:
-            if DUMP_GAME_EVENTS:
+            if DUMP_GAME_EVENTS and OUTPUT_SINK is None:
                 print('Player {} {} (id:{}) connected.'.format(new_player.guid, name, userid))
             PLAYER_INFOS.append(new_player)
         else:
-            existing = new_player
-            # this doesn't actually work because it's not a pointer
-            # but I'm putting it here because I want to
-            # TODO: make a function to give the index of the existing player
-            # so that it can assign to the position in the array
-            # This could also be solved by giving a method to overwrite
-            # exiting but that seems uglier
+            PLAYER_INFOS[existing] = new_player
     return True
 
 def parse_game_event(msg, descriptor):
     """gets the info from the game event"""
+    global MATCH_START_OCCURED
     if descriptor is None:
         raise ValueError('descriptor is None')
+    if PHASE_INDEX is not None:
+        PHASE_INDEX.game_event(descriptor.name, CURRENT_TICK, CURRENT_FRAME_OFFSET)
     if descriptor.name != 'player_footstep' or DUMP_FOOTSTEP_EVENTS:
+        # events that are only decoded for the parser's state aren't output
+        output = descriptor.name not in IGNORED_GAME_EVENTS
+        if EVENT_EXPORTER is not None and output:
+            EVENT_EXPORTER.add_event(CURRENT_TICK, msg, descriptor)
+        if KILL_FEED is not None and descriptor.name == 'player_death':
+            record_kill(msg, descriptor)
         if not handle_player_connect_events(msg, descriptor):
             if descriptor.name == 'round_announce_match_start':
                 MATCH_START_OCCURED = True
             allow_death_report = (MATCH_START_OCCURED or DUMP_WARMUP_DEATHS) and DUMP_DEATHS
             if descriptor.name == 'player_death' and allow_death_report:
                 handle_player_death(msg, descriptor)
-            if DUMP_GAME_EVENTS:
+            if DUMP_GAME_EVENTS and output and OUTPUT_SINK is not None:
+                OUTPUT_SINK.write_event(descriptor.name,
+                                        game_event_record(msg, descriptor))
+            elif DUMP_GAME_EVENTS and output:
                 print('{}\n{{'.format(descriptor.name))
                 for i in range(len(msg.keys)):
                     key = descriptor.keys[i]
-                    key_value = msg.keys[i]
+                    key_value = game_event_key_value(msg.keys[i])
                     handled = False
                     if key.name == 'userid' or key.name == 'attacker' or key.name == 'assister':
-                        # key_value.data is probably wrong, but I'm not sure what
-                        # the correct way is to get the data
-                        handled = show_player_info(key.name, key_value.data)
+                        handled = show_player_info(key.name, key_value)
                     if not handled:
-                        print(' {}:{}'.format(key.name, key))
+                        print(' {}:{}'.format(key.name, key_value))
                 print('}')
 
-def handle_svc_game_event(data_stream, size, cmd):
+def handle_svc_game_event(payload, size, cmd):
     """handles a packet of type svc_game_event"""
+    global SKIPPED_BYTES
+    if GAME_EVENT_DESCRIPTORS:
+        # the eventid comes before the keys, so unwanted events are dropped
+        # after reading a couple of bytes instead of decoding all the keys
+        eventid = wire.find_varint_field(payload, GAME_EVENT_ID_FIELD, 0)
+        if eventid not in WANTED_GAME_EVENT_IDS:
+            SKIPPED_BYTES += size
+            if PROFILER is not None:
+                descriptor = GAME_EVENT_DESCRIPTORS.get(eventid)
+                PROFILER.add('skipped', eventid if descriptor is None else descriptor.name,
+                             size, 0)
+            return
+
     msg = netmessages_public_pb2.CSVCMsg_GameEvent()
-    msg.ParseFromString(data_stream.read('bytes:{}'.format(size)))
-    descriptor = get_game_event_descriptor(data_stream, cmd)
-    parse_game_event(msg, descriptor)
+    msg.ParseFromString(payload)
+    descriptor = get_game_event_descriptor(msg)
+    if PROFILER is None or descriptor is None:
+        parse_game_event(msg, descriptor)
+    else:
+        PROFILER.time('game_event', descriptor.name, size,
+                      parse_game_event, msg, descriptor)
+
+def handle_state_game_event(payload):
+    """
+    decodes a game event from a state only frame if it's one of
+    STATE_GAME_EVENTS, returns False for any other event
+    """
+    eventid = wire.find_varint_field(payload, GAME_EVENT_ID_FIELD, 0)
+    if eventid not in STATE_GAME_EVENT_IDS:
+        return False
+    msg = netmessages_public_pb2.CSVCMsg_GameEvent()
+    msg.ParseFromString(payload)
+    handle_player_connect_events(msg, GAME_EVENT_DESCRIPTORS[eventid])
+    return True
 
 def parse_string_table_update(data_stream, entries, max_entries,
                               user_data_size, user_data_size_bits,
@@ -1061,10 +1400,10 @@ def parse_string_table_update(data_stream, entries, max_entries,
             unswapped_player_info = user_data   # probably need to do a conversion
         
 
-def handle_svc_create_string_table(data_stream, size, cmd):
+def handle_svc_create_string_table(payload, size, cmd):
     """handles a packet of type svc_create_string_table"""
     msg = netmessages_public_pb2.CSVCMsg_CreateStringTable()
-    msg.ParseFromString(read_bytes(data_stream, size))
+    msg.ParseFromString(payload)
     is_user_info = msg.name != "userinfo"
     if DUMP_STRING_TABLES:
         print('CreateStringTable:{}:{}:{}:{}:{}'.format(msg.name,
@@ -1072,49 +1411,96 @@ def handle_svc_create_string_table(data_stream, size, cmd):
                                                         msg.num_entries,
                                                         msg.user_data_size,
                                                         msg.user_data_size_bits))
-    # here the c code makes data which is a `CBitRead` for the entirity of
-    # string_data, this might need to be parsed by me later, but that can
-    # be figured out at some point
-    parse_string_table_update(data_stream, msg.string_data,
+    # the c code makes a `CBitRead` for the entirety of string_data
+    parse_string_table_update(ConstBitStream(bytes=msg.string_data),
                               msg.num_entries, msg.max_entries,
                               msg.user_data_size, msg.user_data_size_bits,
                               msg.user_data_fixed_size, is_user_info)
     new_string_table = StringTableData(szName = msg.name, max_entires = msg.max_entries)
     STRING_TABLES.append(new_string_table)
     
-def handle_svc_update_string_table(data_stream, size, cmd):
+def handle_svc_update_string_table(payload, size, cmd):
     """handles a packet of type svc_update_string_table"""
     msg = netmessages_public_pb2.CSVCMsg_UpdateStringTable()
-    msg.ParseFromString(read_bytes(data_steam, size))
+    msg.ParseFromString(payload)
     is_user_info = msg.name != "userinfo"
     if DUMP_STRING_TABLES:
         print('UpdateStringTable:{}({}):{}'.format(msg.table_id,
                                                    STRING_TABLES[msg.table_id].szName,
                                                    msg.num_changed_entries))
-    # here the c code makes data which is a `CBitRead` for the entirity of
-    # string_data, this might need to be parsed by me later, but that can
-    # be figured out at some point
-    parse_string_table_update(data_stream, msg.string_data,
+    # the c code makes a `CBitRead` for the entirety of string_data
+    parse_string_table_update(ConstBitStream(bytes=msg.string_data),
                               msg.num_changed_entries,
                               STRING_TABLES[msg.table_id].nMaxEntries,
                               0, 0, 0, is_user_info)
     # the c code prints out some stuff if it's a bad table here, but
     # instead we will just silently fail
     
-def handle_svc_send_table(data_stream, size, cmd):
+def handle_svc_send_table(payload, size, cmd):
     """handles a packet of type svc_send_table"""
     msg = netmessages_public_pb2.CSVCMsg_SendTable()
-    msg.ParseFromString(read_bytes(data_stream, size))
+    msg.ParseFromString(payload)
     recv_table_read_infos(msg)
 
-def handle_svc_packet_entities(data_stream, size, cmd):
+def add_entity(index, u_class, u_serial_num):
+    """adds an entity entering the pvs, or reuses the entry if it's already there"""
+    entity = ENTITIES.get(index)
+    if entity is None:
+        entity = EntityEntry(index, u_class, u_serial_num)
+        ENTITIES[index] = entity
+    else:
+        if entity.u_class != u_class:
+            entity.props.clear()
+        entity.u_class = u_class
+        entity.u_serial_num = u_serial_num
+    return entity
+
+def find_entity(index):
+    """the EntityEntry with index, None if there isn't one"""
+    return ENTITIES.get(index)
+
+def remove_entity(index):
+    ENTITIES.pop(index, None)
+
+def read_new_entity(entity_bit_buffer, entity):
+    """reads the changed props of an entity, returns their indices"""
+    decoder = prop_decode.class_decoder(SERVER_CLASSES[entity.u_class])
+    indices = decoder.decode(entity_bit_buffer, entity.props)
+    if DUMP_PACKET_ENTITIES:
+        for index in indices:
+            print(' {}: {} = {}'.format(index, decoder.props[index].var_name,
+                                        entity.props.get(index)))
+    if ENTITY_JOURNAL is not None:
+        props = entity.props
+        for index in indices:
+            if index in props:      # props that aren't subscribed have no value
+                ENTITY_JOURNAL.change(CURRENT_TICK, entity.nEntity, index, props[index])
+    return indices
+
+def server_class_name(class_id):
+    """name of the server class with index class_id, or the index if it's unknown"""
+    if 0 <= class_id < len(SERVER_CLASSES):
+        return SERVER_CLASSES[class_id].strName
+    return class_id
+
+def decode_entity(entity_bit_buffer, entity, class_id):
+    """reads an entity update, counting it towards its class when profiling"""
+    if PROFILER is None:
+        read_new_entity(entity_bit_buffer, entity)
+        return
+    start_pos = entity_bit_buffer.pos
+    start = perf_counter()
+    read_new_entity(entity_bit_buffer, entity)
+    # entity updates aren't byte aligned, bytes are rounded down
+    PROFILER.add('entity_class', server_class_name(class_id),
+                 (entity_bit_buffer.pos - start_pos) // 8, perf_counter() - start)
+
+def handle_svc_packet_entities(payload, size, cmd):
     """handles a packet of type svc_packet_entities"""
-    msg = netmessages_public_pb2.CSVCMsg_PacketEntities()
-    msg.ParseFromString(read_bytes(data_stream, size))
-    # here the c code makes `entityBitBuffer` which is a `CBitRead` that
-    # contains `msg.entity_data`, this might need to be parsed but I'm
-    # willing to pretend that it doesn't need to be
-    entity_bit_buffer = ConstBitStream(msg.entity_data)
+    # only the header fields are decoded, entity_data stays a view into
+    # payload and the bit reader works on it directly
+    msg = wire.read_packet_entities(payload)
+    entity_bit_buffer = BitReader(msg.entity_data)
     as_delta = msg.is_delta         # why is this a variable
     header_count = msg.updated_entries
     baseline = msg.baseline
@@ -1132,19 +1518,19 @@ def handle_svc_packet_entities(data_stream, size, cmd):
         if is_entity:
             update_flags = FHDR_ZERO        # zero, not sure why it's in a constant
 
-            new_entity = header_base + 1 + read_ubit_var(entity_bit_buffer)
+            new_entity = header_base + 1 + entity_bit_buffer.read_ubit_var()
             header_base = new_entity
 
             # leave pvs flag
-            if not read_bit(entity_bit_buffer):
+            if not entity_bit_buffer.read_bit():
                 # enter pvs flag
-                if read_bit(entity_bit_buffer):
+                if entity_bit_buffer.read_bit():
                     update_flags = update_flags | FHDR_ENTERPVS
             else:
                 update_flags = update_flags | FHDR_LEAVEPVS
                 
                 # ? force delete flag
-                if read_bit(entity_bit_buffer):
+                if entity_bit_buffer.read_bit():
                     update_flags = update_flags | FHDR_DELETE
         update_type = 3
         while update_type == 3:
@@ -1159,16 +1545,16 @@ def handle_svc_packet_entities(data_stream, size, cmd):
                     update_type = 2     # delta pvs
 
             if update_type == 0:    # enter pvs
-                u_class = read_ubit_long(entity_bit_buffer, SERVER_CLASS_BITS)
-                u_serial_num = read_ubit_long(entity_bit_buffer, NUM_NETWORKED_EHANDLE_SERIAL_BITS)
+                u_class = entity_bit_buffer.read_bits(SERVER_CLASS_BITS)
+                u_serial_num = entity_bit_buffer.read_bits(NUM_NETWORKED_EHANDLE_SERIAL_BITS)
                 if DUMP_PACKET_ENTITIES:
                     print('Entity enters PVS: id:{}, class:{}, serial:{}'.format(new_entity,
                                                                                  u_class,
                                                                                  u_serial_num))
-                #TODO: implement AddEntity
-                entity = AddEntity(new_entity, u_class, u_serial_num)
-                #TODO: implement read_new_entity
-                read_new_entity(entity_bit_buffer, entity)
+                entity = add_entity(new_entity, u_class, u_serial_num)
+                if ENTITY_JOURNAL is not None:
+                    ENTITY_JOURNAL.entered(CURRENT_TICK, new_entity, u_class)
+                decode_entity(entity_bit_buffer, entity, u_class)
             elif update_type == 1:   # leave pvs
                 if not as_delta:
                     raise ValueError('leave pvs on full update')
@@ -1177,14 +1563,16 @@ def handle_svc_packet_entities(data_stream, size, cmd):
                         print('entity leaves pvs and is deleted: id:{}'.format(new_entity))
                     else:
                         print('entity leaves pvs: id:{}'.format(new_entity))
-                remove_entity(new_entity)   #TODO: implement remove_entity
+                remove_entity(new_entity)
+                if ENTITY_JOURNAL is not None:
+                    ENTITY_JOURNAL.deleted(CURRENT_TICK, new_entity)
             elif update_type == 2:  # delta ent
-                entity = find_entity(new_entity)   #TODO: implement find_entity
+                entity = find_entity(new_entity)
                 if DUMP_PACKET_ENTITIES:
                     print('entity delta update: id:{}, class:{}, serial:{}'.format(entity.nEntity,
                                                                                    entity.u_class,
                                                                                    entity.u_serial_num))
-                read_new_entity(entity_bit_buffer, entity)
+                decode_entity(entity_bit_buffer, entity, entity.u_class)
             elif update_type == 3:  # preserve ent
                 if not as_delta:
                     raise ValueError('PreserveEnt on full update')     # right type of exception?
@@ -1194,7 +1582,7 @@ def handle_svc_packet_entities(data_stream, size, cmd):
                     if DUMP_PACKET_ENTITIES:
                         print('PreserveEnt: id:{}'.format(new_entity))
 
-def handle_net_default(data_stream, size, cmd):
+def handle_net_default(payload, size, cmd):
     """handles a non-special case, it might be slightly ugly"""
     if DEBUG:
         print('entering print_user_message, size: {}'.format(size))
@@ -1236,120 +1624,182 @@ def handle_net_default(data_stream, size, cmd):
              34 : 'CSVCMsg_EncryptedData',
              35 : 'CSVCMsg_HltvReplay'}
     msg = types[cmd]()
-    msg.FromString(bytes(read_bytes(data_stream, size)))
+    msg.ParseFromString(payload)
     if cmd == 30:       # svc game event list
         # TODO: get a demo object and change this to demo.game_event_list
         GAME_EVENT_LIST.MergeFrom(msg)
+        index_game_events()
     demo_msg_print(msg, size)
 
-def handle_netmsg(data_stream, size, cmd):
-    """handle the top level of netmsg and svcmsg parsing"""
+def handle_netmsg(payload, size, cmd):
+    """
+    handle the top level of netmsg and svcmsg parsing, payload is a
+    memoryview of the message bytes
+    """
     if DEBUG:
         print('entering handle_netmsg')
     if cmd == 23:   # svc user message
-        handle_svc_user_message(data_stream, size, cmd)
+        handle_svc_user_message(payload, size, cmd)
     elif cmd == 25:     # svc game event
-        handle_svc_game_event(data_stream, size, cmd)
+        handle_svc_game_event(payload, size, cmd)
     elif cmd == 12:     # svc create string table
-        handle_svc_create_string_table(data_stream, size, cmd)
+        handle_svc_create_string_table(payload, size, cmd)
     elif cmd == 13:     # svc update string table
-        handle_svc_update_string_table(data_stream, size, cmd)
+        handle_svc_update_string_table(payload, size, cmd)
     elif cmd == 9:      # svc send table
-        handle_svc_send_table(data_stream, size, cmd)
+        handle_svc_send_table(payload, size, cmd)
     elif cmd == 26:     # svc packet entities
-        handle_svc_packet_entities(data_stream, size, cmd)
+        handle_svc_packet_entities(payload, size, cmd)
     else:
-        handle_net_default(data_stream, size, cmd)
+        handle_net_default(payload, size, cmd)
 
-def dump_demo_packet(data_stream):
-    """deals with some parsing of a demo packet"""
-    chunk = read_raw_data(data_stream)
+def dump_demo_packet(data_stream, state_only=False):
+    """
+    deals with some parsing of a demo packet, with state_only only the
+    messages in STATE_NET_MESSAGES and the STATE_GAME_EVENTS are decoded
+    """
+    global SKIPPED_BYTES
+    chunk = memoryview(read_bytes(data_stream, read_int(data_stream)))
     if DEBUG:
         print('entering dump_demo_packet')
         print('chunk len: {}'.format(len(chunk)))
-    while len(chunk) > chunk.pos:
+    # all the cmd and size varints are read in one pass over the chunk,
+    # the payloads are handed out as slices of it without copying
+    for cmd, size, offset in wire.scan_messages(chunk):
         if DEBUG:
-            print('in loop, chunk len: {}'.format(len(chunk)))
-        cmd = read_varint32(chunk)
+            print('read_cmd_info: cmd: {} size: {}'.format(cmd, size))
 
-        size = read_varint32(chunk)
+        if state_only and cmd == netmessages_public_pb2.svc_GameEvent:
+            if handle_state_game_event(chunk[offset:offset + size]):
+                continue
 
-        if DEBUG:
-            print('read_cmd_info: cmd: {} size: {}'.format(cmd, size))
-        
-        message_buffer = chunk.read(size*8)
+        if cmd in SKIP_NET_MESSAGES or (state_only and cmd not in STATE_NET_MESSAGES):
+            SKIPPED_BYTES += size
+            if PROFILER is not None:
+                PROFILER.add('skipped', cmd, size, 0)
+            continue
 
-        handle_netmsg(message_buffer, size, cmd)
+        payload = chunk[offset:offset + size]
 
-def handle_demo_packet(data_table_bytes):
+        if PROFILER is None:
+            handle_netmsg(payload, size, cmd)
+        else:
+            PROFILER.time('net_message', cmd, size,
+                          handle_netmsg, payload, size, cmd)
+
+def handle_demo_packet(data_table_bytes, state_only=False):
     """parses a data packet"""
     cmd_info = read_cmd_info(data_table_bytes)
     read_sequence_info(data_table_bytes)    # result ignored
 
-    dump_demo_packet(data_table_bytes)
+    dump_demo_packet(data_table_bytes, state_only)
+
+def in_skipped_frames(offset):
+    """True if the frame at offset is in one of SKIP_FRAME_RANGES"""
+    for start, end in SKIP_FRAME_RANGES:
+        if start <= offset < end:
+            return True
+    return False
+
+def dump_frame(data_stream, base_offset=0):
+    """
+    reads and handles a single frame, returns True once the demo has stopped.
+    base_offset is the file offset of the start of data_stream, for streams
+    that only hold part of the file.
+    """
+    global CURRENT_TICK, CURRENT_FRAME_OFFSET
+    CURRENT_FRAME_OFFSET = base_offset + data_stream.bytepos
+    cmd, tick, player_slot = read_cmd_header(data_stream)
+
+    if DEBUG:
+        print('cmd:{}, tick:{}, player_slot:{}'.format(cmd, tick, player_slot))
+
+    CURRENT_TICK = tick
+
+    if cmd == 1:
+        #startup packet
+        #handled same as tick type 2
+        handle_demo_packet(data_stream)
+
+    elif cmd == 2:
+        #normal network packet
+        #handled same as tick type 1
+        if SKIP_FRAME_RANGES and in_skipped_frames(CURRENT_FRAME_OFFSET):
+            handle_demo_packet(data_stream, True)
+        else:
+            handle_demo_packet(data_stream)
+            if DUMP_PLAYER_TRACKS and OUTPUT_SINK is not None:
+                dump_player_tracks()
+
+    elif cmd == 3:
+        #synctick, doesn't seem to do anything
+        pass
+
+    elif cmd == 4:
+        #console command, nothing seems to be saved in c++
+        #it might be interesting to do something with this at some point
+        buf = read_raw_data(data_stream)
+
+    elif cmd == 5:
+        read_user_cmd(data_stream)
+
+    elif cmd == 6:
+        #data tables, the c++ reads these into a buffer first as well
+        parse_data_table(read_raw_data(data_stream).bytes)
+
+    elif cmd == 7:
+        #stop tick
+        return True
+
+    elif cmd == 8:
+        #custom data, "blob of binary data
+        pass
+
+    elif cmd == 9:
+        #read a stringtable, somewhat confusing
+        data_table_bytes = read_raw_data(data_stream).bytes
+
+        dump_string_tables(data_table_bytes)
+
+    return False
 
 def dump(data_stream):
     """gets the information from the demo"""
-    match_started = False
     demo_finished = False
 
     while not demo_finished:
-        cmd, tick, player_slot = read_cmd_header(data_stream)
-        
-        if DEBUG:
-            print('cmd:{}, tick:{}, player_slot:{}'.format(cmd, tick, player_slot))
+        demo_finished = dump_frame(data_stream)
 
-        current_tick = tick
+FRAME_HEADER_SIZE = 6       # cmd, tick, player_slot
+PACKET_INFO_SIZE = 152 + 8  # demo_cmd_info and the sequence numbers
 
-        if cmd == 1:
-            #startup packet
-            #handled same as tick type 2
-            handle_demo_packet(data_stream)
-
-        elif cmd == 2:
-            #normal network packet
-            #handled same as tick type 1
-            handle_demo_packet(data_stream)
-
-        elif cmd == 3:
-            #synctick, doesn't seem to do anything
-            pass
-        
-        elif cmd == 4:
-            #console command, nothing seems to be saved in c++
-            #it might be interesting to do something with this at some point
-            buf = read_raw_data(data_stream)
-
-        elif cmd == 5:
-            read_user_cmd(data_stream)
-
-        elif cmd == 7:
-            #stop tick
-            demo_finished = True
-            parse_data_table(data_stream)
-
-        elif cmd == 8:
-            #custom data, "blob of binary data
-            pass
-
-        elif cmd == 9:
-            #read a stringtable, somewhat confusing
-            data_table_bytes = read_raw_data(data_stream)
-            
-            dump_string_tables(data_table_bytes)
-
-def main():
-    """main method, currently opens test.dem, parses the header,
-    and then tries and fails to parse the main body"""
-    if DEBUG:
-        pathtofile = 'test.dem'     # makes testing less tedious
+def complete_frame_size(buf, pos):
+    """
+    size in bytes of the frame starting at buf[pos], or None if buf doesn't
+    hold all of it yet. Only looks at the frame header and the length field.
+    """
+    header_end = pos + FRAME_HEADER_SIZE
+    if len(buf) < header_end:
+        return None
+    cmd = buf[pos]
+    if cmd in (1, 2):
+        length_pos = header_end + PACKET_INFO_SIZE
+    elif cmd in (4, 6, 9):
+        length_pos = header_end
+    elif cmd == 5:
+        length_pos = header_end + 4     # outgoing sequence number
     else:
-        pathtofile = input('path to demo>')
-    print('parsing {}'.format(pathtofile))
-
-    data_stream = ConstBitStream(filename=pathtofile)
-    demo_info = get_demo_info(data_stream)
+        return FRAME_HEADER_SIZE
+    if len(buf) < length_pos + 4:
+        return None
+    size = struct.unpack_from('<i', buf, length_pos)[0]
+    frame_end = length_pos + 4 + size
+    if len(buf) < frame_end:
+        return None
+    return frame_end - pos
 
+def print_demo_info(demo_info):
+    """prints out the header of the demo"""
     print('Demo protocol version: {}'.format(demo_info.dem_prot))
     print('Network protocol version: {}'.format(demo_info.net_prot))
     print('HOSTNAME if TV, and IP:PORT if RIE (Record In eyes): {}'.format(demo_info.host_name))
@@ -1362,9 +1812,194 @@ def main():
     print('Tickrate: {}'.format(demo_info.tickrate))
     print('\n--- END HEADER ---\n')
 
+def demo_info_record(pathtofile, demo_info):
+    """turns the DemoInfo of a demo into a record for an output sink"""
+    return {'path': pathtofile,
+            'dem_prot': demo_info.dem_prot,
+            'net_prot': demo_info.net_prot,
+            'host_name': demo_info.host_name,
+            'client_name': demo_info.client_name,
+            'map_name': demo_info.map_name,
+            'gamedir': demo_info.gamedir,
+            'time': demo_info.time,
+            'ticks': demo_info.ticks,
+            'frames': demo_info.frames,
+            'tickrate': demo_info.tickrate,
+            'demo_type': demo_info.demo_type}
+
+def reset_state():
+    """clears everything left over from parsing a previous demo"""
+    global MATCH_START_OCCURED, CURRENT_TICK, CURRENT_FRAME_OFFSET, SKIPPED_BYTES
+    SERVER_CLASSES.clear()
+    DATA_TABLES.clear()
+    DATA_TABLE_INDEX.clear()
+    CURRENT_EXCLUDES.clear()
+    ENTITIES.clear()
+    prop_decode.clear_compiled()
+    PLAYER_INFOS.clear()
+    STRING_TABLES.clear()
+    GAME_EVENT_LIST.Clear()
+    GAME_EVENT_DESCRIPTORS.clear()
+    WANTED_GAME_EVENT_IDS.clear()
+    STATE_GAME_EVENT_IDS.clear()
+    MATCH_START_OCCURED = False
+    CURRENT_TICK = 0
+    CURRENT_FRAME_OFFSET = 0
+    SKIPPED_BYTES = 0
+
+def parse_demo(pathtofile):
+    """
+    parses the demo at pathtofile, the header is sent to OUTPUT_SINK if
+    there is one and printed otherwise
+    """
+    reset_state()
+    data_stream = ConstBitStream(filename=pathtofile)
+    demo_info = get_demo_info(data_stream)
+    if demo_info is None:
+        raise ValueError('{} is not a demo'.format(pathtofile))
+
+    if OUTPUT_SINK is not None:
+        emit('demo', demo_info_record(pathtofile, demo_info))
+    else:
+        print_demo_info(demo_info)
+
     data_stream.bytepos = 1072      # skip to the end of the header, beginning of main demo
 
+    if EVENT_EXPORTER is not None:
+        EVENT_EXPORTER.begin_demo(pathtofile)
     dump(data_stream)
+    if PHASE_INDEX is not None:
+        PHASE_INDEX.finish(CURRENT_TICK, CURRENT_FRAME_OFFSET)
+    if EVENT_EXPORTER is not None:
+        EVENT_EXPORTER.end_demo()
+    return demo_info
+
+def journal_classes():
+    """(class id, name, prop names) of every server class, for the entity journal"""
+    return [(server_class.nClassID, server_class.strName,
+             [entry.prop.var_name for entry in server_class.flattened_props])
+            for server_class in SERVER_CLASSES]
+
+def net_message_id(name):
+    """id of a net message given its name in netmessages_public.proto or its id"""
+    if name.isdigit():
+        return int(name)
+    for enum in (netmessages_public_pb2.NET_Messages,
+                 netmessages_public_pb2.SVC_Messages):
+        if name in enum.keys():
+            return enum.Value(name)
+    raise ValueError('unknown net message {}'.format(name))
+
+# subcommands, `demoparse serve ...` runs the main() of the module named here
+COMMANDS = {'serve': 'parse_service',
+            'dedupe': 'dedupe',
+            'chunk-server': 'round_chunks'}
+
+def main(argv=None):
+    """main method, parses the demo given on the command line (or test.dem
+    when debugging) and sends the output wherever the options say to"""
+    global OUTPUT_SINK, EVENT_EXPORTER, PROFILER, SUBSCRIBED_USER_MESSAGES, ENTITY_JOURNAL
+    global DUMP_GAME_EVENTS, DUMP_DEATHS, DUMP_WARMUP_DEATHS, DUMP_PLAYER_TRACKS
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] in COMMANDS:
+        return importlib.import_module(COMMANDS[argv[0]]).main(argv[1:])
+
+    parser = argparse.ArgumentParser(prog='demoparse',
+                                     description='parses CSGO demos')
+    parser.add_argument('demo', nargs='?', help='path to the demo')
+    parser.add_argument('--format', choices=sorted(output_sinks.SINK_TYPES),
+                        default=OUTPUT_FORMAT,
+                        help='write records to files instead of printing them')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR,
+                        help='directory for --format output')
+    parser.add_argument('--game-events', action='store_true', default=DUMP_GAME_EVENTS,
+                        help='output every game event')
+    parser.add_argument('--deaths', action='store_true', default=DUMP_DEATHS,
+                        help='output a kill record for every death after the match starts')
+    parser.add_argument('--warmup-deaths', action='store_true', default=DUMP_WARMUP_DEATHS,
+                        help='with --deaths, output the deaths in warmup too')
+    parser.add_argument('--player-tracks', action='store_true', default=DUMP_PLAYER_TRACKS,
+                        help='output the position of every player every tick, '
+                             'only with --format')
+    parser.add_argument('--parquet', metavar='DIR', default=PARQUET_DIR,
+                        help='export game events as parquet files to DIR')
+    parser.add_argument('--profile', action='store_true',
+                        help='print where parse time went at the end')
+    parser.add_argument('--skip', action='append', metavar='MESSAGE', default=[],
+                        help='net message to step over without reading, by '
+                             'name (svc_Sounds) or id, can be repeated')
+    parser.add_argument('--skip-bulky', action='store_true',
+                        help='skip voice data, sounds, temp entities and decals')
+    parser.add_argument('--ignore-event', action='append', metavar='EVENT', default=[],
+                        help='game event to leave out, e.g. weapon_fire. It is '
+                             'dropped without decoding unless the parser needs '
+                             'it. Can be repeated')
+    parser.add_argument('--props', action='append', metavar='CLASS=PROP,...', default=[],
+                        help='only decode these entity props, e.g. '
+                             'CCSPlayer=m_vecOrigin,m_iHealth, other classes '
+                             'are skipped. Can be repeated')
+    parser.add_argument('--entity-journal', metavar='PATH',
+                        help='write every entity change to a compressed journal at PATH')
+    parser.add_argument('--journal-codec', choices=('zlib', 'lzma', 'none'), default='zlib')
+    parser.add_argument('--user-message', action='append', metavar='MESSAGE',
+                        help='only decode these user messages, by name '
+                             '(SayText2) or id, can be repeated')
+    args = parser.parse_args(argv)
+
+    DUMP_GAME_EVENTS = args.game_events
+    DUMP_DEATHS = args.deaths
+    DUMP_WARMUP_DEATHS = args.warmup_deaths
+    DUMP_PLAYER_TRACKS = args.player_tracks
+    for name in args.skip:
+        SKIP_NET_MESSAGES.add(net_message_id(name))
+    if args.skip_bulky:
+        SKIP_NET_MESSAGES.update(BULKY_NET_MESSAGES)
+    IGNORED_GAME_EVENTS.update(args.ignore_event)
+    for subscription in args.props:
+        class_name, _, prop_names = subscription.partition('=')
+        prop_decode.subscribe_props(class_name, prop_names.split(','))
+    if args.user_message is not None:
+        SUBSCRIBED_USER_MESSAGES = {user_message_id(name) for name in args.user_message}
+
+    pathtofile = args.demo
+    if pathtofile is None:
+        if DEBUG:
+            pathtofile = 'test.dem'     # makes testing less tedious
+        else:
+            pathtofile = input('path to demo>')
+    print('parsing {}'.format(pathtofile))
+
+    if args.format is not None:
+        OUTPUT_SINK = output_sinks.open_sink(args.format, args.output_dir)
+    if args.parquet is not None:
+        import parquet_export
+        EVENT_EXPORTER = parquet_export.ParquetEventExporter(args.parquet)
+    if args.entity_journal is not None:
+        import entity_journal
+        ENTITY_JOURNAL = entity_journal.EntityJournal(args.entity_journal,
+                                                      args.journal_codec)
+    if args.profile:
+        import profiling
+        PROFILER = profiling.Profiler()
+    try:
+        parse_demo(pathtofile)
+    finally:
+        if OUTPUT_SINK is not None:
+            OUTPUT_SINK.close()
+            OUTPUT_SINK = None
+        if EVENT_EXPORTER is not None:
+            EVENT_EXPORTER.close()
+            EVENT_EXPORTER = None
+        if ENTITY_JOURNAL is not None:
+            ENTITY_JOURNAL.set_classes(journal_classes())
+            ENTITY_JOURNAL.close()
+            ENTITY_JOURNAL = None
+        if PROFILER is not None:
+            PROFILER.report()
+            PROFILER = None
+        if SKIP_NET_MESSAGES or IGNORED_GAME_EVENTS or SUBSCRIBED_USER_MESSAGES is not None:
+            print('skipped {} bytes of net messages and game events'.format(SKIPPED_BYTES))
 
 if __name__ == '__main__':
     main()
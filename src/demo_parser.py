@@ -0,0 +1,311 @@
+"""
+Object interface to the parser in demo_parse_test
+
+The parser still keeps its state in module globals, so only one DemoParser
+can be parsing at a time in a process. Code that parses from more than one
+thread has to hold PARSE_LOCK while it does.
+"""
+
+import threading
+import time
+
+from bitstring import ConstBitStream
+
+import demo_parse_test
+import output_sinks
+
+HEADER_SIZE = 1072
+FOLLOW_POLL_INTERVAL = 0.25     # seconds between checks for new data
+
+PARSE_LOCK = threading.Lock()
+
+# demo_parse_test globals that install sets and uninstall restores
+INSTALLED_GLOBALS = ('OUTPUT_SINK', 'DUMP_GAME_EVENTS', 'DEBUG')
+
+
+class DemoParser():
+    """parses demos, sending records to sink and/or handing them back"""
+    def __init__(self, sink=None, game_events=True, collect=True):
+        """
+        sink gets every record as it is parsed, game_events turns on
+        DUMP_GAME_EVENTS while this parser is running. With collect=False
+        records only go to sink and nothing is handed back.
+        """
+        self.sink = sink
+        self.game_events = game_events
+        self.collect = collect
+        self.collector = output_sinks.MemorySink()
+        self.demo_info = None
+        self.path = None
+        self.offset = 0         # file offset of the next unparsed frame
+        self.finished = False
+        self.saved_globals = {}
+
+    def install(self):
+        """
+        points the parser globals at this parser's sinks, the values they
+        had are put back by uninstall
+        """
+        self.saved_globals = {name: getattr(demo_parse_test, name)
+                              for name in INSTALLED_GLOBALS}
+        if self.sink is None:
+            demo_parse_test.OUTPUT_SINK = self.collector
+        elif not self.collect:
+            demo_parse_test.OUTPUT_SINK = self.sink
+        else:
+            demo_parse_test.OUTPUT_SINK = output_sinks.TeeSink(self.collector,
+                                                               self.sink)
+        if self.game_events:
+            demo_parse_test.DUMP_GAME_EVENTS = True
+        # records go to the sinks, nothing gets printed
+        demo_parse_test.DEBUG = False
+
+    def uninstall(self):
+        for name, value in self.saved_globals.items():
+            setattr(demo_parse_test, name, value)
+        self.saved_globals = {}
+
+    def parse(self, path):
+        """parses the whole demo at path, returns every record that was emitted"""
+        self.install()
+        try:
+            self.demo_info = demo_parse_test.parse_demo(path)
+        finally:
+            self.uninstall()
+        self.path = path
+        self.finished = True
+        return self.collector.drain()
+
+    def kills(self, path):
+        """
+        parses the demo at path for its kill feed only, returns a dict of
+        columns, see kill_feed.KillFeed.table
+        """
+        import kill_feed
+
+        feed = kill_feed.KillFeed()
+        game_events = self.game_events
+        self.game_events = False
+        demo_parse_test.KILL_FEED = feed
+        try:
+            self.parse(path)
+        finally:
+            demo_parse_test.KILL_FEED = None
+            self.game_events = game_events
+        # players that left have a user id of -1, their names are in the feed
+        names = {player.userID: player.name for player in demo_parse_test.PLAYER_INFOS
+                 if player.userID is not None and player.userID >= 0}
+        return feed.table(names)
+
+    def phases(self, path):
+        """parses the demo at path and returns its phases.PhaseIndex"""
+        import phases
+
+        index = phases.PhaseIndex(start_offset=HEADER_SIZE)
+        demo_parse_test.PHASE_INDEX = index
+        try:
+            self.parse(path)
+        finally:
+            demo_parse_test.PHASE_INDEX = None
+        return index
+
+    def journal(self, path, journal_path, codec='zlib'):
+        """
+        parses the demo at path writing every entity change to an
+        entity_journal at journal_path, returns journal_path
+        """
+        import entity_journal
+
+        journal = entity_journal.EntityJournal(journal_path, codec)
+        demo_parse_test.ENTITY_JOURNAL = journal
+        try:
+            self.parse(path)
+            journal.set_classes(demo_parse_test.journal_classes())
+        finally:
+            demo_parse_test.ENTITY_JOURNAL = None
+            journal.close()
+        return journal_path
+
+    def parse_everything(self, demo_path=None):
+        """
+        parses demo_path (the last demo parsed when it isn't given) with the
+        kill feed, phase index and player tracks turned on, returns (header
+        record, records, kill_feed.KillFeed, phases.PhaseIndex)
+        """
+        import kill_feed
+        import phases
+
+        if demo_path is None:
+            demo_path = self.path
+        feed = kill_feed.KillFeed()
+        index = phases.PhaseIndex(start_offset=HEADER_SIZE)
+        tracks = demo_parse_test.DUMP_PLAYER_TRACKS
+        demo_parse_test.KILL_FEED = feed
+        demo_parse_test.PHASE_INDEX = index
+        demo_parse_test.DUMP_PLAYER_TRACKS = True
+        try:
+            records = self.parse(demo_path)
+        finally:
+            demo_parse_test.KILL_FEED = None
+            demo_parse_test.PHASE_INDEX = None
+            demo_parse_test.DUMP_PLAYER_TRACKS = tracks
+        header = demo_parse_test.demo_info_record(demo_path, self.demo_info)
+        return header, records, feed, index
+
+    def save(self, path, demo_path=None, track_interval=None):
+        """
+        parses everything out of demo_path and writes it to path, see
+        parsed_demo.ParsedDemo.load. Player positions are kept every
+        track_interval ticks, parsed_demo.TRACK_INTERVAL when it isn't given.
+        """
+        import parsed_demo
+
+        if track_interval is None:
+            track_interval = parsed_demo.TRACK_INTERVAL
+        parsed_demo.write(path, *self.parse_everything(demo_path),
+                          demo_parse_test.PARSER_VERSION, track_interval)
+        return path
+
+    def save_rounds(self, path, demo_path=None, track_interval=None):
+        """
+        like save, but with every round compressed on its own so one round
+        can be loaded without the rest, see round_chunks.RoundChunks
+        """
+        import round_chunks
+
+        if track_interval is None:
+            track_interval = round_chunks.parsed_demo.TRACK_INTERVAL
+        round_chunks.write(path, *self.parse_everything(demo_path),
+                           demo_parse_test.PARSER_VERSION, track_interval)
+        return path
+
+    def parse_live(self, path, index):
+        """
+        parses the demo at path without decoding warmup or anything after
+        the match, index is the demo's PhaseIndex from an earlier pass. Those
+        frames still get the messages that later frames depend on decoded.
+        """
+        demo_parse_test.SKIP_FRAME_RANGES[:] = index.not_live_ranges()
+        try:
+            return self.parse(path)
+        finally:
+            demo_parse_test.SKIP_FRAME_RANGES.clear()
+
+    def start(self, path, header):
+        """resets the parser for a new demo given its header bytes"""
+        demo_parse_test.reset_state()
+        self.path = path
+        self.demo_info = demo_parse_test.get_demo_info(ConstBitStream(bytes=header))
+        if self.demo_info is None:
+            raise ValueError('{} is not a demo'.format(path))
+        demo_parse_test.emit('demo', demo_parse_test.demo_info_record(path, self.demo_info))
+        self.offset = HEADER_SIZE
+        self.finished = False
+
+    def parse_frames(self, buf):
+        """
+        handles every complete frame at the start of buf, which starts at
+        file offset self.offset, returns how many bytes were used. A frame
+        that is cut off is left for the next call.
+        """
+        stream = None
+        pos = 0
+        while not self.finished:
+            size = demo_parse_test.complete_frame_size(buf, pos)
+            if size is None:
+                break
+            if stream is None:
+                stream = ConstBitStream(bytes=bytes(buf))
+            stream.bytepos = pos
+            self.finished = demo_parse_test.dump_frame(stream, self.offset)
+            pos += size
+        return pos
+
+    def iter_bytes(self, data, path='<memory>'):
+        """
+        parses a whole demo held in memory, yielding the records of each
+        frame as a list once the frame is done
+        """
+        self.install()
+        try:
+            self.start(path, data[:HEADER_SIZE])
+            records = self.collector.drain()
+            if records:
+                yield records
+
+            stream = ConstBitStream(bytes=bytes(data))
+            pos = HEADER_SIZE
+            while not self.finished:
+                size = demo_parse_test.complete_frame_size(data, pos)
+                if size is None:
+                    if pos == len(data):
+                        break       # no stop frame, but nothing is missing either
+                    raise EOFError('demo ends in the middle of a frame')
+                stream.bytepos = pos
+                self.finished = demo_parse_test.dump_frame(stream)
+                pos += size
+                self.offset = pos
+                records = self.collector.drain()
+                if records:
+                    yield records
+        finally:
+            self.uninstall()
+
+    def follow(self, path, poll_interval=FOLLOW_POLL_INTERVAL, idle_timeout=None):
+        """
+        parses a demo that is still being written, yielding (record_type,
+        record) as soon as the frame they came from is complete. Waits for
+        the file to grow until the stop frame shows up, or until nothing was
+        written for idle_timeout seconds. Calling it again for the same path
+        carries on from the last complete frame.
+        """
+        resume = path == self.path and self.offset and not self.finished
+        self.install()
+        try:
+            with open(path, 'rb') as demo_file:
+                if resume:
+                    demo_file.seek(self.offset)
+                else:
+                    header = wait_for_bytes(demo_file, HEADER_SIZE, poll_interval,
+                                            idle_timeout)
+                    if header is None:
+                        return
+                    self.start(path, header)
+                    for record in self.collector.drain():
+                        yield record
+
+                pending = bytearray()
+                last_growth = time.monotonic()
+                while not self.finished:
+                    data = demo_file.read()
+                    if not data:
+                        if (idle_timeout is not None and
+                                time.monotonic() - last_growth > idle_timeout):
+                            return
+                        time.sleep(poll_interval)
+                        continue
+                    last_growth = time.monotonic()
+                    pending += data
+                    used = self.parse_frames(pending)
+                    del pending[:used]
+                    self.offset += used
+                    for record in self.collector.drain():
+                        yield record
+        finally:
+            self.uninstall()
+
+
+def wait_for_bytes(demo_file, count, poll_interval, idle_timeout):
+    """reads count bytes from demo_file, waiting for them to be written"""
+    data = bytearray()
+    started = time.monotonic()
+    while len(data) < count:
+        chunk = demo_file.read(count - len(data))
+        if chunk:
+            data += chunk
+            started = time.monotonic()
+            continue
+        if idle_timeout is not None and time.monotonic() - started > idle_timeout:
+            return None
+        time.sleep(poll_interval)
+    return bytes(data)
@@ -0,0 +1,372 @@
+"""
+Entity change journal
+
+Every decoded entity prop change is recorded as a row of (tick, entity,
+prop index, value) into typed array.array columns. Values go into a column
+for their type (ints, float32s, string bytes) with a kind column saying
+which, so there are no per row objects. Entities entering and leaving are
+rows too, with marker prop indices. The columns are compressed into a
+block every JOURNAL_BLOCK_ROWS rows and at every snapshot, and the footer
+lists the tick range and file offset of every block so a range of ticks
+can be read without decompressing the rest. Every SNAPSHOT_INTERVAL ticks
+the whole entity table is written as well, as a block of rows that sets
+every prop, so the state at a tick can be rebuilt from the snapshot before
+it (see state_query) instead of from the start. Since blocks end at
+snapshots, that only decompresses the blocks of the snapshot's interval:
+
+    DemoParser().journal('match.dem', 'match.journal')
+    with JournalReader('match.journal') as journal:
+        for tick, entity, prop, value in journal.changes(1000, 2000):
+            ...
+
+The file is the header (MAGIC, version, codec), the blocks and snapshots,
+the footer and a trailer of the footer's offset and MAGIC. The footer also
+holds the server classes so prop indices can be turned into names without
+the demo.
+"""
+
+import json
+import lzma
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+MAGIC = b'DEMJRNL\x00'
+VERSION = 2
+JOURNAL_BLOCK_ROWS = 65536      # rows per compressed block
+SNAPSHOT_INTERVAL = 640         # ticks between snapshots, 10s at 64 tick
+
+HEADER = struct.Struct('<8sBB')
+BLOCK_ENTRY = struct.Struct('<QIIiiI')  # offset, size, raw size, first tick, last tick, rows
+SNAPSHOT_ENTRY = struct.Struct('<QIIiI')    # offset, size, raw size, tick, rows
+TRAILER = struct.Struct('<Q8s')
+
+# codec name -> (id, compress, decompress)
+CODECS = {'none': (0, bytes, bytes),
+          'zlib': (1, zlib.compress, zlib.decompress),
+          'lzma': (2, lzma.compress, lzma.decompress)}
+CODEC_NAMES = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+# prop indices that aren't props
+PROP_DELETED = -1       # the entity left, no value
+PROP_CLASS = -2         # the entity entered, the value is its class id
+
+# value kinds
+KIND_NONE = 0
+KIND_INT = 1
+KIND_FLOAT = 2
+KIND_VECTOR = 3         # three floats
+KIND_VECTOR_XY = 4      # two floats
+KIND_STRING = 5
+KIND_ARRAY = 6          # count and element kind in ints, then the elements
+KIND_BIG_INT = 7        # ints that don't fit in 64 signed bits, as a string
+
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+# name, typecode; strings are a bytes blob after these
+COLUMNS = (('tick', 'i'),
+           ('entity', 'H'),
+           ('prop', 'h'),
+           ('kind', 'B'),
+           ('ints', 'q'),
+           ('floats', 'f'),
+           ('string_sizes', 'I'))
+
+Block = namedtuple('Block', ['offset', 'size', 'raw_size', 'first_tick', 'last_tick', 'rows'])
+Snapshot = namedtuple('Snapshot', ['offset', 'size', 'raw_size', 'tick', 'rows'])
+Change = namedtuple('Change', ['tick', 'entity', 'prop', 'value'])
+
+
+def column_bytes(column):
+    """little endian bytes of an array"""
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def column_from_bytes(typecode, data):
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+class EntityJournal():
+    """writes entity changes to path in compressed blocks, with snapshots"""
+    def __init__(self, path, codec='zlib', block_rows=JOURNAL_BLOCK_ROWS,
+                 snapshot_interval=SNAPSHOT_INTERVAL):
+        codec_id, self.compress, _ = CODECS[codec]
+        self.block_rows = block_rows
+        self.snapshot_interval = snapshot_interval
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, codec_id))
+        self.blocks = []
+        self.snapshots = []
+        self.classes = {}   # class id -> (name, prop names)
+        self.rows = 0       # rows written to blocks
+        # entity -> [class id, {prop index: value}], what the next snapshot holds
+        self.state = {}
+        self.next_snapshot = None
+        self.new_block()
+
+    def __len__(self):
+        return self.rows + len(self.columns['tick'])
+
+    def new_block(self):
+        self.columns = {name: array(typecode) for name, typecode in COLUMNS}
+        self.strings = bytearray()
+
+    def append_value(self, value):
+        """appends value to the value columns, returns its kind"""
+        columns = self.columns
+        if value is None:
+            return KIND_NONE
+        if isinstance(value, int):
+            if INT64_MIN <= value <= INT64_MAX:
+                columns['ints'].append(value)
+                return KIND_INT
+            value = str(value)
+            kind = KIND_BIG_INT
+        elif isinstance(value, float):
+            columns['floats'].append(value)
+            return KIND_FLOAT
+        elif isinstance(value, tuple):
+            columns['floats'].extend(value)
+            return KIND_VECTOR if len(value) == 3 else KIND_VECTOR_XY
+        elif isinstance(value, list):
+            ints = columns['ints']
+            ints.append(len(value))
+            kind_pos = len(ints)
+            ints.append(KIND_NONE)
+            for element in value:
+                ints[kind_pos] = self.append_value(element)
+            return KIND_ARRAY
+        else:
+            kind = KIND_STRING
+        data = value.encode('utf-8')
+        columns['string_sizes'].append(len(data))
+        self.strings += data
+        return kind
+
+    def append_row(self, tick, entity, prop, value):
+        columns = self.columns
+        columns['kind'].append(self.append_value(value))
+        columns['tick'].append(tick)
+        columns['entity'].append(entity)
+        columns['prop'].append(prop)
+
+    def add(self, tick, entity, prop, value):
+        if self.next_snapshot is None or tick >= self.next_snapshot:
+            # intervals without any changes don't need a snapshot
+            snapshot_tick = tick - tick % self.snapshot_interval
+            self.write_snapshot(snapshot_tick)
+            self.next_snapshot = snapshot_tick + self.snapshot_interval
+        self.update_state(entity, prop, value)
+        self.append_row(tick, entity, prop, value)
+        if len(self.columns['tick']) >= self.block_rows:
+            self.flush()
+
+    def update_state(self, entity, prop, value):
+        """same as state_query.apply_change, for the snapshots"""
+        state = self.state
+        if prop == PROP_DELETED:
+            state.pop(entity, None)
+            return
+        entity_state = state.get(entity)
+        if prop == PROP_CLASS:
+            if entity_state is None or entity_state[0] != value:
+                state[entity] = [value, {}]
+            return
+        if entity_state is None:
+            entity_state = state[entity] = [None, {}]
+        entity_state[1][prop] = value
+
+    def change(self, tick, entity, prop, value):
+        self.add(tick, entity, prop, value)
+
+    def entered(self, tick, entity, class_id):
+        self.add(tick, entity, PROP_CLASS, class_id)
+
+    def deleted(self, tick, entity):
+        self.add(tick, entity, PROP_DELETED, None)
+
+    def set_classes(self, classes):
+        """classes is (class id, name, prop names in index order) for each server class"""
+        for class_id, name, prop_names in classes:
+            self.classes[class_id] = (name, list(prop_names))
+
+    def write_columns(self):
+        """compresses the columns and writes them, returns (offset, size, raw size)"""
+        parts = [column_bytes(self.columns[name]) for name, _ in COLUMNS]
+        parts.append(bytes(self.strings))
+        raw = struct.pack('<{}I'.format(len(parts)), *map(len, parts)) + b''.join(parts)
+        data = self.compress(raw)
+        offset = self.file.tell()
+        self.file.write(data)
+        return offset, len(data), len(raw)
+
+    def flush(self):
+        """compresses the rows so far into a block"""
+        ticks = self.columns['tick']
+        if not ticks:
+            return
+        self.blocks.append(Block(*self.write_columns(), min(ticks), max(ticks), len(ticks)))
+        self.rows += len(ticks)
+        self.new_block()
+
+    def write_snapshot(self, tick):
+        """
+        writes the entity table as rows at tick, it has every change made
+        before tick. The rows so far are flushed first so no block has rows
+        from both sides of a snapshot.
+        """
+        self.flush()
+        for entity, (class_id, props) in self.state.items():
+            self.append_row(tick, entity, PROP_CLASS, class_id)
+            for prop, value in props.items():
+                self.append_row(tick, entity, prop, value)
+        rows = len(self.columns['tick'])
+        self.snapshots.append(Snapshot(*self.write_columns(), tick, rows))
+        self.new_block()
+
+    def close(self):
+        """writes the last block and the footer"""
+        if self.file.closed:
+            return
+        self.flush()
+        footer_offset = self.file.tell()
+        classes = json.dumps(self.classes).encode('utf-8')
+        self.file.write(struct.pack('<I', len(self.blocks)))
+        for block in self.blocks:
+            self.file.write(BLOCK_ENTRY.pack(*block))
+        self.file.write(struct.pack('<I', len(classes)) + classes)
+        self.file.write(struct.pack('<I', len(self.snapshots)))
+        for snapshot in self.snapshots:
+            self.file.write(SNAPSHOT_ENTRY.pack(*snapshot))
+        self.file.write(TRAILER.pack(footer_offset, MAGIC))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class JournalReader():
+    """reads a journal written by EntityJournal, a block at a time"""
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        magic, version, codec_id = HEADER.unpack(self.file.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not an entity journal'.format(path))
+        if version != VERSION:
+            raise ValueError('{} is journal version {}, only {} can be read'.format(
+                path, version, VERSION))
+        self.codec = CODEC_NAMES[codec_id]
+        self.decompress = CODECS[self.codec][2]
+
+        self.file.seek(-TRAILER.size, 2)
+        footer_offset, magic = TRAILER.unpack(self.file.read(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError('{} has no footer, it was not closed'.format(path))
+        self.file.seek(footer_offset)
+        count, = struct.unpack('<I', self.file.read(4))
+        entries = self.file.read(BLOCK_ENTRY.size * count)
+        self.blocks = [Block(*entry) for entry in BLOCK_ENTRY.iter_unpack(entries)]
+        size, = struct.unpack('<I', self.file.read(4))
+        self.classes = {int(class_id): (name, prop_names) for class_id, (name, prop_names)
+                        in json.loads(self.file.read(size).decode('utf-8')).items()}
+        count, = struct.unpack('<I', self.file.read(4))
+        entries = self.file.read(SNAPSHOT_ENTRY.size * count)
+        self.snapshots = [Snapshot(*entry) for entry in SNAPSHOT_ENTRY.iter_unpack(entries)]
+        self.snapshot_ticks = [snapshot.tick for snapshot in self.snapshots]
+        self.last_ticks = [block.last_tick for block in self.blocks]
+
+    def __len__(self):
+        return sum(block.rows for block in self.blocks)
+
+    def prop_name(self, class_id, prop):
+        return self.classes[class_id][1][prop]
+
+    def blocks_between(self, start_tick=None, end_tick=None):
+        """blocks that can have rows with start_tick <= tick <= end_tick"""
+        first = 0 if start_tick is None else bisect_left(self.last_ticks, start_tick)
+        blocks = []
+        for block in self.blocks[first:]:
+            if end_tick is not None and block.first_tick > end_tick:
+                break
+            blocks.append(block)
+        return blocks
+
+    def read_columns(self, block):
+        """the columns of a block as a dict of arrays, plus 'strings' as bytes"""
+        self.file.seek(block.offset)
+        raw = self.decompress(self.file.read(block.size))
+        sizes = struct.unpack_from('<{}I'.format(len(COLUMNS) + 1), raw)
+        pos = 4 * len(sizes)
+        columns = {}
+        for (name, typecode), size in zip(COLUMNS, sizes):
+            columns[name] = column_from_bytes(typecode, raw[pos:pos + size])
+            pos += size
+        columns['strings'] = raw[pos:pos + sizes[-1]]
+        return columns
+
+    def block_changes(self, block):
+        """every row of a block or a snapshot as a Change"""
+        columns = self.read_columns(block)
+        ints = iter(columns['ints'])
+        floats = iter(columns['floats'])
+        string_sizes = iter(columns['string_sizes'])
+        strings = columns['strings']
+        string_pos = 0
+
+        def read_value(kind):
+            nonlocal string_pos
+            if kind == KIND_INT:
+                return next(ints)
+            if kind == KIND_FLOAT:
+                return next(floats)
+            if kind == KIND_VECTOR:
+                return (next(floats), next(floats), next(floats))
+            if kind == KIND_VECTOR_XY:
+                return (next(floats), next(floats))
+            if kind == KIND_ARRAY:
+                count = next(ints)
+                element_kind = next(ints)
+                return [read_value(element_kind) for _ in range(count)]
+            if kind in (KIND_STRING, KIND_BIG_INT):
+                size = next(string_sizes)
+                value = strings[string_pos:string_pos + size].decode('utf-8')
+                string_pos += size
+                return value if kind == KIND_STRING else int(value)
+            return None
+
+        for tick, entity, prop, kind in zip(columns['tick'], columns['entity'],
+                                            columns['prop'], columns['kind']):
+            yield Change(tick, entity, prop, read_value(kind))
+
+    def changes(self, start_tick=None, end_tick=None):
+        """the rows with start_tick <= tick <= end_tick, in the order they were written"""
+        for block in self.blocks_between(start_tick, end_tick):
+            for change in self.block_changes(block):
+                if start_tick is not None and change.tick < start_tick:
+                    continue
+                if end_tick is not None and change.tick > end_tick:
+                    continue
+                yield change
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
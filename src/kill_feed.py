@@ -0,0 +1,132 @@
+"""
+Kill feed collected into typed arrays
+
+Every player_death is appended to preallocated array.array columns while
+the demo is parsed, with the weapon stored as an id into a list of weapon
+names. Player names are kept per user id as they were when the player was
+last in a kill, so players who left before the end still have theirs, and
+are only joined to the rows once at the end when the columns are turned
+into a table. Collecting kills costs a few array stores per event instead
+of building and printing records.
+
+    feed = DemoParser().kills('match.dem')
+    feed['attacker_name'], feed['weapon'], feed['headshot'] ...
+"""
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+KILL_FEED_CAPACITY = 256    # rows allocated up front, doubled when it runs out
+
+TEAM_NAMES = {2: 'T', 3: 'CT'}
+
+# column name -> array typecode, positions are NaN and teams 0 when unknown
+KILL_COLUMNS = (('tick', 'i'),
+                ('victim', 'i'),
+                ('attacker', 'i'),
+                ('assister', 'i'),
+                ('weapon_id', 'H'),
+                ('headshot', 'b'),
+                ('victim_x', 'd'),
+                ('victim_y', 'd'),
+                ('victim_z', 'd'),
+                ('victim_team', 'b'),
+                ('attacker_x', 'd'),
+                ('attacker_y', 'd'),
+                ('attacker_z', 'd'),
+                ('attacker_team', 'b'))
+
+NAN = float('nan')
+
+
+class KillFeed():
+    """columns of kills, grown by doubling"""
+    def __init__(self, capacity=KILL_FEED_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+        self.columns = {name: array(typecode, bytes(array(typecode).itemsize * capacity))
+                        for name, typecode in KILL_COLUMNS}
+        self.weapons = []       # weapon id -> name
+        self.weapon_ids = {}    # name -> weapon id
+        self.player_names = {}  # user id -> name when they were last in a kill
+
+    def __len__(self):
+        return self.count
+
+    def grow(self):
+        for column in self.columns.values():
+            column.extend(array(column.typecode, bytes(column.itemsize * self.capacity)))
+        self.capacity *= 2
+
+    def weapon_id(self, weapon_name):
+        """interns a weapon name"""
+        weapon_id = self.weapon_ids.get(weapon_name)
+        if weapon_id is None:
+            weapon_id = len(self.weapons)
+            self.weapons.append(weapon_name)
+            self.weapon_ids[weapon_name] = weapon_id
+        return weapon_id
+
+    def name_player(self, userid, name):
+        """remembers the name of userid, it's kept after the player disconnects"""
+        if name is not None:
+            self.player_names[userid] = name
+
+    def add(self, tick, victim, attacker, assister, weapon_name, headshot,
+            victim_state=None, attacker_state=None):
+        """
+        appends one kill, the states are (x, y, z, pitch, yaw, team) of the
+        player or None when the player's entity isn't known
+        """
+        if self.count == self.capacity:
+            self.grow()
+        row = self.count
+        columns = self.columns
+        columns['tick'][row] = tick
+        columns['victim'][row] = victim
+        columns['attacker'][row] = attacker
+        columns['assister'][row] = assister
+        columns['weapon_id'][row] = self.weapon_id(weapon_name)
+        columns['headshot'][row] = bool(headshot)
+        for prefix, state in (('victim_', victim_state), ('attacker_', attacker_state)):
+            x = y = z = team = None
+            if state is not None:
+                x, y, z, _, _, team = state
+            columns[prefix + 'x'][row] = NAN if x is None else x
+            columns[prefix + 'y'][row] = NAN if y is None else y
+            columns[prefix + 'z'][row] = NAN if z is None else z
+            columns[prefix + 'team'][row] = team or 0
+        self.count += 1
+
+    def arrays(self):
+        """the filled part of every column, numpy arrays when numpy is installed"""
+        if numpy is not None:
+            # copied, a view would keep the array from growing on the next add
+            return {name: numpy.frombuffer(column, column.typecode, self.count).copy()
+                    for name, column in self.columns.items()}
+        return {name: column[:self.count] for name, column in self.columns.items()}
+
+    def table(self, player_names=None):
+        """
+        every column plus names for the players, weapons and teams. Names
+        come from name_player, player_names (user id -> name) is only used
+        for players that were never named
+        """
+        known = dict(player_names or {})
+        known.update(self.player_names)
+        table = self.arrays()
+        for field in ('victim', 'attacker', 'assister'):
+            ids = self.columns[field][:self.count]
+            names = {userid: known.get(userid) for userid in set(ids)}
+            table[field + '_name'] = [names[userid] for userid in ids]
+        weapons = self.weapons
+        table['weapon'] = [weapons[weapon_id]
+                           for weapon_id in self.columns['weapon_id'][:self.count]]
+        for field in ('victim_team', 'attacker_team'):
+            table[field + '_name'] = [TEAM_NAMES.get(team)
+                                      for team in self.columns[field][:self.count]]
+        return table
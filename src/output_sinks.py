@@ -0,0 +1,195 @@
+"""
+Structured output sinks for parsed demo data
+
+Records are plain dicts that get handed to a sink along with a record type
+('kill', 'player', 'net_message', ...). Every record type ends up in its own
+file so the columns of each file stay consistent.
+"""
+
+import csv
+import json
+import os
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024    # bytes buffered per file before a write
+
+NUMERIC_TYPES = (int, float, bool)
+
+
+class OutputSink():
+    """base class for sinks, records are dicts keyed by column name"""
+    def write(self, record_type, record):
+        """write a single record of type record_type"""
+        raise NotImplementedError
+
+    def write_event(self, event_name, record):
+        """write a game event, by default every event type gets its own file"""
+        self.write(event_name, record)
+
+    def close(self):
+        """flush and close anything that was opened"""
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class FileSink(OutputSink):
+    """sink that writes one buffered file per record type"""
+    extension = None
+
+    def __init__(self, directory, prefix='demo', buffer_size=OUTPUT_BUFFER_SIZE):
+        """files are created lazily in directory as record types show up"""
+        self.directory = directory
+        self.prefix = prefix
+        self.buffer_size = buffer_size
+        self.files = {}     # record_type -> open file
+
+        os.makedirs(directory, exist_ok=True)
+
+    def open_file(self, record_type):
+        """open the file for a new record type"""
+        path = os.path.join(self.directory, '{}_{}.{}'.format(self.prefix,
+                                                             record_type,
+                                                             self.extension))
+        out_file = open(path, 'w', buffering=self.buffer_size,
+                        encoding='utf-8', newline='')
+        self.files[record_type] = out_file
+        return out_file
+
+    def close(self):
+        """close every file that was opened"""
+        for out_file in self.files.values():
+            out_file.close()
+        self.files.clear()
+
+
+class JSONLinesSink(FileSink):
+    """writes one json object per line"""
+    extension = 'jsonl'
+
+    def __init__(self, directory, prefix='demo', buffer_size=OUTPUT_BUFFER_SIZE):
+        super().__init__(directory, prefix, buffer_size)
+        self.encode = json.JSONEncoder(separators=(',', ':'),
+                                       ensure_ascii=False,
+                                       default=str).encode
+
+    def write(self, record_type, record):
+        out_file = self.files.get(record_type)
+        if out_file is None:
+            out_file = self.open_file(record_type)
+        out_file.write(self.encode(record))
+        out_file.write('\n')
+
+
+class DelimitedSink(FileSink):
+    """
+    writes delimited text with a header row, the columns are taken from the
+    first record of each type. Rows where every value is a number skip the
+    csv module entirely since there is nothing to quote.
+    """
+    extension = 'csv'
+    delimiter = ','
+
+    def __init__(self, directory, prefix='demo', buffer_size=OUTPUT_BUFFER_SIZE):
+        super().__init__(directory, prefix, buffer_size)
+        self.writers = {}   # record_type -> (file, csv writer, columns)
+
+    def open_writer(self, record_type, record):
+        """open the file for record_type and write the header"""
+        out_file = self.open_file(record_type)
+        writer = csv.writer(out_file, delimiter=self.delimiter,
+                            lineterminator='\n')
+        columns = tuple(record)
+        writer.writerow(columns)
+        entry = (out_file, writer, columns)
+        self.writers[record_type] = entry
+        return entry
+
+    def write(self, record_type, record):
+        entry = self.writers.get(record_type)
+        if entry is None:
+            entry = self.open_writer(record_type, record)
+        out_file, writer, columns = entry
+
+        values = [record.get(column) for column in columns]
+        for value in values:
+            if not isinstance(value, NUMERIC_TYPES):
+                writer.writerow(values)
+                return
+        # fast path, numbers never need quoting
+        out_file.write(self.delimiter.join(map(repr, values)))
+        out_file.write('\n')
+
+    def close(self):
+        super().close()
+        self.writers.clear()
+
+
+class CSVSink(DelimitedSink):
+    """comma separated output"""
+    extension = 'csv'
+    delimiter = ','
+
+
+class TSVSink(DelimitedSink):
+    """tab separated output"""
+    extension = 'tsv'
+    delimiter = '\t'
+
+
+class MemorySink(OutputSink):
+    """
+    keeps records in a list until they are taken with drain(), game events
+    become 'game_event' records with the event name under 'name'
+    """
+    def __init__(self):
+        self.records = []   # list of (record_type, record)
+
+    def write(self, record_type, record):
+        self.records.append((record_type, record))
+
+    def write_event(self, event_name, record):
+        event = {'name': event_name}
+        event.update(record)
+        self.records.append(('game_event', event))
+
+    def drain(self):
+        """returns everything written since the last drain"""
+        records = self.records
+        self.records = []
+        return records
+
+
+class TeeSink(OutputSink):
+    """passes every record on to several sinks"""
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def write(self, record_type, record):
+        for sink in self.sinks:
+            sink.write(record_type, record)
+
+    def write_event(self, event_name, record):
+        for sink in self.sinks:
+            sink.write_event(event_name, record)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+SINK_TYPES = {'jsonl': JSONLinesSink,
+              'csv': CSVSink,
+              'tsv': TSVSink}
+
+
+def open_sink(output_format, directory, prefix='demo'):
+    """creates a sink given the name of a format in SINK_TYPES"""
+    try:
+        sink_type = SINK_TYPES[output_format]
+    except KeyError:
+        raise ValueError('unknown output format {}'.format(output_format))
+    return sink_type(directory, prefix)
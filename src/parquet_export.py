@@ -0,0 +1,132 @@
+"""
+Parquet export of game events
+
+Every event type gets its own set of typed columns built from the keys in
+its CSVCMsg_GameEventList descriptor. Rows are appended straight from the
+CSVCMsg_GameEvent message and written out as record batches, one Parquet
+file per event type per demo:
+
+    <directory>/<event name>/<demo name>-<path digest>.parquet
+
+so each event type directory can be read as a single dataset over every
+demo that was exported into it. The digest is of the demo's full path, so
+demos with the same name in different directories don't overwrite each
+other, and exporting the same demo again replaces its own files.
+
+pyarrow is only needed if this module is actually used.
+"""
+
+import hashlib
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_BATCH_SIZE = 65536       # rows per record batch (and parquet row group)
+PATH_DIGEST_SIZE = 4            # bytes of the demo path's digest in file names
+
+# descriptor key type -> (CSVCMsg_GameEvent.key_t field, arrow type name)
+EVENT_KEY_TYPES = {1: ('val_string', 'string'),
+                   2: ('val_float', 'float32'),
+                   3: ('val_long', 'int32'),
+                   4: ('val_short', 'int16'),
+                   5: ('val_byte', 'uint8'),
+                   6: ('val_bool', 'bool_'),
+                   7: ('val_uint64', 'uint64'),
+                   8: ('val_wstring', 'binary')}
+
+
+class EventColumns():
+    """typed column buffers for one game event type"""
+    def __init__(self, descriptor, path, batch_size):
+        """builds the schema from the descriptor, the file is opened lazily"""
+        self.path = path
+        self.batch_size = batch_size
+        self.writer = None
+
+        fields = [pyarrow.field('tick', pyarrow.int32())]
+        self.value_fields = []
+        for key in descriptor.keys:
+            value_field, type_name = EVENT_KEY_TYPES.get(key.type, EVENT_KEY_TYPES[1])
+            fields.append(pyarrow.field(key.name, getattr(pyarrow, type_name)()))
+            self.value_fields.append(value_field)
+        self.schema = pyarrow.schema(fields)
+
+        self.ticks = []
+        self.columns = [[] for _ in self.value_fields]
+
+    def append(self, tick, msg):
+        """adds a row from a CSVCMsg_GameEvent, keys it's missing are null"""
+        self.ticks.append(tick)
+        for column, value_field, key_value in zip(self.columns,
+                                                  self.value_fields,
+                                                  msg.keys):
+            column.append(getattr(key_value, value_field))
+        for column in self.columns[len(msg.keys):]:
+            column.append(None)
+        if len(self.ticks) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """writes the buffered rows as one record batch"""
+        if not self.ticks:
+            return
+        arrays = [pyarrow.array(values, type=field.type)
+                  for values, field in zip([self.ticks] + self.columns,
+                                           self.schema)]
+        batch = pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.writer is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+        self.writer.write_batch(batch, row_group_size=self.batch_size)
+
+        self.ticks = []
+        self.columns = [[] for _ in self.value_fields]
+
+    def close(self):
+        """flushes what's left and closes the file"""
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class ParquetEventExporter():
+    """collects game events of every type and writes them to parquet"""
+    def __init__(self, directory, batch_size=EXPORT_BATCH_SIZE):
+        if pyarrow is None:
+            raise ImportError('pyarrow is needed to export parquet files')
+        self.directory = directory
+        self.batch_size = batch_size
+        self.demo_name = 'demo'
+        self.events = {}    # eventid -> EventColumns
+
+    def begin_demo(self, pathtofile):
+        """starts a new set of files named after the demo and its path"""
+        self.end_demo()
+        path_digest = hashlib.blake2b(os.path.abspath(pathtofile).encode('utf-8'),
+                                      digest_size=PATH_DIGEST_SIZE).hexdigest()
+        self.demo_name = '{}-{}'.format(os.path.splitext(os.path.basename(pathtofile))[0],
+                                        path_digest)
+
+    def end_demo(self):
+        """closes every file of the current demo"""
+        for event_columns in self.events.values():
+            event_columns.close()
+        self.events.clear()
+
+    def add_event(self, tick, msg, descriptor):
+        """appends a CSVCMsg_GameEvent to the columns for its type"""
+        event_columns = self.events.get(descriptor.eventid)
+        if event_columns is None:
+            path = os.path.join(self.directory, descriptor.name,
+                                self.demo_name + '.parquet')
+            event_columns = EventColumns(descriptor, path, self.batch_size)
+            self.events[descriptor.eventid] = event_columns
+        event_columns.append(tick, msg)
+
+    def close(self):
+        self.end_demo()
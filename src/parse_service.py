@@ -0,0 +1,216 @@
+"""
+Long running parse service
+
+Keeps a pool of worker processes that have already imported the parser and
+the protobuf modules, and takes jobs over a unix socket or localhost http:
+
+    demoparse serve --socket /tmp/demoparse.sock --workers 4
+    demoparse serve --http 8765
+
+A job is a json object:
+
+    {"path": "match.dem",               demo to parse
+     "outputs": ["kill", "game_event"], record types to return (default all)
+     "output_path": "out/",             optional, write files here instead
+     "format": "jsonl"}                 format of the files in output_path
+
+On the unix socket every job is one line of json and gets one line back.
+Over http jobs are POSTed to /parse. Responses look like
+
+    {"ok": true, "records": [[record_type, record], ...], "cached": false,
+     "timing": {"parse_s": ..., "queued_s": ..., "total_s": ...}}
+
+with "output" and "count" instead of "records" when output_path is given,
+or {"ok": false, "error": "..."} if the job failed. With --cache-dir the
+records of demos that were parsed before come out of a result_cache.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+JOB_TIMEOUT = 600       # seconds before a job is given up on
+
+_WORKER_PARSER = None
+_WORKER_CACHE = None
+
+
+def warm_worker(cache_dir=None, cache_size=None):
+    """runs once in every worker, does all the imports before the first job"""
+    global _WORKER_PARSER, _WORKER_CACHE
+    import demo_parse_test
+    import demo_parser
+
+    demo_parse_test.DEBUG = False
+    _WORKER_PARSER = demo_parser.DemoParser
+    if cache_dir is not None:
+        import result_cache
+        _WORKER_CACHE = result_cache.ResultCache(
+            cache_dir, cache_size or result_cache.CACHE_MAX_BYTES)
+
+
+def run_job(job):
+    """parses one demo in a worker process"""
+    import output_sinks
+
+    started = time.time()
+    start = time.perf_counter()
+    outputs = job.get('outputs')
+    output_path = job.get('output_path')
+
+    if output_path is not None:
+        prefix = os.path.splitext(os.path.basename(job['path']))[0]
+        sink = output_sinks.open_sink(job.get('format', 'jsonl'), output_path, prefix)
+        parser = _WORKER_PARSER(sink=sink, collect=False)
+        try:
+            parser.parse(job['path'])
+            files = sorted(out_file.name for out_file in sink.files.values())
+        finally:
+            sink.close()
+        result = {'ok': True, 'output': output_path, 'files': files}
+    elif _WORKER_CACHE is not None:
+        import result_cache
+        records, cached = result_cache.cached_parse(job['path'], outputs, _WORKER_CACHE)
+        result = {'ok': True, 'records': records, 'count': len(records),
+                  'cached': cached}
+    else:
+        records = _WORKER_PARSER().parse(job['path'])
+        if outputs is not None:
+            records = [record for record in records if record[0] in outputs]
+        result = {'ok': True, 'records': records, 'count': len(records),
+                  'cached': False}
+
+    result['timing'] = {'started': started,
+                        'parse_s': time.perf_counter() - start}
+    return result
+
+
+class ParseService():
+    """hands jobs to the worker pool and times them"""
+    def __init__(self, workers=DEFAULT_WORKERS, cache_dir=None, cache_size=None):
+        self.pool = multiprocessing.Pool(workers, initializer=warm_worker,
+                                         initargs=(cache_dir, cache_size))
+
+    def submit(self, job):
+        """runs a job, returns the response as a dict"""
+        received = time.time()
+        if not isinstance(job, dict) or 'path' not in job:
+            return {'ok': False, 'error': 'job needs a path'}
+        try:
+            result = self.pool.apply_async(run_job, (job,)).get(JOB_TIMEOUT)
+        except Exception as error:      # anything from the parser goes back to the client
+            return {'ok': False, 'error': '{}: {}'.format(type(error).__name__, error),
+                    'timing': {'total_s': time.time() - received}}
+        timing = result['timing']
+        timing['queued_s'] = timing.pop('started') - received
+        timing['total_s'] = time.time() - received
+        return result
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class UnixJobHandler(socketserver.StreamRequestHandler):
+    """one json job per line, one json response per line"""
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                job = json.loads(line)
+            except ValueError as error:
+                response = {'ok': False, 'error': 'bad json: {}'.format(error)}
+            else:
+                response = self.server.service.submit(job)
+            self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class UnixJobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class HTTPJobHandler(BaseHTTPRequestHandler):
+    """POST /parse with a json job"""
+    def do_POST(self):
+        if self.path != '/parse':
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            job = json.loads(self.rfile.read(length))
+        except ValueError as error:
+            response = {'ok': False, 'error': 'bad json: {}'.format(error)}
+        else:
+            response = self.server.service.submit(job)
+        body = json.dumps(response, default=str).encode('utf-8')
+        self.send_response(200 if response['ok'] else 400)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def request(socket_path, job):
+    """sends one job to a service on a unix socket and waits for the response"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(json.dumps(job).encode('utf-8') + b'\n')
+        with client.makefile('rb') as response:
+            return json.loads(response.readline())
+
+
+def serve(socket_path=None, http_port=None, workers=DEFAULT_WORKERS,
+          cache_dir=None, cache_size=None):
+    """runs the service until it is interrupted"""
+    service = ParseService(workers, cache_dir, cache_size)
+    if http_port is not None:
+        server = ThreadingHTTPServer(('127.0.0.1', http_port), HTTPJobHandler)
+        where = 'http://127.0.0.1:{}/parse'.format(http_port)
+    else:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixJobServer(socket_path, UnixJobHandler)
+        where = socket_path
+    server.service = service
+    print('demoparse serving on {} with {} workers'.format(where, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if socket_path is not None and http_port is None:
+            os.remove(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='demoparse serve',
+                                     description='runs a local parse service')
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', metavar='PATH', help='unix socket to listen on')
+    where.add_argument('--http', metavar='PORT', type=int,
+                       help='localhost port to listen on')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help='keep parse results in DIR and reuse them')
+    parser.add_argument('--cache-size', type=int, metavar='MB', default=1024,
+                        help='size the cache is trimmed to (default 1024)')
+    args = parser.parse_args(argv)
+    serve(args.socket, args.http, args.workers, args.cache_dir,
+          args.cache_size * 1024 * 1024)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,378 @@
+"""
+Parsed demos saved to a binary container
+
+Everything a parse produces is written once as tables of columns: the
+header, the players, every game event type, the kill feed with the names
+its user ids had, the phase index and the player tracks, sampled every
+TRACK_INTERVAL ticks. Loading only reads the footer, columns are read from
+the mmapped file when they're first used, with numpy.frombuffer when numpy
+is installed so numeric columns aren't even copied:
+
+    DemoParser().save('match.parsed', 'match.dem')
+    demo = ParsedDemo.load('match.parsed')
+    demo.header['map_name'], demo.kills['tick'], demo.events('round_end')['winner']
+
+The file is MAGIC and VERSION, the column data with every column starting
+on an 8 byte boundary, a json footer describing the tables and a trailer of
+the footer's offset and size and MAGIC. Numeric columns are little endian.
+Strings are an offsets column and a utf-8 blob, and columns that mix types
+are stored as json.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b'DEMOPRSD'
+VERSION = 1
+
+HEADER = struct.Struct('<8sI4x')
+TRAILER = struct.Struct('<QQ8s')
+ALIGNMENT = 8
+
+NAN = float('nan')
+INT64_MIN = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+# array typecode -> numpy dtype, with sizes that don't depend on the platform
+NUMPY_TYPES = {'b': '<i1', 'B': '<u1', 'h': '<i2', 'H': '<u2', 'i': '<i4',
+               'I': '<u4', 'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+
+EVENT_TABLE_PREFIX = 'events/'
+TRACK_INTERVAL = 8      # ticks between stored player positions, 1 keeps every tick
+
+
+def little_endian(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def encode_column(values):
+    """
+    (description, data parts) for a column of values, the description is
+    what ends up in the footer minus the offsets
+    """
+    if isinstance(values, array):
+        return {'kind': 'numeric', 'typecode': values.typecode}, [little_endian(values)]
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, bool) for value in present) and len(present) == len(values):
+        return {'kind': 'numeric', 'typecode': 'b'}, [little_endian(array('b', values))]
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in present):
+        if not all(INT64_MIN <= value <= INT64_MAX for value in present):
+            return {'kind': 'json'}, [json.dumps(values).encode('utf-8')]
+        if len(present) == len(values):
+            return {'kind': 'numeric', 'typecode': 'q'}, [little_endian(array('q', values))]
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool)
+           for value in present):
+        # missing numbers are NaN
+        column = array('d', (NAN if value is None else value for value in values))
+        return {'kind': 'numeric', 'typecode': 'd'}, [little_endian(column)]
+    if all(isinstance(value, str) for value in values):
+        blob = bytearray()
+        offsets = array('Q', [0])
+        for value in values:
+            blob += value.encode('utf-8')
+            offsets.append(len(blob))
+        return {'kind': 'string'}, [little_endian(offsets), bytes(blob)]
+    return {'kind': 'json'}, [json.dumps(values).encode('utf-8')]
+
+
+def records_to_columns(records, fields=None):
+    """list of dicts -> dict of column lists, missing fields are None"""
+    if fields is None:
+        fields = []
+        for record in records:
+            for field in record:
+                if field not in fields:
+                    fields.append(field)
+    return {field: [record.get(field) for record in records] for field in fields}
+
+
+class ContainerWriter():
+    """writes tables of columns to path, or to a file object"""
+    def __init__(self, path):
+        self.own_file = not hasattr(path, 'write')
+        self.file = open(path, 'wb') if self.own_file else path
+        self.start = self.file.tell()
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.tables = {}
+        self.meta = {}
+
+    def write_part(self, data):
+        """writes data on an 8 byte boundary, returns its offset"""
+        offset = self.file.tell() - self.start
+        padding = -offset % ALIGNMENT
+        if padding:
+            self.file.write(bytes(padding))
+            offset += padding
+        self.file.write(data)
+        return offset
+
+    def add_table(self, name, columns):
+        """columns is a dict of name -> list or array.array, all the same length"""
+        rows = None
+        described = {}
+        for column_name, values in columns.items():
+            if rows is None:
+                rows = len(values)
+            elif len(values) != rows:
+                raise ValueError('column {} of {} has {} rows, not {}'.format(
+                    column_name, name, len(values), rows))
+            description, parts = encode_column(values)
+            description['parts'] = [(self.write_part(part), len(part)) for part in parts]
+            described[column_name] = description
+        self.tables[name] = {'rows': rows or 0, 'columns': described}
+
+    def close(self):
+        footer = json.dumps({'version': VERSION, 'meta': self.meta,
+                             'tables': self.tables}).encode('utf-8')
+        offset = self.write_part(footer)
+        self.file.write(TRAILER.pack(offset, len(footer), MAGIC))
+        if self.own_file:
+            self.file.close()
+
+
+def records_by_type(records):
+    by_type = {}
+    for record_type, record in records:
+        by_type.setdefault(record_type, []).append(record)
+    return by_type
+
+
+def kill_columns(kill_feed, start=0, end=None):
+    """the kill feed's columns from row start up to end"""
+    end = kill_feed.count if end is None else end
+    return {name: column[start:end] for name, column in kill_feed.columns.items()}
+
+
+def kill_names(kill_feed):
+    """user id -> name of everyone in the kill feed, as columns"""
+    names = sorted(kill_feed.player_names.items())
+    return {'userid': array('q', (userid for userid, _ in names)),
+            'name': [name for _, name in names]}
+
+
+def sample_tracks(tracks, interval=TRACK_INTERVAL):
+    """the tick records of the first tick in every interval ticks"""
+    if interval <= 1:
+        return tracks
+    sampled = []
+    current_tick = None
+    next_tick = None
+    keep = False
+    for record in tracks:
+        tick = record['tick']
+        if tick != current_tick:
+            current_tick = tick
+            keep = next_tick is None or tick >= next_tick
+            if keep:
+                next_tick = tick - tick % interval + interval
+        if keep:
+            sampled.append(record)
+    return sampled
+
+
+def event_tables(game_events):
+    """table name -> columns for game_event records, one table per event type"""
+    events = {}
+    for record in game_events:
+        events.setdefault(record['name'], []).append(record)
+    tables = {}
+    for name, event_records in events.items():
+        columns = records_to_columns(event_records)
+        del columns['name']
+        tables[EVENT_TABLE_PREFIX + name] = columns
+    return tables
+
+
+def write(path, demo, records, kill_feed=None, phase_index=None, parser_version=None,
+          track_interval=TRACK_INTERVAL):
+    """
+    writes a parsed demo, records are the (record_type, record) pairs a
+    MemorySink collected. demo is the header as a demo_info_record.
+    """
+    by_type = records_by_type(records)
+
+    writer = ContainerWriter(path)
+    writer.meta['header'] = demo
+    writer.meta['parser_version'] = parser_version
+    writer.meta['track_interval'] = track_interval
+    writer.add_table('players', records_to_columns(by_type.get('player', [])))
+    writer.add_table('tracks', records_to_columns(
+        sample_tracks(by_type.get('tick', []), track_interval)))
+    for name, columns in event_tables(by_type.get('game_event', [])).items():
+        writer.add_table(name, columns)
+    if kill_feed is not None:
+        writer.add_table('kills', kill_columns(kill_feed))
+        writer.add_table('weapons', {'name': list(kill_feed.weapons)})
+        writer.add_table('kill_names', kill_names(kill_feed))
+    else:
+        writer.add_table('kills', records_to_columns(by_type.get('kill', [])))
+    if phase_index is not None:
+        writer.add_table('phases', phase_index.table())
+    writer.close()
+
+
+class Table():
+    """columns of one table, each read from the file the first time it's used"""
+    def __init__(self, container, name, description):
+        self.container = container
+        self.name = name
+        self.rows = description['rows']
+        self.descriptions = description['columns']
+        self.loaded = {}
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, column_name):
+        return column_name in self.descriptions
+
+    @property
+    def columns(self):
+        return list(self.descriptions)
+
+    def __getitem__(self, column_name):
+        column = self.loaded.get(column_name)
+        if column is None:
+            try:
+                description = self.descriptions[column_name]
+            except KeyError:
+                raise KeyError('{} has no column {}'.format(self.name, column_name))
+            column = self.container.read_column(description, self.rows)
+            self.loaded[column_name] = column
+        return column
+
+    def to_dict(self):
+        return {column_name: self[column_name] for column_name in self.descriptions}
+
+
+class ParsedDemo():
+    """a container written by write(), opened without reading any columns"""
+    def __init__(self, path, buffer=None):
+        """opens path, or reads from buffer when it's given (path is then only a name)"""
+        self.path = path
+        self.file = None
+        if buffer is None:
+            self.file = open(path, 'rb')
+            try:
+                buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                self.file.close()
+                raise ValueError('{} is empty'.format(path))
+        self.buffer = buffer
+        magic, version = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('{} is not a parsed demo'.format(path))
+        if version != VERSION:
+            raise ValueError('{} is version {}, only {} can be read'.format(
+                path, version, VERSION))
+        offset, size, magic = TRAILER.unpack_from(self.buffer, len(self.buffer) - TRAILER.size)
+        if magic != MAGIC:
+            raise ValueError('{} is cut off'.format(path))
+        footer = json.loads(self.buffer[offset:offset + size].decode('utf-8'))
+        self.meta = footer['meta']
+        self.tables = {name: Table(self, name, description)
+                       for name, description in footer['tables'].items()}
+
+    @classmethod
+    def load(cls, path):
+        return cls(path)
+
+    @classmethod
+    def from_bytes(cls, data, name='<memory>'):
+        return cls(name, data)
+
+    def close(self):
+        for table in self.tables.values():
+            table.loaded.clear()
+        if self.file is None:
+            return
+        # numpy arrays still pointing into the mmap keep it open
+        try:
+            self.buffer.close()
+        except BufferError:
+            pass
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read_column(self, description, rows):
+        kind = description['kind']
+        parts = description['parts']
+        if kind == 'numeric':
+            offset, size = parts[0]
+            return self.numeric(description['typecode'], offset, size)
+        if kind == 'string':
+            (offsets_at, offsets_size), (blob_at, blob_size) = parts
+            offsets = self.numeric('Q', offsets_at, offsets_size)
+            blob = self.buffer[blob_at:blob_at + blob_size]
+            return [blob[int(offsets[i]):int(offsets[i + 1])].decode('utf-8')
+                    for i in range(rows)]
+        offset, size = parts[0]
+        return json.loads(self.buffer[offset:offset + size].decode('utf-8'))
+
+    def numeric(self, typecode, offset, size):
+        """a numeric column, a read only view of the file with numpy, a copy without"""
+        if numpy is not None:
+            dtype = numpy.dtype(NUMPY_TYPES[typecode])
+            return numpy.frombuffer(self.buffer, dtype, size // dtype.itemsize, offset)
+        column = array(typecode)
+        column.frombytes(self.buffer[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
+
+    @property
+    def header(self):
+        """the demo header as a demo_info_record"""
+        return self.meta['header']
+
+    def table(self, name):
+        return self.tables[name]
+
+    @property
+    def players(self):
+        return self.tables['players']
+
+    @property
+    def tracks(self):
+        return self.tables['tracks']
+
+    @property
+    def kills(self):
+        return self.tables['kills']
+
+    @property
+    def kill_names(self):
+        """user id -> name for the ids in kills, including players who left"""
+        table = self.tables.get('kill_names')
+        if table is None:
+            return {}
+        return dict(zip((int(userid) for userid in table['userid']), table['name']))
+
+    @property
+    def phases(self):
+        return self.tables.get('phases')
+
+    @property
+    def event_names(self):
+        return [name[len(EVENT_TABLE_PREFIX):] for name in self.tables
+                if name.startswith(EVENT_TABLE_PREFIX)]
+
+    def events(self, name):
+        """the table of one game event type"""
+        return self.tables[EVENT_TABLE_PREFIX + name]
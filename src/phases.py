@@ -0,0 +1,118 @@
+"""
+Index of the phases of a match
+
+A PhaseIndex is filled from game events while a demo is parsed and ends up
+with one row per warmup, half, overtime half, round and the time after the
+match, each with its start and end tick and the file offsets of the frames
+it starts and ends at. Ranges are half open, a phase covers the frames from
+start_offset up to but not including end_offset.
+
+    index = DemoParser().phases('match.dem')
+    DemoParser().parse_live('match.dem', index)     # warmup isn't decoded
+"""
+
+import json
+from collections import namedtuple
+
+Phase = namedtuple('Phase', ['kind', 'number', 'start_tick', 'end_tick',
+                             'start_offset', 'end_offset'])
+
+REGULATION_HALVES = 2       # halves after these are overtime
+NOT_LIVE = ('warmup', 'postgame')
+
+
+class PhaseIndex():
+    """phases of one demo, built from game events"""
+    def __init__(self, start_tick=0, start_offset=1072):
+        self.phases = []    # finished Phase rows
+        # kind -> [number, start_tick, start_offset] for phases still going
+        self.open = {'warmup': [0, start_tick, start_offset]}
+        self.halves = 0
+        self.rounds = 0
+
+    def begin(self, kind, number, tick, offset):
+        self.open[kind] = [number, tick, offset]
+
+    def end(self, kind, tick, offset):
+        started = self.open.pop(kind, None)
+        if started is not None:
+            number, start_tick, start_offset = started
+            self.phases.append(Phase(kind, number, start_tick, tick,
+                                     start_offset, offset))
+
+    def begin_half(self, tick, offset):
+        self.halves += 1
+        if self.halves > REGULATION_HALVES:
+            self.begin('overtime', self.halves - REGULATION_HALVES, tick, offset)
+        else:
+            self.begin('half', self.halves, tick, offset)
+
+    def end_half(self, tick, offset):
+        self.end('half', tick, offset)
+        self.end('overtime', tick, offset)
+
+    def game_event(self, name, tick, offset):
+        """handles a game event, everything but the phase events is ignored"""
+        if name == 'round_announce_match_start':
+            if self.halves:
+                # the match was restarted, whatever came before was warmup
+                first = next(iter(self.of_kind('warmup')), None)
+                self.phases.clear()
+                self.open.clear()
+                self.halves = 0
+                if first is not None:
+                    self.open['warmup'] = [0, first.start_tick, first.start_offset]
+            self.end('warmup', tick, offset)
+            self.rounds = 0
+            self.begin_half(tick, offset)
+        elif not self.halves:
+            return
+        elif name == 'round_start':
+            self.end('round', tick, offset)
+            self.rounds += 1
+            self.begin('round', self.rounds, tick, offset)
+        elif name == 'round_officially_ended':
+            self.end('round', tick, offset)
+        elif name == 'announce_phase_end':
+            self.end_half(tick, offset)
+            self.begin_half(tick, offset)
+        elif name == 'cs_win_panel_match':
+            self.end('round', tick, offset)
+            self.end_half(tick, offset)
+            self.begin('postgame', 0, tick, offset)
+
+    def finish(self, tick, offset):
+        """ends everything still open at the last frame"""
+        for kind in list(self.open):
+            self.end(kind, tick, offset)
+        self.phases.sort(key=lambda phase: (phase.start_offset, phase.kind != 'round'))
+
+    def of_kind(self, *kinds):
+        return [phase for phase in self.phases if phase.kind in kinds]
+
+    def live_ranges(self):
+        """(start_offset, end_offset) of the halves and overtime"""
+        return [(phase.start_offset, phase.end_offset)
+                for phase in self.of_kind('half', 'overtime')]
+
+    def not_live_ranges(self):
+        """(start_offset, end_offset) of warmup and whatever came after the match"""
+        return [(phase.start_offset, phase.end_offset) for phase in self.of_kind(*NOT_LIVE)]
+
+    def table(self):
+        """the phases as a dict of columns"""
+        return {field: [getattr(phase, field) for phase in self.phases]
+                for field in Phase._fields}
+
+    def dumps(self):
+        """json of the index, so later passes don't have to build it again"""
+        return json.dumps(self.phases)
+
+    @classmethod
+    def loads(cls, text):
+        index = cls()
+        index.open.clear()
+        index.phases = [Phase(*row) for row in json.loads(text)]
+        index.halves = len(index.of_kind('half', 'overtime'))
+        index.rounds = len(index.of_kind('round'))
+        return index
@@ -0,0 +1,112 @@
+"""
+Counters for figuring out where parse time goes
+
+The parser only calls into this when demo_parse_test.PROFILER is set, so
+leaving it off costs one comparison per message. Times are kept inclusive
+and as self time, without what was timed inside them. Game events, user
+messages and entity classes are timed inside their net messages, so the
+overall ranking uses self time to not count them twice.
+"""
+
+import sys
+from time import perf_counter
+
+import cstrike15_usermessages_public_pb2
+import netmessages_public_pb2
+
+NET_MESSAGE_NAMES = dict((value, name) for name, value in
+                         netmessages_public_pb2.NET_Messages.items() +
+                         netmessages_public_pb2.SVC_Messages.items())
+USER_MESSAGE_NAMES = dict((value, name) for name, value in
+                          cstrike15_usermessages_public_pb2.ECstrike15UserMessages.items())
+
+CATEGORY_NAMES = {'net_message': NET_MESSAGE_NAMES,
+                  'user_message': USER_MESSAGE_NAMES}
+
+
+def key_name(category, key):
+    """readable name for a key, message ids are looked up in the protobuf enums"""
+    names = CATEGORY_NAMES.get(category)
+    if names is not None:
+        return '{} ({})'.format(names.get(key, 'unknown'), key)
+    return str(key)
+
+
+class Profiler():
+    """counts messages, bytes and time per category and key"""
+    def __init__(self):
+        # (category, key) -> [count, bytes, seconds, self seconds]
+        self.counters = {}
+        # seconds added so far inside each time call that's running
+        self.nested = []
+        self.started = perf_counter()
+
+    def add(self, category, key, size, seconds, nested_seconds=0.0):
+        """
+        adds one message of size bytes that took seconds to handle,
+        nested_seconds of which were counted under other keys
+        """
+        if self.nested:
+            self.nested[-1] += seconds
+        self_seconds = seconds - nested_seconds
+        counter = self.counters.get((category, key))
+        if counter is None:
+            self.counters[(category, key)] = [1, size, seconds, self_seconds]
+        else:
+            counter[0] += 1
+            counter[1] += size
+            counter[2] += seconds
+            counter[3] += self_seconds
+
+    def time(self, category, key, size, function, *args):
+        """calls function(*args) and adds how long it took"""
+        self.nested.append(0.0)
+        start = perf_counter()
+        try:
+            result = function(*args)
+        finally:
+            nested_seconds = self.nested.pop()
+        self.add(category, key, size, perf_counter() - start, nested_seconds)
+        return result
+
+    def ranked(self, category=None, self_time=False):
+        """
+        counters sorted by time spent, or by self time, optionally only for
+        one category
+        """
+        column = 3 if self_time else 2
+        entries = [(category_key, counter)
+                   for category_key, counter in self.counters.items()
+                   if category is None or category_key[0] == category]
+        entries.sort(key=lambda entry: entry[1][column], reverse=True)
+        return entries
+
+    def report(self, limit=15, out=sys.stdout):
+        """prints the hottest keys overall and then per category"""
+        elapsed = perf_counter() - self.started
+        print('--- PROFILE ({:.3f} s total) ---'.format(elapsed), file=out)
+        categories = sorted(set(category for category, _ in self.counters))
+
+        # by self time, the same time is never counted under two keys
+        print('\nhottest overall (self time):', file=out)
+        self.print_entries(self.ranked(self_time=True)[:limit], elapsed, out, True)
+
+        # times are inclusive, game events are part of their net messages
+        for category in categories:
+            entries = self.ranked(category)
+            print('\n{}:'.format(category), file=out)
+            self.print_entries(entries[:limit], elapsed, out)
+            if len(entries) > limit:
+                print(' ... {} more'.format(len(entries) - limit), file=out)
+
+    def print_entries(self, entries, elapsed, out, self_time=False):
+        """prints one table of the report, % is of self time if self_time is set"""
+        print(' {:<44} {:>9} {:>12} {:>10} {:>10} {:>9} {:>6}'.format(
+            'name', 'count', 'bytes', 'ms', 'self ms', 'us/each', '%'), file=out)
+        for (category, key), (count, size, seconds, self_seconds) in entries:
+            share = self_seconds if self_time else seconds
+            print(' {:<44} {:>9} {:>12} {:>10.1f} {:>10.1f} {:>9.1f} {:>6.1f}'.format(
+                '{}:{}'.format(category, key_name(category, key))[:44],
+                count, size, seconds * 1000, self_seconds * 1000,
+                seconds * 1e6 / count,
+                100 * share / elapsed if elapsed else 0), file=out)
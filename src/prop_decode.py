@@ -0,0 +1,558 @@
+"""
+Compiled decoders for entity props
+
+Every server class gets a ClassDecoder the first time one of its entities
+is read. It holds one entry per flattened prop: a function that decodes the
+prop, and for props that are always the same number of bits wide, that
+width. Props nobody subscribed to are stepped over by moving the bit cursor
+instead of being decoded, and classes with no subscribed props at all are
+only walked.
+
+Without any subscriptions every prop of every class is decoded:
+
+    prop_decode.subscribe_props('CCSPlayer', ['m_vecOrigin', 'm_iHealth'])
+
+The decoding follows demofilepropdecode.cpp from demoinfogo, except that
+float props are decoded with values worked out when the data tables are
+flattened: lookup tables for narrow quantized floats, normals and coord
+fractions, and a scale and offset for wider quantized floats.
+"""
+
+import math
+from collections import namedtuple
+
+# send prop types, same as SEND_PROP_TYPE in demo_parse_test
+DPT_Int = 0
+DPT_Float = 1
+DPT_Vector = 2
+DPT_VectorXY = 3
+DPT_String = 4
+DPT_Array = 5
+DPT_DataTable = 6
+DPT_Int64 = 7
+
+# send prop flags
+SPROP_UNSIGNED = 1 << 0
+SPROP_COORD = 1 << 1
+SPROP_NOSCALE = 1 << 2
+SPROP_ROUNDDOWN = 1 << 3
+SPROP_ROUNDUP = 1 << 4
+SPROP_NORMAL = 1 << 5
+SPROP_EXCLUDE = 1 << 6
+SPROP_XYZE = 1 << 7
+SPROP_INSIDEARRAY = 1 << 8
+SPROP_PROXY_ALWAYS_YES = 1 << 9
+SPROP_IS_A_VECTOR_ELEM = 1 << 10
+SPROP_COLLAPSIBLE = 1 << 11
+SPROP_COORD_MP = 1 << 12
+SPROP_COORD_MP_LOWPRECISION = 1 << 13
+SPROP_COORD_MP_INTEGRAL = 1 << 14
+SPROP_CELL_COORD = 1 << 15
+SPROP_CELL_COORD_LOWPRECISION = 1 << 16
+SPROP_CELL_COORD_INTEGRAL = 1 << 17
+SPROP_CHANGES_OFTEN = 1 << 18
+SPROP_VARINT = 1 << 19
+
+COORD_INTEGER_BITS = 14
+COORD_FRACTIONAL_BITS = 5
+COORD_RESOLUTION = 1.0 / (1 << COORD_FRACTIONAL_BITS)
+COORD_INTEGER_BITS_MP = 11
+COORD_FRACTIONAL_BITS_MP_LOWPRECISION = 3
+COORD_RESOLUTION_LOWPRECISION = 1.0 / (1 << COORD_FRACTIONAL_BITS_MP_LOWPRECISION)
+NORMAL_FRACTIONAL_BITS = 11
+NORMAL_RESOLUTION = 1.0 / ((1 << NORMAL_FRACTIONAL_BITS) - 1)
+
+DT_MAX_STRING_BITS = 9
+DT_MAX_STRING_BUFFERSIZE = 1 << DT_MAX_STRING_BITS
+
+FIELD_INDEX_END = 0xFFF
+
+Vector = namedtuple('Vector', ['x', 'y', 'z'])
+
+# class name -> set of prop names, empty means everything is decoded
+SUBSCRIPTIONS = {}
+_COMPILED = {}      # id of a ServerClass -> ClassDecoder
+
+
+def subscribe_props(class_name, prop_names):
+    """
+    only decode prop_names for entities of class_name. Once anything is
+    subscribed, classes without subscriptions are skipped entirely.
+    """
+    SUBSCRIPTIONS.setdefault(class_name, set()).update(prop_names)
+    _COMPILED.clear()
+
+
+def clear_subscriptions():
+    SUBSCRIPTIONS.clear()
+    _COMPILED.clear()
+
+
+def wanted_props(class_name):
+    """set of prop names to decode for class_name, None for all of them"""
+    if not SUBSCRIPTIONS:
+        return None
+    return SUBSCRIPTIONS.get(class_name, frozenset())
+
+
+# reading single values, straight ports of the engine's readers. The
+# decoders further down use the precomputed versions instead, these are kept
+# as the reference they're checked against.
+
+def read_bit_coord(reader):
+    value = 0.0
+    has_int = reader.read_bit()
+    has_fract = reader.read_bit()
+    if has_int or has_fract:
+        sign = reader.read_bit()
+        int_value = reader.read_bits(COORD_INTEGER_BITS) + 1 if has_int else 0
+        fract_value = reader.read_bits(COORD_FRACTIONAL_BITS) if has_fract else 0
+        value = int_value + fract_value * COORD_RESOLUTION
+        if sign:
+            value = -value
+    return value
+
+
+def read_bit_coord_mp(reader, integral, low_precision):
+    in_bounds = reader.read_bit()
+    int_bits = COORD_INTEGER_BITS_MP if in_bounds else COORD_INTEGER_BITS
+    if integral:
+        value = 0.0
+        if reader.read_bit():
+            sign = reader.read_bit()
+            value = float(reader.read_bits(int_bits) + 1)
+            if sign:
+                value = -value
+        return value
+    has_int = reader.read_bit()
+    sign = reader.read_bit()
+    int_value = reader.read_bits(int_bits) + 1 if has_int else 0
+    if low_precision:
+        value = (int_value + reader.read_bits(COORD_FRACTIONAL_BITS_MP_LOWPRECISION) *
+                 COORD_RESOLUTION_LOWPRECISION)
+    else:
+        value = int_value + reader.read_bits(COORD_FRACTIONAL_BITS) * COORD_RESOLUTION
+    return -value if sign else value
+
+
+def read_bit_normal(reader):
+    sign = reader.read_bit()
+    value = reader.read_bits(NORMAL_FRACTIONAL_BITS) * NORMAL_RESOLUTION
+    return -value if sign else value
+
+
+def read_bit_cell_coord(reader, bits, integral, low_precision):
+    if integral:
+        return float(reader.read_bits(bits))
+    int_value = reader.read_bits(bits)
+    if low_precision:
+        return (int_value + reader.read_bits(COORD_FRACTIONAL_BITS_MP_LOWPRECISION) *
+                COORD_RESOLUTION_LOWPRECISION)
+    return int_value + reader.read_bits(COORD_FRACTIONAL_BITS) * COORD_RESOLUTION
+
+
+def read_quantized_float(reader, prop):
+    raw = reader.read_bits(prop.num_bits)
+    value = raw / ((1 << prop.num_bits) - 1)
+    return prop.low_value + (prop.high_value - prop.low_value) * value
+
+
+# precomputed float decoding. Bits come least significant first, so fields
+# that follow each other can be read with one read_bits and split with
+# shifts, the first field ends up in the lowest bits.
+
+FLOAT_TABLE_BITS = 12   # quantized floats up to this wide get a lookup table
+
+# fraction bits -> value
+COORD_FRACTIONS = tuple(fract * COORD_RESOLUTION
+                        for fract in range(1 << COORD_FRACTIONAL_BITS))
+COORD_FRACTIONS_LOWPRECISION = tuple(fract * COORD_RESOLUTION_LOWPRECISION
+                                     for fract in range(1 << COORD_FRACTIONAL_BITS_MP_LOWPRECISION))
+
+
+def normal_table():
+    """sign bit followed by the fraction bits -> value"""
+    table = []
+    for raw in range(1 << (1 + NORMAL_FRACTIONAL_BITS)):
+        value = (raw >> 1) * NORMAL_RESOLUTION
+        table.append(-value if raw & 1 else value)
+    return tuple(table)
+
+NORMAL_TABLE = normal_table()
+NORMAL_BITS = 1 + NORMAL_FRACTIONAL_BITS
+
+_FLOAT_DECODERS = {}    # (flags, num_bits, low_value, high_value) -> function
+
+
+def read_normal(reader):
+    return NORMAL_TABLE[reader.read_bits(NORMAL_BITS)]
+
+
+COORD_BITS = 1 + COORD_INTEGER_BITS + COORD_FRACTIONAL_BITS
+COORD_INTEGER_MASK = (1 << COORD_INTEGER_BITS) - 1
+COORD_FRACTION_SHIFT = 1 + COORD_INTEGER_BITS
+
+
+def read_coord(reader):
+    present = reader.read_bits(2)   # has integer part, has fraction
+    if present == 3:
+        raw = reader.read_bits(COORD_BITS)
+        value = (((raw >> 1) & COORD_INTEGER_MASK) + 1 +
+                 COORD_FRACTIONS[raw >> COORD_FRACTION_SHIFT])
+    elif present == 1:
+        raw = reader.read_bits(COORD_FRACTION_SHIFT)
+        value = float((raw >> 1) + 1)
+    elif present == 2:
+        raw = reader.read_bits(1 + COORD_FRACTIONAL_BITS)
+        value = COORD_FRACTIONS[raw >> 1]
+    else:
+        return 0.0
+    return -value if raw & 1 else value
+
+
+def coord_mp_decoder(integral, low_precision):
+    if integral:
+        def read_coord_mp_integral(reader):
+            head = reader.read_bits(2)      # in bounds, has a value
+            if not head & 2:
+                return 0.0
+            int_bits = COORD_INTEGER_BITS_MP if head & 1 else COORD_INTEGER_BITS
+            raw = reader.read_bits(1 + int_bits)
+            value = float((raw >> 1) + 1)
+            return -value if raw & 1 else value
+        return read_coord_mp_integral
+
+    if low_precision:
+        fractions = COORD_FRACTIONS_LOWPRECISION
+        fract_bits = COORD_FRACTIONAL_BITS_MP_LOWPRECISION
+    else:
+        fractions = COORD_FRACTIONS
+        fract_bits = COORD_FRACTIONAL_BITS
+
+    def read_coord_mp(reader):
+        head = reader.read_bits(3)          # in bounds, has integer part, sign
+        if head & 2:
+            int_bits = COORD_INTEGER_BITS_MP if head & 1 else COORD_INTEGER_BITS
+            raw = reader.read_bits(int_bits + fract_bits)
+            value = (raw & ((1 << int_bits) - 1)) + 1 + fractions[raw >> int_bits]
+        else:
+            value = fractions[reader.read_bits(fract_bits)]
+        return -value if head & 4 else value
+    return read_coord_mp
+
+
+def cell_coord_decoder(bits, integral, low_precision):
+    if integral:
+        return lambda reader: float(reader.read_bits(bits))
+    if low_precision:
+        fractions = COORD_FRACTIONS_LOWPRECISION
+        fract_bits = COORD_FRACTIONAL_BITS_MP_LOWPRECISION
+    else:
+        fractions = COORD_FRACTIONS
+        fract_bits = COORD_FRACTIONAL_BITS
+    total_bits = bits + fract_bits
+    int_mask = (1 << bits) - 1
+
+    def read_cell_coord(reader):
+        raw = reader.read_bits(total_bits)
+        return (raw & int_mask) + fractions[raw >> bits]
+    return read_cell_coord
+
+
+def quantized_decoder(prop):
+    """
+    a table of every value for narrow props, otherwise scale and offset so
+    a value is one multiply-add
+    """
+    bits = prop.num_bits
+    low = prop.low_value
+    high = prop.high_value
+    divisor = (1 << bits) - 1
+    if bits <= FLOAT_TABLE_BITS:
+        # same arithmetic as read_quantized_float so the values match exactly
+        table = tuple(low + (high - low) * (raw / divisor) for raw in range(1 << bits))
+        return lambda reader: table[reader.read_bits(bits)]
+    scale = (high - low) / divisor
+    return lambda reader: low + reader.read_bits(bits) * scale
+
+
+def build_float_decoder(prop):
+    flags = prop.flags
+    bits = prop.num_bits
+    if flags & SPROP_COORD:
+        return read_coord
+    if flags & SPROP_COORD_MP:
+        return coord_mp_decoder(False, False)
+    if flags & SPROP_COORD_MP_LOWPRECISION:
+        return coord_mp_decoder(False, True)
+    if flags & SPROP_COORD_MP_INTEGRAL:
+        return coord_mp_decoder(True, False)
+    if flags & SPROP_NOSCALE:
+        return lambda reader: reader.read_float()
+    if flags & SPROP_NORMAL:
+        return read_normal
+    if flags & SPROP_CELL_COORD:
+        return cell_coord_decoder(bits, False, False)
+    if flags & SPROP_CELL_COORD_LOWPRECISION:
+        return cell_coord_decoder(bits, False, True)
+    if flags & SPROP_CELL_COORD_INTEGRAL:
+        return cell_coord_decoder(bits, True, False)
+    return quantized_decoder(prop)
+
+
+def float_key(prop):
+    return (prop.flags, prop.num_bits, prop.low_value, prop.high_value)
+
+
+def float_decoder(prop):
+    """
+    function that reads a float prop. Props with the same encoding share
+    one, so most are already built when the data tables are flattened.
+    """
+    key = float_key(prop)
+    decoder = _FLOAT_DECODERS.get(key)
+    if decoder is None:
+        decoder = build_float_decoder(prop)
+        _FLOAT_DECODERS[key] = decoder
+    return decoder
+
+
+def precompute_floats(flattened_props):
+    """builds the float decoders for a class's props ahead of its first entity"""
+    for entry in flattened_props:
+        for prop in (entry.prop, entry.array_element_prop):
+            if prop is not None and prop.type in (DPT_Float, DPT_Vector, DPT_VectorXY):
+                float_decoder(prop)
+
+
+def float_width(prop):
+    """bits a float prop always takes, None if it depends on the value"""
+    flags = prop.flags
+    if flags & (SPROP_COORD | SPROP_COORD_MP | SPROP_COORD_MP_LOWPRECISION |
+                SPROP_COORD_MP_INTEGRAL):
+        return None
+    if flags & SPROP_NOSCALE:
+        return 32
+    if flags & SPROP_NORMAL:
+        return 1 + NORMAL_FRACTIONAL_BITS
+    if flags & SPROP_CELL_COORD:
+        return prop.num_bits + COORD_FRACTIONAL_BITS
+    if flags & SPROP_CELL_COORD_LOWPRECISION:
+        return prop.num_bits + COORD_FRACTIONAL_BITS_MP_LOWPRECISION
+    return prop.num_bits
+
+
+def int_decoder(prop):
+    bits = prop.num_bits
+    if prop.flags & SPROP_VARINT:
+        if prop.flags & SPROP_UNSIGNED:
+            return lambda reader: reader.read_var_int32()
+        return lambda reader: reader.read_signed_var_int32()
+    if prop.flags & SPROP_UNSIGNED:
+        return lambda reader: reader.read_bits(bits)
+    return lambda reader: reader.read_signed(bits)
+
+
+def int64_decoder(prop):
+    bits = prop.num_bits
+    if prop.flags & SPROP_VARINT:
+        if prop.flags & SPROP_UNSIGNED:
+            return read_var_int64
+
+        def read_signed_var_int64(reader):
+            value = read_var_int64(reader)
+            return (value >> 1) ^ -(value & 1)
+        return read_signed_var_int64
+    if prop.flags & SPROP_UNSIGNED:
+        return lambda reader: reader.read_bits(32) | (reader.read_bits(bits - 32) << 32)
+
+    def read_signed_int64(reader):
+        negative = reader.read_bit()
+        value = reader.read_bits(32) | (reader.read_bits(bits - 32 - 1) << 32)
+        return -value if negative else value
+    return read_signed_int64
+
+
+def read_var_int64(reader):
+    result = 0
+    for shift in range(0, 70, 7):
+        byte = reader.read_bits(8)
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            break
+    return result & 0xffffffffffffffff
+
+
+def read_string(reader):
+    length = reader.read_bits(DT_MAX_STRING_BITS)
+    if length >= DT_MAX_STRING_BUFFERSIZE:
+        length = DT_MAX_STRING_BUFFERSIZE - 1
+    return reader.read_bytes(length).decode('utf-8', 'replace')
+
+
+def vector_decoder(prop):
+    read_float = float_decoder(prop)
+    if not prop.flags & SPROP_NORMAL:
+        return lambda reader: Vector(read_float(reader), read_float(reader), read_float(reader))
+
+    def read_normal_vector(reader):
+        x = read_float(reader)
+        y = read_float(reader)
+        sign = reader.read_bit()
+        length = x * x + y * y
+        z = math.sqrt(1.0 - length) if length < 1.0 else 0.0
+        return Vector(x, y, -z if sign else z)
+    return read_normal_vector
+
+
+def array_decoder(prop, element_prop):
+    count_bits = prop.num_elements.bit_length()
+    read_element = prop_decoder(element_prop, None)
+    return lambda reader: [read_element(reader) for _ in range(reader.read_bits(count_bits))]
+
+
+def prop_decoder(prop, element_prop):
+    """function that reads one value of prop from a BitReader"""
+    prop_type = prop.type
+    if prop_type == DPT_Int:
+        return int_decoder(prop)
+    if prop_type == DPT_Float:
+        return float_decoder(prop)
+    if prop_type == DPT_Vector:
+        return vector_decoder(prop)
+    if prop_type == DPT_VectorXY:
+        read_float = float_decoder(prop)
+        return lambda reader: (read_float(reader), read_float(reader))
+    if prop_type == DPT_String:
+        return read_string
+    if prop_type == DPT_Array:
+        return array_decoder(prop, element_prop)
+    if prop_type == DPT_Int64:
+        return int64_decoder(prop)
+    raise ValueError('can not decode prop {} of type {}'.format(prop.var_name, prop_type))
+
+
+def prop_width(prop):
+    """bits prop always takes, None if it depends on the value"""
+    prop_type = prop.type
+    if prop_type in (DPT_Int, DPT_Int64):
+        return None if prop.flags & SPROP_VARINT else prop.num_bits
+    if prop_type == DPT_Float:
+        return float_width(prop)
+    if prop_type == DPT_VectorXY:
+        width = float_width(prop)
+        return None if width is None else 2 * width
+    if prop_type == DPT_Vector:
+        width = float_width(prop)
+        if width is None:
+            return None
+        return 2 * width + 1 if prop.flags & SPROP_NORMAL else 3 * width
+    return None
+
+
+# decoding entities
+
+def read_field_index(reader, last_index, new_way):
+    """next changed prop index after last_index, -1 at the end of the list"""
+    if new_way and reader.read_bit():
+        return last_index + 1
+    if new_way and reader.read_bit():
+        ret = reader.read_bits(3)
+    else:
+        ret = reader.read_bits(7)
+        extra = ret & (32 | 64)
+        if extra == 32:
+            ret = (ret & ~96) | (reader.read_bits(2) << 5)
+        elif extra == 64:
+            ret = (ret & ~96) | (reader.read_bits(4) << 5)
+        elif extra == 96:
+            ret = (ret & ~96) | (reader.read_bits(7) << 5)
+    if ret == FIELD_INDEX_END:
+        return -1
+    return last_index + 1 + ret
+
+
+def read_field_indices(reader):
+    """list of the prop indices that changed in an entity update"""
+    new_way = reader.read_bit()
+    indices = []
+    index = read_field_index(reader, -1, new_way)
+    while index != -1:
+        indices.append(index)
+        index = read_field_index(reader, index, new_way)
+    return indices
+
+
+class ClassDecoder():
+    """reads entity updates for one server class"""
+    __slots__ = ('name', 'props', 'decoders', 'widths', 'wanted', 'prop_indices')
+
+    def __init__(self, name, flattened_props, wanted=None):
+        """flattened_props in prop index order, wanted is a set of names or None for all"""
+        self.name = name
+        self.props = [entry.prop for entry in flattened_props]
+        self.decoders = [prop_decoder(entry.prop, entry.array_element_prop)
+                         for entry in flattened_props]
+        self.widths = [prop_width(entry.prop) for entry in flattened_props]
+        self.wanted = [wanted is None or entry.prop.var_name in wanted
+                       for entry in flattened_props]
+        self.prop_indices = {entry.prop.var_name: index
+                             for index, entry in enumerate(flattened_props)}
+
+    def decode(self, reader, values):
+        """
+        reads one entity update into values (prop index -> value), returns
+        the indices of the props that changed
+        """
+        indices = read_field_indices(reader)
+        decoders = self.decoders
+        widths = self.widths
+        wanted = self.wanted
+        try:
+            for index in indices:
+                if wanted[index]:
+                    values[index] = decoders[index](reader)
+                elif widths[index] is not None:
+                    reader.skip(widths[index])
+                else:
+                    decoders[index](reader)
+        except IndexError:
+            raise ValueError('{} has no prop {}'.format(self.name, index))
+        return indices
+
+
+class SkipDecoder(ClassDecoder):
+    """decoder for classes nothing is subscribed to, only walks the bits"""
+    __slots__ = ()
+
+    def decode(self, reader, values):
+        indices = read_field_indices(reader)
+        decoders = self.decoders
+        widths = self.widths
+        skip = reader.skip
+        try:
+            for index in indices:
+                width = widths[index]
+                if width is not None:
+                    skip(width)
+                else:
+                    decoders[index](reader)
+        except IndexError:
+            raise ValueError('{} has no prop {}'.format(self.name, index))
+        return indices
+
+
+def class_decoder(server_class):
+    """the compiled decoder for a ServerClass, built on first use"""
+    decoder = _COMPILED.get(id(server_class))
+    if decoder is None:
+        wanted = wanted_props(server_class.strName)
+        decoder_type = SkipDecoder if wanted is not None and not wanted else ClassDecoder
+        decoder = decoder_type(server_class.strName, server_class.flattened_props, wanted)
+        _COMPILED[id(server_class)] = decoder
+    return decoder
+
+
+def clear_compiled():
+    """forgets the decoders, for when the server classes change"""
+    _COMPILED.clear()
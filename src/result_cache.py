@@ -0,0 +1,174 @@
+"""
+Content addressed cache of parse results
+
+Results are keyed by a hash of the demo's bytes, the parser version, the
+record types that were asked for and the demo_parse_test options that change
+what a parse emits (see parse_options), so a demo that is uploaded again
+under a different name or parsed again with the same options comes straight
+out of the cache. Entries live as files under the cache directory; once it grows
+past max_bytes the least recently used entries are removed.
+
+    cache = ResultCache()
+    records = cached_parse('match.dem', cache=cache)
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import demo_parse_test
+import demo_parser
+import prop_decode
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'demoparse')
+CACHE_MAX_BYTES = 1024 ** 3     # 1 GiB
+HASH_CHUNK_SIZE = 1024 * 1024   # bytes read at a time while hashing
+
+
+def file_digest(path, chunk_size=HASH_CHUNK_SIZE):
+    """blake2b hex digest of a file, read in chunks"""
+    digest = hashlib.blake2b()
+    with open(path, 'rb', buffering=0) as demo_file:
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while True:
+            count = demo_file.readinto(buf)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+def sorted_or_none(values):
+    return None if values is None else sorted(values)
+
+
+def parse_options(game_events=True):
+    """
+    canonical summary of the demo_parse_test globals that change which
+    records a parse emits, game_events is what DemoParser gets
+    """
+    dumps = {name: bool(value) for name, value in vars(demo_parse_test).items()
+             if name.startswith('DUMP_')}
+    if game_events:
+        dumps['DUMP_GAME_EVENTS'] = True
+    options = {'dump': dumps,
+               'extra_player_info': bool(demo_parse_test.SHOW_EXTRA_PLAYER_INFO_IN_GAME_EVENTS),
+               'ignored_game_events': sorted(demo_parse_test.IGNORED_GAME_EVENTS),
+               'skip_net_messages': sorted(demo_parse_test.SKIP_NET_MESSAGES),
+               'user_messages': sorted_or_none(demo_parse_test.SUBSCRIBED_USER_MESSAGES),
+               'skip_frames': sorted(map(list, demo_parse_test.SKIP_FRAME_RANGES)),
+               'subscriptions': {class_name: sorted(prop_names) for class_name, prop_names
+                                 in prop_decode.SUBSCRIPTIONS.items()}}
+    return json.dumps(options, sort_keys=True, separators=(',', ':'))
+
+
+def cache_key(digest, outputs=None, options=None):
+    """key for the results of parsing the demo with digest, outputs is an
+    iterable of record types or None for all of them, options is from
+    parse_options and is taken from the current globals when it's None"""
+    wanted = ','.join(sorted(outputs)) if outputs is not None else '*'
+    if options is None:
+        options = parse_options()
+    key = '{}:{}:{}:{}'.format(digest, demo_parse_test.PARSER_VERSION, wanted, options)
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=20).hexdigest()
+
+
+class ResultCache():
+    """records stored as pickles under directory, evicted least recently used first"""
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """the records stored under key, or None if they are not cached"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as entry:
+                records = pickle.load(entry)
+            os.utime(path)      # mtime is the last use for eviction
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            # missing, or removed by another process while it was read
+            return None
+        return records
+
+    def put(self, key, records):
+        """stores records under key, then evicts if the cache is too big"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write somewhere else first so readers never see half an entry
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry:
+                pickle.dump(records, entry, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """(mtime, size, path) of every entry"""
+        entries = []
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """removes the least recently used entries until the cache fits in max_bytes"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        for _, _, path in self.entries():
+            os.remove(path)
+
+
+def filter_records(records, outputs):
+    """keeps the records whose type is in outputs, all of them if outputs is None"""
+    if outputs is None:
+        return records
+    return [record for record in records if record[0] in outputs]
+
+
+def cached_parse(path, outputs=None, cache=None):
+    """
+    parses the demo at path unless its results are already in cache, returns
+    (records, True if they came from the cache)
+    """
+    if cache is None:
+        cache = ResultCache()
+    key = cache_key(file_digest(path), outputs)
+    records = cache.get(key)
+    if records is not None:
+        return records, True
+    records = filter_records(demo_parser.DemoParser().parse(path), outputs)
+    cache.put(key, records)
+    return records, False
@@ -0,0 +1,371 @@
+"""
+Parsed demos split into independently compressed rounds
+
+Same tables as parsed_demo, but the tracks, game events and kills of every
+round are a chunk of their own: a parsed_demo container compressed with
+zlib. The players, weapons, kill names and phases are in a 'shared' chunk,
+and whatever
+happened outside of a round (warmup, between halves, after the match) is in
+'other'. A round has the ticks from its start tick up to and including its
+end tick, so the round_officially_ended that ends it is in its chunk, and a
+tick that ends one round and starts the next goes to the next. Rounds are
+named after their number and start tick, numbers can repeat when a match
+is restarted. A json footer at the end of the file gives the byte range and tick
+range of every chunk, so a reader only fetches the footer and the chunks it
+wants. That works from a file, or over HTTP from any server that answers
+range requests:
+
+    DemoParser().save_rounds('match.rounds', 'match.dem')
+    with RoundChunks.open('http://127.0.0.1:8000/match.rounds') as chunks:
+        round_17 = chunks.round(17)             # a parsed_demo.ParsedDemo
+        round_17.tracks['x'], round_17.kills['tick']
+
+`demoparse chunk-server DIR` serves a directory with range requests, as a
+stand in for a static file server.
+
+The file is MAGIC and VERSION, the chunks, the footer, and a trailer of
+the footer's offset and size and MAGIC.
+"""
+
+import argparse
+import functools
+import io
+import json
+import os
+import struct
+import sys
+import urllib.request
+import zlib
+from array import array
+from bisect import bisect_right
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import parsed_demo
+
+MAGIC = b'DEMORNDS'
+VERSION = 2
+
+HEADER = struct.Struct('<8sI4x')
+TRAILER = struct.Struct('<QQ8s')
+COMPRESS_LEVEL = 6
+HTTP_TIMEOUT = 30
+COPY_BUFFER_SIZE = 64 * 1024
+
+SHARED = 'shared'
+OTHER = 'other'
+
+
+def round_name(number, start_tick):
+    return 'round {} at {}'.format(number, start_tick)
+
+
+def chunk_bytes(tables, meta=None):
+    """a compressed parsed_demo container holding tables (name -> columns)"""
+    data = io.BytesIO()
+    writer = parsed_demo.ContainerWriter(data)
+    if meta:
+        writer.meta.update(meta)
+    for name, columns in tables.items():
+        writer.add_table(name, columns)
+    writer.close()
+    return zlib.compress(data.getvalue(), COMPRESS_LEVEL)
+
+
+def kill_rows(kill_feed, rows):
+    """the kill feed's columns for the given rows"""
+    return {name: array(column.typecode, (column[row] for row in rows))
+            for name, column in kill_feed.columns.items()}
+
+
+def round_tables(records, kill_feed, kills, track_interval):
+    """
+    the tables of one round, records are the round's (record_type, record)
+    pairs and kills its rows in kill_feed
+    """
+    by_type = parsed_demo.records_by_type(records)
+    tables = {'tracks': parsed_demo.records_to_columns(
+        parsed_demo.sample_tracks(by_type.get('tick', []), track_interval))}
+    if kill_feed is not None:
+        tables['kills'] = kill_rows(kill_feed, kills)
+    else:
+        tables['kills'] = parsed_demo.records_to_columns(by_type.get('kill', []))
+    tables.update(parsed_demo.event_tables(by_type.get('game_event', [])))
+    return tables
+
+
+def write(path, demo, records, kill_feed=None, phase_index=None, parser_version=None,
+          track_interval=parsed_demo.TRACK_INTERVAL):
+    """
+    writes a parsed demo split into rounds, the arguments are the same as
+    for parsed_demo.write. Without a phase index everything is in 'other'.
+    """
+    rounds = [] if phase_index is None else phase_index.of_kind('round')
+    starts = [phase.start_tick for phase in rounds]
+
+    def chunk_of(tick):
+        """index of the round tick is in, None if it isn't in one"""
+        index = bisect_right(starts, tick) - 1
+        if index >= 0 and tick <= rounds[index].end_tick:
+            return index
+        return None
+
+    shared = []
+    per_round = [[] for _ in rounds]
+    other = []
+    for record_type, record in records:
+        if record_type in ('player', 'demo'):
+            shared.append((record_type, record))
+            continue
+        tick = record.get('tick')
+        index = None if tick is None else chunk_of(tick)
+        (other if index is None else per_round[index]).append((record_type, record))
+
+    round_kills = [[] for _ in rounds]
+    other_kills = []
+    if kill_feed is not None:
+        ticks = kill_feed.columns['tick']
+        for row in range(kill_feed.count):
+            index = chunk_of(ticks[row])
+            (other_kills if index is None else round_kills[index]).append(row)
+
+    with open(path, 'wb') as chunk_file:
+        chunk_file.write(HEADER.pack(MAGIC, VERSION))
+        chunks = []
+
+        def add_chunk(name, data, phase=None):
+            entry = {'name': name, 'offset': chunk_file.tell(), 'size': len(data)}
+            if phase is not None:
+                entry.update(number=phase.number, start_tick=phase.start_tick,
+                             end_tick=phase.end_tick)
+            chunks.append(entry)
+            chunk_file.write(data)
+
+        by_type = parsed_demo.records_by_type(shared)
+        shared_tables = {'players': parsed_demo.records_to_columns(by_type.get('player', []))}
+        if kill_feed is not None:
+            shared_tables['weapons'] = {'name': list(kill_feed.weapons)}
+            shared_tables['kill_names'] = parsed_demo.kill_names(kill_feed)
+        if phase_index is not None:
+            shared_tables['phases'] = phase_index.table()
+        add_chunk(SHARED, chunk_bytes(shared_tables, {'header': demo,
+                                                      'parser_version': parser_version,
+                                                      'track_interval': track_interval}))
+
+        for phase, round_records, kills in zip(rounds, per_round, round_kills):
+            add_chunk(round_name(phase.number, phase.start_tick),
+                      chunk_bytes(round_tables(round_records, kill_feed, kills,
+                                               track_interval)), phase)
+        add_chunk(OTHER, chunk_bytes(round_tables(other, kill_feed, other_kills,
+                                                  track_interval)))
+
+        footer = json.dumps({'version': VERSION, 'header': demo,
+                             'chunks': chunks}).encode('utf-8')
+        offset = chunk_file.tell()
+        chunk_file.write(footer)
+        chunk_file.write(TRAILER.pack(offset, len(footer), MAGIC))
+
+
+class FileSource():
+    """byte ranges of a local file"""
+    def __init__(self, path):
+        self.name = path
+        self.file = open(path, 'rb')
+        self.bytes_read = 0
+
+    def read(self, offset, size):
+        self.file.seek(offset)
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def read_tail(self, size):
+        self.file.seek(-size, 2)
+        data = self.file.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class HTTPSource():
+    """byte ranges of a file behind a server that answers range requests"""
+    def __init__(self, url, timeout=HTTP_TIMEOUT):
+        self.name = url
+        self.timeout = timeout
+        self.bytes_read = 0
+        self.requests = 0
+
+    def fetch(self, byte_range):
+        request = urllib.request.Request(self.name, headers={'Range': 'bytes=' + byte_range})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            if response.status != 206:
+                raise ValueError("{} doesn't support range requests".format(self.name))
+            data = response.read()
+        self.requests += 1
+        self.bytes_read += len(data)
+        return data
+
+    def read(self, offset, size):
+        return self.fetch('{}-{}'.format(offset, offset + size - 1))
+
+    def read_tail(self, size):
+        return self.fetch('-{}'.format(size))
+
+    def close(self):
+        pass
+
+
+class RoundChunks():
+    """the footer of a round chunked file, chunks are fetched when asked for"""
+    def __init__(self, source):
+        self.source = source
+        offset, size, magic = TRAILER.unpack(source.read_tail(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError('{} is not a round chunked demo'.format(source.name))
+        footer = json.loads(source.read(offset, size).decode('utf-8'))
+        if footer['version'] != VERSION:
+            raise ValueError('{} is version {}, only {} can be read'.format(
+                source.name, footer['version'], VERSION))
+        self.header = footer['header']
+        self.chunks = {entry['name']: entry for entry in footer['chunks']}
+
+    @classmethod
+    def open(cls, location):
+        """location is a path or an http(s) url"""
+        if location.startswith(('http://', 'https://')):
+            return cls(HTTPSource(location))
+        return cls(FileSource(location))
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def rounds(self):
+        """(number, start_tick, end_tick) of every round"""
+        return [(entry['number'], entry['start_tick'], entry['end_tick'])
+                for entry in self.chunks.values() if 'number' in entry]
+
+    def chunk(self, name):
+        """one chunk as a parsed_demo.ParsedDemo, only its bytes are fetched"""
+        try:
+            entry = self.chunks[name]
+        except KeyError:
+            raise KeyError('{} has no chunk {}'.format(self.source.name, name))
+        data = zlib.decompress(self.source.read(entry['offset'], entry['size']))
+        return parsed_demo.ParsedDemo.from_bytes(data, '{}:{}'.format(self.source.name, name))
+
+    def round(self, number, start_tick=None):
+        """
+        the chunk of round number, if the number was used more than once
+        it's the last of them unless start_tick says which
+        """
+        matches = [entry for entry in self.chunks.values() if entry.get('number') == number
+                   and (start_tick is None or entry['start_tick'] == start_tick)]
+        if not matches:
+            raise KeyError('{} has no round {}'.format(self.source.name, number))
+        last = max(matches, key=lambda entry: entry['start_tick'])
+        return self.chunk(last['name'])
+
+    def shared(self):
+        """the chunk with the players, weapons, kill names and phases"""
+        return self.chunk(SHARED)
+
+    def other(self):
+        """everything that happened outside of a round"""
+        return self.chunk(OTHER)
+
+
+def parse_range(header, size):
+    """
+    (first, last) byte of a single range Range header, both included. None
+    when the range can't be satisfied, False when it isn't one we handle.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return False
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return None
+            return max(size - length, 0), size - 1
+        first = int(first)
+        last = int(last) if last else size - 1
+    except ValueError:
+        return False
+    if first >= size or last < first:
+        return None
+    return first, min(last, size - 1)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """static files, answering single byte range requests with 206"""
+    def do_GET(self):
+        header = self.headers.get('Range')
+        path = self.translate_path(self.path)
+        if header is None or not os.path.isfile(path):
+            super().do_GET()
+            return
+        size = os.path.getsize(path)
+        byte_range = parse_range(header, size)
+        if byte_range is False:
+            super().do_GET()
+            return
+        if byte_range is None:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{}'.format(size))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        first, last = byte_range
+        self.send_response(206)
+        self.send_header('Content-Type', self.guess_type(path))
+        self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, size))
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        with open(path, 'rb') as served_file:
+            served_file.seek(first)
+            left = last - first + 1
+            while left:
+                data = served_file.read(min(left, COPY_BUFFER_SIZE))
+                if not data:
+                    break
+                self.wfile.write(data)
+                left -= len(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(directory, port, host='127.0.0.1'):
+    """serves directory until interrupted"""
+    handler = functools.partial(RangeRequestHandler, directory=directory)
+    server = ThreadingHTTPServer((host, port), handler)
+    print('serving {} on http://{}:{}/'.format(directory, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='demoparse chunk-server',
+                                     description='serves round chunked demos with range requests')
+    parser.add_argument('directory', nargs='?', default='.')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args(argv)
+    serve(args.directory, args.port)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,278 @@
+"""
+SQLite output for parsed demos
+
+Rows are buffered per table and written with executemany inside one large
+transaction per demo. When the database is empty (or the caller asks for
+it) the indexes are dropped while loading and created again when the sink
+is closed, so a first load doesn't pay for index updates on every insert.
+Appending to a database that already has demos in it keeps the indexes,
+rebuilding them would cost more than the inserts save.
+
+usage: python sqlite_sink.py database.sqlite demo1.dem [demo2.dem ...]
+"""
+
+import json
+import logging
+import sqlite3
+import sys
+
+from output_sinks import OutputSink
+
+log = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000      # rows buffered per table before an executemany
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS demos (
+    id INTEGER PRIMARY KEY,
+    path TEXT,
+    map_name TEXT,
+    host_name TEXT,
+    client_name TEXT,
+    gamedir TEXT,
+    dem_prot INTEGER,
+    net_prot INTEGER,
+    time REAL,
+    ticks INTEGER,
+    frames INTEGER,
+    tickrate INTEGER,
+    demo_type INTEGER
+);
+CREATE TABLE IF NOT EXISTS players (
+    demo_id INTEGER REFERENCES demos(id),
+    userid INTEGER,
+    entity INTEGER,
+    xuid INTEGER,
+    name TEXT,
+    guid TEXT,
+    friends_id INTEGER,
+    fakeplayer INTEGER,
+    ishltv INTEGER
+);
+CREATE TABLE IF NOT EXISTS kills (
+    demo_id INTEGER REFERENCES demos(id),
+    tick INTEGER,
+    victim_id INTEGER,
+    attacker_id INTEGER,
+    assister_id INTEGER,
+    weapon TEXT,
+    headshot INTEGER,
+    victim_x REAL,
+    victim_y REAL,
+    victim_z REAL,
+    victim_team TEXT,
+    attacker_x REAL,
+    attacker_y REAL,
+    attacker_z REAL,
+    attacker_team TEXT
+);
+CREATE TABLE IF NOT EXISTS game_events (
+    demo_id INTEGER REFERENCES demos(id),
+    tick INTEGER,
+    name TEXT,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS ticks (
+    demo_id INTEGER REFERENCES demos(id),
+    tick INTEGER,
+    userid INTEGER,
+    x REAL,
+    y REAL,
+    z REAL,
+    pitch REAL,
+    yaw REAL,
+    team TEXT
+);
+"""
+
+INDEXES = {'players_demo': 'players (demo_id, userid)',
+           'kills_demo_tick': 'kills (demo_id, tick)',
+           'game_events_demo_name': 'game_events (demo_id, name, tick)',
+           'ticks_demo_tick': 'ticks (demo_id, tick, userid)'}
+
+# record type -> (table, columns taken from the record after demo_id)
+TABLE_COLUMNS = {'player': ('players', ('userid', 'entity', 'xuid', 'name',
+                                        'guid', 'friends_id', 'fakeplayer',
+                                        'ishltv')),
+                 'kill': ('kills', ('tick', 'victim_id', 'attacker_id',
+                                    'assister_id', 'weapon', 'headshot',
+                                    'victim_x', 'victim_y', 'victim_z',
+                                    'victim_team', 'attacker_x', 'attacker_y',
+                                    'attacker_z', 'attacker_team')),
+                 'tick': ('ticks', ('tick', 'id', 'x', 'y', 'z', 'pitch',
+                                    'yaw', 'team'))}
+
+DEMO_COLUMNS = ('path', 'map_name', 'host_name', 'client_name', 'gamedir',
+                'dem_prot', 'net_prot', 'time', 'ticks', 'frames', 'tickrate',
+                'demo_type')
+
+
+def insert_statement(table, count):
+    """INSERT for table with count columns"""
+    return 'INSERT INTO {} VALUES ({})'.format(table, ', '.join('?' * count))
+
+
+class SQLiteSink(OutputSink):
+    """
+    writes demos, players, kills, game events and player tracks into a
+    sqlite database, other record types are ignored
+    """
+    def __init__(self, path, batch_size=BATCH_SIZE, drop_indexes=None):
+        """
+        opens (or creates) the database at path, the indexes are dropped
+        until close when drop_indexes is true, or when it's None and there
+        are no demos in the database yet
+        """
+        # autocommit mode, transactions are started explicitly
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.batch_size = batch_size
+        self.demo_id = None
+        self.pending = {}   # table -> list of row tuples
+        self.statements = {}
+
+        cursor = self.connection.cursor()
+        cursor.execute('PRAGMA journal_mode = WAL')
+        # NORMAL is safe with WAL, a crash can lose the last commits but
+        # can't corrupt the database
+        cursor.execute('PRAGMA synchronous = NORMAL')
+        cursor.executescript(SCHEMA)
+        if drop_indexes is None:
+            drop_indexes = cursor.execute('SELECT 1 FROM demos LIMIT 1').fetchone() is None
+        if drop_indexes:
+            for name in INDEXES:
+                cursor.execute('DROP INDEX IF EXISTS {}'.format(name))
+
+        for table, columns in TABLE_COLUMNS.values():
+            self.statements[table] = insert_statement(table, len(columns) + 1)
+        self.statements['game_events'] = insert_statement('game_events', 4)
+
+    def begin_demo(self, record):
+        """ends the current demo, then inserts a new one and opens a transaction"""
+        self.end_demo()
+        cursor = self.connection.cursor()
+        cursor.execute('BEGIN')
+        cursor.execute('INSERT INTO demos ({}) VALUES ({})'.format(
+            ', '.join(DEMO_COLUMNS), ', '.join('?' * len(DEMO_COLUMNS))),
+            [record.get(column) for column in DEMO_COLUMNS])
+        self.demo_id = cursor.lastrowid
+
+    def end_demo(self):
+        """flushes everything buffered and commits the demo"""
+        if self.demo_id is None:
+            return
+        for table in self.pending:
+            self.flush(table)
+        self.connection.execute('COMMIT')
+        self.demo_id = None
+
+    def abort_demo(self):
+        """drops the rows of the current demo, its demos row included"""
+        if self.demo_id is None:
+            return
+        self.pending.clear()
+        self.connection.execute('ROLLBACK')
+        self.demo_id = None
+
+    def flush(self, table):
+        """writes the buffered rows of table"""
+        rows = self.pending.get(table)
+        if rows:
+            self.connection.executemany(self.statements[table], rows)
+            rows.clear()
+
+    def add_row(self, table, row):
+        """buffers a row for table, flushing once there are enough of them"""
+        if self.demo_id is None:
+            raise ValueError('record written before a demo record')
+        rows = self.pending.setdefault(table, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(table)
+
+    def write(self, record_type, record):
+        if record_type == 'demo':
+            self.begin_demo(record)
+            return
+        try:
+            table, columns = TABLE_COLUMNS[record_type]
+        except KeyError:
+            return
+        row = [self.demo_id]
+        row.extend(record.get(column) for column in columns)
+        self.add_row(table, row)
+
+    def write_event(self, event_name, record):
+        data = {key: value for key, value in record.items() if key != 'tick'}
+        self.add_row('game_events', (self.demo_id, record.get('tick'), event_name,
+                                     json.dumps(data, default=str)))
+
+    def close(self):
+        """commits the last demo and builds the indexes"""
+        self.end_demo()
+        cursor = self.connection.cursor()
+        for name, target in INDEXES.items():
+            cursor.execute('CREATE INDEX IF NOT EXISTS {} ON {}'.format(name, target))
+        self.connection.close()
+
+
+# demo_parse_test globals ingest_demos sets, the tables need all of these.
+# OUTPUT_SINK is set to the sink and put back afterwards as well
+INGEST_FLAGS = {'DEBUG': False,
+                'DUMP_DEATHS': True,
+                'DUMP_GAME_EVENTS': True,
+                'DUMP_PLAYER_TRACKS': True}
+
+
+def ingest_demos(database, paths, drop_indexes=None):
+    """
+    parses every demo in paths into one database. A demo that fails to
+    parse is rolled back and logged, and the rest are still loaded, so only
+    complete demos end up in it. Returns (path, exception) for each demo
+    that failed. drop_indexes is passed on to SQLiteSink
+    """
+    import demo_parse_test
+
+    saved = {name: getattr(demo_parse_test, name) for name in INGEST_FLAGS}
+    saved['OUTPUT_SINK'] = demo_parse_test.OUTPUT_SINK
+    sink = SQLiteSink(database, drop_indexes=drop_indexes)
+    demo_parse_test.OUTPUT_SINK = sink
+    for name, value in INGEST_FLAGS.items():
+        setattr(demo_parse_test, name, value)
+    failures = []
+    try:
+        for path in paths:
+            log.info('parsing %s', path)
+            try:
+                demo_parse_test.parse_demo(path)
+            except Exception as error:
+                sink.abort_demo()
+                log.exception('failed to parse %s, it was left out', path)
+                failures.append((path, error))
+                continue
+            except BaseException:
+                sink.abort_demo()
+                raise
+            sink.end_demo()
+    finally:
+        for name, value in saved.items():
+            setattr(demo_parse_test, name, value)
+        sink.close()
+    return failures
+
+
+def main(argv):
+    """loads the demos given on the command line"""
+    if len(argv) < 2:
+        print(__doc__.strip().splitlines()[-1])
+        return 1
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    failures = ingest_demos(argv[0], argv[1:])
+    for path, error in failures:
+        print('{}: {}'.format(path, error))
+    if failures:
+        print('{} of {} demos failed'.format(len(failures), len(argv) - 1))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
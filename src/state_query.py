@@ -0,0 +1,174 @@
+"""
+Entity state at any tick, from an entity journal
+
+The journal has a copy of the whole entity table every SNAPSHOT_INTERVAL
+ticks (see entity_journal). state_at(tick) reads the last snapshot at or
+before tick and replays only the changes after it, so opening a journal
+reads nothing but the footer and a query costs at most one interval of
+changes however long the demo is:
+
+    history = StateQuery.open('match.journal')
+    history.prop_at(5, 'm_iHealth', 20000)
+    history.entity_at(5, 20000)     # {prop name: value}
+
+Decompressed blocks and snapshots are kept for the last few queries, since
+queries tend to be close to each other. Float values come back as the
+float32s the journal stores them as.
+"""
+
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from entity_journal import JournalReader, PROP_CLASS, PROP_DELETED
+
+BLOCK_CACHE_SIZE = 4        # decompressed journal blocks kept around
+SNAPSHOT_CACHE_SIZE = 2     # snapshots kept around as entity tables
+
+
+class EntityState():
+    """class id and prop index -> value of one entity"""
+    __slots__ = ('class_id', 'props')
+
+    def __init__(self, class_id, props=None):
+        self.class_id = class_id
+        self.props = {} if props is None else props
+
+    def copy(self):
+        return EntityState(self.class_id, dict(self.props))
+
+
+def apply_change(state, change):
+    """applies one journal row to state, a dict of entity -> EntityState"""
+    entity = change.entity
+    prop = change.prop
+    if prop == PROP_DELETED:
+        state.pop(entity, None)
+        return
+    entity_state = state.get(entity)
+    if prop == PROP_CLASS:
+        # same as add_entity, props are only dropped when the class changes
+        if entity_state is None or entity_state.class_id != change.value:
+            state[entity] = EntityState(change.value)
+        return
+    if entity_state is None:
+        entity_state = state[entity] = EntityState(None)
+    entity_state.props[prop] = change.value
+
+
+def copy_state(state):
+    return {entity: entity_state.copy() for entity, entity_state in state.items()}
+
+
+class StateQuery():
+    """answers what the entities looked like at a tick"""
+    def __init__(self, journal):
+        """journal is a JournalReader"""
+        self.journal = journal
+        self.block_cache = OrderedDict()        # block offset -> (ticks, changes)
+        self.snapshot_cache = OrderedDict()     # snapshot index -> state
+
+    @classmethod
+    def open(cls, path):
+        return cls(JournalReader(path))
+
+    def close(self):
+        self.journal.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def snapshot_before(self, tick):
+        """
+        (snapshot tick, state) of the last snapshot at or before tick, the
+        state has every change before the snapshot tick and must not be
+        changed. None when the journal starts after tick.
+        """
+        index = bisect_right(self.journal.snapshot_ticks, tick) - 1
+        if index < 0:
+            return None
+        snapshot = self.journal.snapshots[index]
+        state = self.snapshot_cache.get(index)
+        if state is not None:
+            self.snapshot_cache.move_to_end(index)
+            return snapshot.tick, state
+        state = {}
+        for change in self.journal.block_changes(snapshot):
+            apply_change(state, change)
+        self.snapshot_cache[index] = state
+        if len(self.snapshot_cache) > SNAPSHOT_CACHE_SIZE:
+            self.snapshot_cache.popitem(last=False)
+        return snapshot.tick, state
+
+    def block_changes(self, block):
+        """(ticks, changes) of a block, decompressed at most once while cached"""
+        cached = self.block_cache.get(block.offset)
+        if cached is not None:
+            self.block_cache.move_to_end(block.offset)
+            return cached
+        changes = list(self.journal.block_changes(block))
+        cached = ([change.tick for change in changes], changes)
+        self.block_cache[block.offset] = cached
+        if len(self.block_cache) > BLOCK_CACHE_SIZE:
+            self.block_cache.popitem(last=False)
+        return cached
+
+    def changes_between(self, start_tick, end_tick):
+        """journal rows with start_tick <= tick <= end_tick"""
+        for block in self.journal.blocks_between(start_tick, end_tick):
+            ticks, changes = self.block_changes(block)
+            first = bisect_left(ticks, start_tick)
+            last = bisect_right(ticks, end_tick)
+            yield from changes[first:last]
+
+    def state_at(self, tick):
+        """
+        the entity table after every change up to and including tick, as a
+        dict of entity -> EntityState
+        """
+        snapshot = self.snapshot_before(tick)
+        if snapshot is None:
+            return {}
+        snapshot_tick, snapshot_state = snapshot
+        state = copy_state(snapshot_state)
+        for change in self.changes_between(snapshot_tick, tick):
+            apply_change(state, change)
+        return state
+
+    def entity_state_at(self, entity, tick):
+        """EntityState of one entity at tick, None if it didn't exist then"""
+        snapshot = self.snapshot_before(tick)
+        if snapshot is None:
+            return None
+        # only this entity's changes are replayed
+        snapshot_tick, snapshot_state = snapshot
+        entity_state = snapshot_state.get(entity)
+        state = {} if entity_state is None else {entity: entity_state.copy()}
+        for change in self.changes_between(snapshot_tick, tick):
+            if change.entity == entity:
+                apply_change(state, change)
+        return state.get(entity)
+
+    def prop_index(self, class_id, prop_name):
+        return self.journal.classes[class_id][1].index(prop_name)
+
+    def entity_at(self, entity, tick):
+        """{prop name: value} of entity at tick, None if it didn't exist then"""
+        entity_state = self.entity_state_at(entity, tick)
+        if entity_state is None:
+            return None
+        if entity_state.class_id not in self.journal.classes:
+            return dict(entity_state.props)
+        names = self.journal.classes[entity_state.class_id][1]
+        return {names[prop]: value for prop, value in entity_state.props.items()}
+
+    def prop_at(self, entity, prop, tick):
+        """value of one prop at tick, prop is an index or a name"""
+        entity_state = self.entity_state_at(entity, tick)
+        if entity_state is None:
+            return None
+        if isinstance(prop, str):
+            prop = self.prop_index(entity_state.class_id, prop)
+        return entity_state.props.get(prop)
@@ -0,0 +1,162 @@
+"""
+Helpers for reading protobuf style varints straight out of byte buffers
+
+These work on bytes or memoryviews and never allocate per byte, which
+makes them a lot cheaper than going through a bitstream for framing.
+"""
+
+
+def read_varint(buf, pos):
+    """reads a varint from buf starting at pos, returns (value, new pos)"""
+    value = 0
+    shift = 0
+    end = len(buf)
+    while True:
+        if pos >= end:
+            raise EOFError('varint runs past the end of the buffer')
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def scan_messages(buf):
+    """
+    walks a packet chunk once and returns (cmd, size, offset) for every
+    message in it, offset is where the payload of the message starts
+    """
+    messages = []
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        # almost every cmd and most sizes fit in one byte
+        cmd = buf[pos]
+        if cmd & 0x80:
+            cmd, pos = read_varint(buf, pos)
+        else:
+            pos += 1
+        if pos >= end:
+            raise EOFError('message header runs past the end of the packet')
+        size = buf[pos]
+        if size & 0x80:
+            size, pos = read_varint(buf, pos)
+        else:
+            pos += 1
+        if pos + size > end:
+            raise EOFError('message runs past the end of the packet')
+        messages.append((cmd, size, pos))
+        pos += size
+    return messages
+
+
+# protobuf wire types
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+
+def skip_field(buf, pos, wire_type):
+    """returns the position after the value of a field of wire_type at pos"""
+    if wire_type == WIRE_VARINT:
+        return read_varint(buf, pos)[1]
+    if wire_type == WIRE_LENGTH_DELIMITED:
+        size, pos = read_varint(buf, pos)
+        return pos + size
+    if wire_type == WIRE_FIXED32:
+        return pos + 4
+    if wire_type == WIRE_FIXED64:
+        return pos + 8
+    raise ValueError('unsupported wire type {}'.format(wire_type))
+
+
+def find_varint_field(buf, field_number, default=None):
+    """
+    value of the first varint field with field_number in the serialized
+    message in buf, only reads as far as that field
+    """
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        tag, pos = read_varint(buf, pos)
+        if tag >> 3 == field_number and tag & 7 == WIRE_VARINT:
+            return read_varint(buf, pos)[0]
+        pos = skip_field(buf, pos, tag & 7)
+    return default
+
+
+def iter_fields(buf):
+    """
+    yields (field_number, value) for every field of the serialized message
+    in buf. Varints are ints, everything else is a memoryview slice of buf.
+    """
+    view = memoryview(buf)
+    pos = 0
+    end = len(view)
+    while pos < end:
+        tag, pos = read_varint(view, pos)
+        wire_type = tag & 7
+        if wire_type == WIRE_VARINT:
+            value, pos = read_varint(view, pos)
+        else:
+            start = pos
+            if wire_type == WIRE_LENGTH_DELIMITED:
+                size, start = read_varint(view, pos)
+                pos = start + size
+            else:
+                pos = skip_field(view, pos, wire_type)
+            if pos > end:
+                raise EOFError('field runs past the end of the message')
+            value = view[start:pos]
+        yield tag >> 3, value
+
+
+def signed(value, bits=64):
+    """negative int32/int64 fields are sent as 10 byte two's complement varints"""
+    if value >= 1 << (bits - 1):
+        value -= 1 << bits
+    return value
+
+
+class PacketEntities():
+    """
+    the fields of a CSVCMsg_PacketEntities, entity_data is a memoryview into
+    the buffer the message was read from
+    """
+    __slots__ = ('max_entries', 'updated_entries', 'is_delta', 'update_baseline',
+                 'baseline', 'delta_from', 'entity_data')
+
+    def __init__(self):
+        self.max_entries = 0
+        self.updated_entries = 0
+        self.is_delta = False
+        self.update_baseline = False
+        self.baseline = 0
+        self.delta_from = 0
+        self.entity_data = memoryview(b'')
+
+
+PACKET_ENTITIES_FIELDS = {1: 'max_entries',
+                          2: 'updated_entries',
+                          3: 'is_delta',
+                          4: 'update_baseline',
+                          5: 'baseline',
+                          6: 'delta_from',
+                          7: 'entity_data'}
+
+
+def read_packet_entities(buf):
+    """decodes a CSVCMsg_PacketEntities without copying its entity_data"""
+    msg = PacketEntities()
+    for field, value in iter_fields(buf):
+        name = PACKET_ENTITIES_FIELDS.get(field)
+        if name is None:
+            continue
+        if name in ('is_delta', 'update_baseline'):
+            value = bool(value)
+        elif name != 'entity_data':
+            value = signed(value)
+        setattr(msg, name, value)
+    return msg